@@ -8,7 +8,9 @@ setuptools.setup(
     entry_points={
         "console_scripts": [
             "spotify_crapped = spotify_crapped.main:main",
+            "spotify_crapped_benchmark = spotify_crapped.benchmark:main",
+            "spotify_crapped_batch = spotify_crapped.batch:main",
         ]
     },
-    python_requires=">=3.6",
+    python_requires=">=3.9",
 )
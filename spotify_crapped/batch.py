@@ -0,0 +1,293 @@
+"""Batch analysis of the spotify listening histories of many users across a pool of worker
+processes, writing a report for each user
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import spotify_crapped.spotify_crapped as sc
+
+
+class BatchResult(NamedTuple):
+    """Result of analysing one user's listening history
+
+    Attributes:
+        user: Name of the user
+        plays: Number of plays left after filtering
+        paths: Paths of the report files written, if any
+        report: Report tables, if they weren't written to files
+        error: Description of the error the analysis failed with, if it did
+    """
+
+    user: str
+    plays: int = 0
+    paths: Optional[List[pathlib.Path]] = None
+    report: Optional[dict] = None
+    error: Optional[str] = None
+
+
+# Settings shared by every user analysed in a worker process, set once by _init_worker
+_worker_settings: dict = {}
+
+
+def find_user_exports(exports_dir: str) -> Dict[str, List[str]]:
+    """Finds the listening history jsons of each user in a directory. Each subdirectory holds the
+    jsons of the user it's named after, and each json directly in the directory is a user of its own
+
+    Arguments:
+        exports_dir: Directory with the exports of every user
+
+    Returns:
+        Dictionary with the sorted json paths of each user, by user name
+    """
+    exports = {}
+    for entry in sorted(pathlib.Path(exports_dir).iterdir()):
+        if entry.is_dir():
+            paths = sorted(str(path) for path in entry.glob("*.json"))
+            if paths:
+                exports[entry.name] = paths
+        elif entry.suffix == ".json":
+            exports[entry.stem] = [str(entry)]
+    return exports
+
+
+def limit_memory(memory_limit: Optional[int]) -> None:
+    """Caps the address space of this process, so a user with an outsized history fails with a
+    MemoryError instead of taking the memory of every other worker. Does nothing on platforms
+    without resource limits
+
+    Arguments:
+        memory_limit: Maximum address space in bytes. Not capped if not given
+    """
+    if memory_limit is None or resource is None:
+        return
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+    if hard_limit != resource.RLIM_INFINITY:
+        memory_limit = min(memory_limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard_limit))
+    return
+
+
+def _init_worker(
+    exclusion_index: Optional[sc.PlaylistExclusionIndex],
+    include_skipped: bool,
+    top: Optional[int],
+    output_dir: Optional[str],
+    file_format: str,
+    cache_dir: Optional[str],
+    memory_limit: Optional[int],
+) -> None:
+    """Stores the settings shared by every user in a worker process and caps its memory. The
+    exclusion index is sent to each worker once rather than with every user, and is only read
+    """
+    _worker_settings.update(
+        exclusion_index=exclusion_index,
+        include_skipped=include_skipped,
+        top=top,
+        output_dir=output_dir,
+        file_format=file_format,
+        cache_dir=cache_dir,
+    )
+    limit_memory(memory_limit)
+    return
+
+
+def _analyse_user(user: str, paths: List[str]) -> BatchResult:
+    """Analyses the listening history of one user with the settings of this worker process
+
+    Arguments:
+        user: Name of the user
+        paths: Paths to the user's spotify listening history jsons
+
+    Returns:
+        Result of the analysis
+    """
+    settings = _worker_settings
+    try:
+        lh = sc.ListeningHistory(
+            cache_dir=settings["cache_dir"], aggregation_cache_size=0
+        )
+        lh.add_history_from_paths(paths, workers=1)
+        if not settings["include_skipped"]:
+            lh.add_filter(sc.NotSkippedFilter())
+        if settings["exclusion_index"] is not None:
+            lh.add_filter(sc.PlaylistFilter(settings["exclusion_index"]))
+        report = lh.get_report(settings["top"])
+        plays = len(lh.filtered_history)
+        if settings["output_dir"] is None:
+            return BatchResult(user, plays, report=report)
+        report_paths = sc.write_report(
+            report, os.path.join(settings["output_dir"], user), settings["file_format"]
+        )
+    except Exception as error:
+        # One user's malformed export or outsized history mustn't stop the rest of the batch
+        return BatchResult(user, error=f"{type(error).__name__}: {error}")
+    return BatchResult(user, plays, paths=report_paths)
+
+
+def analyse_users(
+    exports: Dict[str, List[str]],
+    output_dir: Optional[str] = None,
+    exclusion_index: Optional[sc.PlaylistExclusionIndex] = None,
+    include_skipped: bool = False,
+    top: Optional[int] = 10,
+    file_format: str = "json",
+    cache_dir: Optional[str] = None,
+    workers: Optional[int] = None,
+    memory_limit: Optional[int] = None,
+) -> Iterator[BatchResult]:
+    """Analyses the listening histories of many users across a pool of worker processes. Users
+    are handed out largest first so the pool stays busy to the end, and results are yielded as
+    they finish
+
+    Arguments:
+        exports: Dictionary with the json paths of each user, by user name
+        output_dir: Directory to write each user's report to, in a subdirectory named after the
+            user. Reports are returned in the results instead if not given
+        exclusion_index: Index of the playlist songs excluded from every user's history
+        include_skipped: Whether to include songs that were skipped
+        top: Number of ranks in each table. All are kept if None
+        file_format: Format of the written reports, one of REPORT_FORMATS
+        cache_dir: Directory to cache cleaned listening history in
+        workers: Number of worker processes. Defaults to the number of CPUs, and 1 analyses the
+            users in this process
+        memory_limit: Maximum address space of each worker process in bytes. Not capped if not
+            given, or if the users are analysed in this process
+
+    Returns:
+        Iterator over the result of each user
+    """
+    initargs = (
+        exclusion_index,
+        include_skipped,
+        top,
+        output_dir,
+        file_format,
+        cache_dir,
+    )
+    users = sorted(
+        exports,
+        key=lambda user: sum(os.path.getsize(path) for path in exports[user]),
+        reverse=True,
+    )
+    if workers == 1:
+        _init_worker(*initargs, memory_limit=None)
+        for user in users:
+            yield _analyse_user(user, exports[user])
+        return
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(*initargs, memory_limit),
+    ) as executor:
+        futures = [
+            executor.submit(_analyse_user, user, exports[user]) for user in users
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Batch spotify listening history analysis of many users"
+    )
+    parser.add_argument(
+        "exports_dir",
+        type=str,
+        help="Directory with a subdirectory of listening history jsons, or a single json, per user",
+    )
+    parser.add_argument(
+        "output_dir",
+        type=str,
+        help="Directory to write a report directory per user to",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes users are analysed in (default: all CPUs)",
+    )
+    parser.add_argument(
+        "-m",
+        "--memory-limit",
+        type=int,
+        default=None,
+        help="Maximum memory of each worker process in MiB (default: no limit)",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory to cache cleaned listening history in",
+    )
+    parser.add_argument(
+        "-e",
+        "--exclude-playlists",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Exportify playlist CSVs whose songs are excluded from every user's analysis",
+    )
+    parser.add_argument(
+        "--include-skipped",
+        action="store_true",
+        help="Include songs that were skipped",
+    )
+    parser.add_argument(
+        "-n",
+        "--top",
+        type=int,
+        default=10,
+        help="Number of artists, songs and albums in each top list (default: 10)",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=sc.REPORT_FORMATS,
+        default="json",
+        help="Format of the reports (default: json)",
+    )
+    args = parser.parse_args()
+    exclusion_index = None
+    if args.exclude_playlists:
+        exclusion_index = sc.PlaylistExclusionIndex.from_csvs(args.exclude_playlists)
+    memory_limit = None
+    if args.memory_limit is not None:
+        memory_limit = args.memory_limit << 20
+    failures = 0
+    for result in analyse_users(
+        find_user_exports(args.exports_dir),
+        args.output_dir,
+        exclusion_index,
+        args.include_skipped,
+        args.top,
+        args.format,
+        args.cache_dir,
+        args.workers,
+        memory_limit,
+    ):
+        if result.error is None:
+            print(
+                f"{result.user}: {result.plays} plays, {len(result.paths)} report files"
+            )
+        else:
+            failures += 1
+            print(f"{result.user}: failed with {result.error}", file=sys.stderr)
+    if failures:
+        sys.exit(f"{failures} users failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+"""Benchmarks for spotify listening history analysis. Generates synthetic listening history and
+times loading, filtering and aggregating it
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+import spotify_crapped.spotify_crapped as sc
+
+# Number of plays generated at a time
+GENERATOR_CHUNK_SIZE = 1 << 16
+
+# Number of plays in the history the benchmarks run on
+BENCHMARK_PLAYS = 200_000
+
+# Ratio of a benchmark's time or peak memory to its baseline above which it counts as a regression
+REGRESSION_TOLERANCE = 1.5
+
+# Slowdown below which a benchmark doesn't count as a regression, since timings that short are noisy
+REGRESSION_MIN_SECONDS = 0.01
+
+# Fields of a play in an Extended Streaming History export
+EXPORT_FIELDS = [
+    "ts",
+    "platform",
+    "ms_played",
+    "conn_country",
+    "ip_addr",
+    "master_metadata_track_name",
+    "master_metadata_album_artist_name",
+    "master_metadata_album_album_name",
+    "spotify_track_uri",
+    "episode_name",
+    "episode_show_name",
+    "spotify_episode_uri",
+    "reason_start",
+    "reason_end",
+    "shuffle",
+    "skipped",
+    "offline",
+    "offline_timestamp",
+    "incognito_mode",
+]
+
+
+#  ██████  ███████ ███    ██ ███████ ██████   █████  ████████  ██████  ██████
+# ██       ██      ████   ██ ██      ██   ██ ██   ██    ██    ██    ██ ██   ██
+# ██   ███ █████   ██ ██  ██ █████   ██████  ███████    ██    ██    ██ ██████
+# ██    ██ ██      ██  ██ ██ ██      ██   ██ ██   ██    ██    ██    ██ ██   ██
+#  ██████  ███████ ██   ████ ███████ ██   ██ ██   ██    ██     ██████  ██   ██
+
+
+def zipf_probabilities(count: int, exponent: float) -> np.ndarray:
+    """Computes the probabilities of a Zipf distribution over a finite number of ranks
+
+    Arguments:
+        count: Number of ranks
+        exponent: Exponent of the distribution. Larger exponents concentrate plays on fewer ranks
+
+    Returns:
+        Array with the probability of each rank
+    """
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_listening_history(
+    plays: int,
+    artists: int = 2000,
+    tracks_per_artist: int = 20,
+    tracks_per_album: int = 5,
+    start: str = "2018-01-01",
+    end: str = "2024-01-01",
+    podcast_share: float = 0.05,
+    skip_share: float = 0.2,
+    exponent: float = 1.1,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Generates a synthetic listening history. Artists, and tracks within an artist, are played
+    with Zipf distributed frequencies, and plays are spread evenly over a time range
+
+    Arguments:
+        plays: Number of plays to generate
+        artists: Number of artists
+        tracks_per_artist: Number of tracks of each artist
+        tracks_per_album: Number of tracks on each album
+        start: Time the plays start at
+        end: Time the plays end before
+        podcast_share: Share of plays that are podcast episodes rather than songs
+        skip_share: Share of plays that were skipped
+        exponent: Exponent of the Zipf distributions
+        seed: Seed of the random number generator
+
+    Returns:
+        DataFrame with the raw fields of an Extended Streaming History export, sorted by time
+    """
+    rng = np.random.default_rng(seed)
+    artist_ids = rng.choice(
+        artists, size=plays, p=zipf_probabilities(artists, exponent)
+    )
+    track_numbers = rng.choice(
+        tracks_per_artist, size=plays, p=zipf_probabilities(tracks_per_artist, exponent)
+    )
+    album_numbers = track_numbers // tracks_per_album
+    timestamps = np.sort(
+        rng.integers(
+            np.datetime64(start, "s").astype(np.int64),
+            np.datetime64(end, "s").astype(np.int64),
+            size=plays,
+        )
+    ).astype("datetime64[s]")
+    is_podcast = rng.random(plays) < podcast_share
+    skipped = rng.random(plays) < skip_share
+    ms_played = np.where(
+        skipped, rng.integers(0, 30_000, plays), rng.integers(90_000, 300_000, plays)
+    )
+
+    def song_field(values: np.ndarray) -> np.ndarray:
+        return np.where(is_podcast, None, values.astype(object))
+
+    artist_names = np.char.add("Artist ", artist_ids.astype(str))
+    track_keys = np.char.add(
+        np.char.add(artist_ids.astype(str), "-"), track_numbers.astype(str)
+    )
+    album_keys = np.char.add(
+        np.char.add(artist_ids.astype(str), "-"), album_numbers.astype(str)
+    )
+    track_uris = np.char.add(
+        "spotify:track:",
+        np.char.zfill((artist_ids * tracks_per_artist + track_numbers).astype(str), 22),
+    )
+    episode_numbers = rng.integers(0, 500, plays).astype(str)
+    return pd.DataFrame(
+        {
+            "ts": np.char.add(timestamps.astype(str), "Z"),
+            "platform": "android",
+            "ms_played": ms_played,
+            "conn_country": "US",
+            "ip_addr": "192.0.2.1",
+            "master_metadata_track_name": song_field(np.char.add("Track ", track_keys)),
+            "master_metadata_album_artist_name": song_field(artist_names),
+            "master_metadata_album_album_name": song_field(
+                np.char.add("Album ", album_keys)
+            ),
+            "spotify_track_uri": song_field(track_uris),
+            "episode_name": np.where(
+                is_podcast,
+                np.char.add("Episode ", episode_numbers).astype(object),
+                None,
+            ),
+            "episode_show_name": np.where(is_podcast, "Podcast", None),
+            "spotify_episode_uri": np.where(
+                is_podcast,
+                np.char.add(
+                    "spotify:episode:", np.char.zfill(episode_numbers, 22)
+                ).astype(object),
+                None,
+            ),
+            "reason_start": "trackdone",
+            "reason_end": np.where(skipped, "fwdbtn", "trackdone"),
+            "shuffle": rng.random(plays) < 0.5,
+            "skipped": skipped,
+            "offline": False,
+            "offline_timestamp": timestamps.astype(np.int64),
+            "incognito_mode": False,
+        },
+        columns=EXPORT_FIELDS,
+    )
+
+
+def generate_listening_history_json(
+    path: str,
+    plays: int,
+    start: str = "2018-01-01",
+    end: str = "2024-01-01",
+    trailing_commas: bool = True,
+    seed: int = 0,
+    **kwargs,
+) -> None:
+    """Writes a synthetic Extended Streaming History json. Plays are generated and written a chunk
+    at a time, each chunk covering its share of the time range, so histories much larger than
+    memory can be generated
+
+    Arguments:
+        path: Path of the json file
+        plays: Number of plays to generate
+        start: Time the plays start at
+        end: Time the plays end before
+        trailing_commas: Whether to leave trailing commas after the last field of some plays and
+            after the last play, like some exports do
+        seed: Seed of the random number generator
+        kwargs: Further arguments to generate_listening_history
+    """
+    rng = np.random.default_rng(seed)
+    chunk_starts = list(range(0, plays, GENERATOR_CHUNK_SIZE))
+    bounds = pd.date_range(start, end, periods=len(chunk_starts) + 1).floor("s")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("[\n")
+        for i, chunk_start in enumerate(chunk_starts):
+            chunk = generate_listening_history(
+                min(GENERATOR_CHUNK_SIZE, plays - chunk_start),
+                start=str(bounds[i]),
+                end=str(bounds[i + 1]),
+                seed=int(rng.integers(1 << 32)),
+                **kwargs,
+            )
+            has_trailing_comma = trailing_commas & (rng.random(len(chunk)) < 0.01)
+            lines = []
+            # Missing values are written as nulls rather than NaN
+            records = chunk.astype(object).where(chunk.notna(), None).to_dict("records")
+            for record, trailing_comma in zip(records, has_trailing_comma):
+                text = json.dumps(record)
+                lines.append(text[:-1] + ",}" if trailing_comma else text)
+            if i < len(chunk_starts) - 1 or trailing_commas:
+                lines.append("")
+            file.write(",\n".join(lines))
+        file.write("]\n" if trailing_commas else "\n]\n")
+    return
+
+
+# ██████  ███████ ███    ██  ██████ ██   ██ ███    ███  █████  ██████  ██   ██ ███████
+# ██   ██ ██      ████   ██ ██      ██   ██ ████  ████ ██   ██ ██   ██ ██  ██  ██
+# ██████  █████   ██ ██  ██ ██      ███████ ██ ████ ██ ███████ ██████  █████   ███████
+# ██   ██ ██      ██  ██ ██ ██      ██   ██ ██  ██  ██ ██   ██ ██   ██ ██  ██       ██
+# ██████  ███████ ██   ████  ██████ ██   ██ ██      ██ ██   ██ ██   ██ ██   ██ ███████
+
+
+def measure(function: Callable[[], object], repeat: int = 3) -> Dict[str, float]:
+    """Times a function and measures the peak memory it allocates. The time is the best of a number
+    of runs, and memory is measured on a run of its own since tracing allocations slows it down
+
+    Arguments:
+        function: Function to measure
+        repeat: Number of times to time the function
+
+    Returns:
+        Dictionary with the seconds the function took and the peak bytes it allocated
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_bytes": peak_bytes}
+
+
+def add_history(raw_history: pd.DataFrame) -> pd.DataFrame:
+    """Adds a raw listening history to a new ListeningHistory and merges it
+
+    Arguments:
+        raw_history: DataFrame with raw listening history data
+
+    Returns:
+        DataFrame with the merged listening history
+    """
+    lh = sc.ListeningHistory()
+    lh.add_history(raw_history)
+    return lh.listening_history
+
+
+def run_benchmarks(
+    plays: int = BENCHMARK_PLAYS,
+    repeat: int = 3,
+    seed: int = 0,
+    directory: Optional[str] = None,
+) -> Dict[str, Dict[str, float]]:
+    """Benchmarks reading, adding, filtering and aggregating a synthetic listening history
+
+    Arguments:
+        plays: Number of plays in the listening history
+        repeat: Number of times to time each benchmark
+        seed: Seed of the synthetic listening history
+        directory: Directory the listening history json is written to. A temporary directory is
+            used if not given
+
+    Returns:
+        Dictionary with the seconds and peak bytes of each benchmark
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        path = str(pathlib.Path(temp_dir) / "listening_history.json")
+        generate_listening_history_json(path, plays, seed=seed)
+        raw_history = sc.read_listening_history_json(path)
+        # Aggregations aren't cached, so every call is measured
+        lh = sc.ListeningHistory(aggregation_cache_size=0)
+        lh.add_history(raw_history)
+        history = lh.listening_history
+        # Time filters are measured both through the time index and by checking every row
+        time_index = lh.time_index
+        top_artists = list(
+            history["master_metadata_album_artist_name"].value_counts().index[:10]
+        )
+        year = int(history["ts"].iloc[len(history) // 2].year)
+        playlist = sc.decategorize_fields(
+            history.drop_duplicates("track_id")
+            .sample(min(100, len(history)), random_state=seed)[
+                [
+                    "master_metadata_track_name",
+                    "master_metadata_album_artist_name",
+                    "spotify_track_uri",
+                ]
+            ]
+            .reset_index(drop=True)
+        )
+        benchmarks = {
+            "read_listening_history_json": lambda: sc.read_listening_history_json(path),
+            "add_history": lambda: add_history(raw_history),
+            "filter_by_song_title": lambda: sc.filter_by_song_title(
+                history, "track 1-"
+            ),
+            "filter_by_artists": lambda: sc.filter_by_artists(history, top_artists),
+            "filter_by_not_skipped": lambda: sc.filter_by_not_skipped(history),
+            "filter_by_years": lambda: sc.filter_by_years(history, [year], time_index),
+            "filter_by_years_full_scan": lambda: sc.filter_by_years(history, [year]),
+            "filter_by_date_range": lambda: sc.filter_by_date_range(
+                history, f"{year}-03-01", f"{year}-09-01", time_index
+            ),
+            "filter_by_date_range_full_scan": lambda: sc.filter_by_date_range(
+                history, f"{year}-03-01", f"{year}-09-01"
+            ),
+            "filter_playlist_from_history": lambda: sc.filter_playlist_from_history(
+                history, playlist
+            ),
+            "get_top_artists_by_count": lh.get_top_artists_by_count,
+            "get_top_artists_by_playtime": lh.get_top_artists_by_playtime,
+            "get_top_songs_by_count": lh.get_top_songs_by_count,
+            "get_top_albums_by_count": lh.get_top_albums_by_count,
+        }
+        return {
+            name: measure(function, repeat) for name, function in benchmarks.items()
+        }
+
+
+def compare_with_baseline(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float = REGRESSION_TOLERANCE,
+) -> Dict[str, Dict[str, float]]:
+    """Finds the benchmarks that regressed from a baseline
+
+    Arguments:
+        results: Dictionary with the seconds and peak bytes of each benchmark
+        baseline: Results of an earlier run of the benchmarks
+        tolerance: Ratio of a measurement to its baseline above which it counts as a regression
+
+    Returns:
+        Dictionary with the ratio to the baseline of each measurement that regressed, by benchmark
+    """
+    regressions = {}
+    for name, measurements in results.items():
+        for measurement, value in measurements.items():
+            baseline_value = baseline.get(name, {}).get(measurement)
+            if not baseline_value or value / baseline_value <= tolerance:
+                continue
+            if (
+                measurement != "seconds"
+                or value - baseline_value > REGRESSION_MIN_SECONDS
+            ):
+                regressions.setdefault(name, {})[measurement] = value / baseline_value
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks spotify listening history analysis"
+    )
+    parser.add_argument(
+        "-p",
+        "--plays",
+        type=int,
+        default=BENCHMARK_PLAYS,
+        help=f"Number of plays in the synthetic listening history (default: {BENCHMARK_PLAYS})",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to time each benchmark (default: 3)",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the synthetic listening history",
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        type=str,
+        help="Json file with baseline results to compare the results with",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Save the results to the baseline file instead of comparing with it",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=REGRESSION_TOLERANCE,
+        help="Ratio to the baseline above which a benchmark has regressed "
+        f"(default: {REGRESSION_TOLERANCE})",
+    )
+    parser.add_argument(
+        "-g",
+        "--generate",
+        type=str,
+        help="Only write a synthetic listening history json to this path",
+    )
+    args = parser.parse_args()
+    if args.generate:
+        generate_listening_history_json(args.generate, args.plays, seed=args.seed)
+        return
+
+    results = run_benchmarks(args.plays, args.repeat, args.seed)
+    print(pd.DataFrame(results).T)
+    if not args.baseline:
+        return
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump({"plays": args.plays, "results": results}, file, indent=2)
+        return
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    if baseline["plays"] != args.plays:
+        sys.exit(
+            f"Baseline was measured on {baseline['plays']} plays, not {args.plays}"
+        )
+    regressions = compare_with_baseline(results, baseline["results"], args.tolerance)
+    if regressions:
+        print("Regressions (ratio to baseline):")
+        print(pd.DataFrame(regressions).T)
+        sys.exit(1)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import argparse
 
+import pandas as pd
+
 import spotify_crapped.spotify_crapped as sc
 from spotify_crapped.spotify_crapped import ListeningHistory
 
@@ -12,16 +14,83 @@ def main():
         help="One or more spotify listening history json files",
         nargs="+",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes used to read the listening history jsons (default: all CPUs)",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory to cache cleaned listening history in",
+    )
+    parser.add_argument(
+        "-e",
+        "--exclude-playlists",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Exportify playlist CSVs whose songs are excluded from the analysis",
+    )
+    parser.add_argument(
+        "--include-skipped",
+        action="store_true",
+        help="Include songs that were skipped",
+    )
+    parser.add_argument(
+        "-n",
+        "--top",
+        type=int,
+        default=10,
+        help="Number of artists, songs and albums in each top list (default: 10)",
+    )
+    parser.add_argument(
+        "-r",
+        "--report",
+        type=str,
+        default=None,
+        help="Write the top lists of every year and of all time to this directory instead of "
+        "printing the all time top lists",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=sc.REPORT_FORMATS,
+        default="json",
+        help="Format of the report (default: json)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time, rows and memory of each stage of the analysis",
+    )
     args = parser.parse_args()
-    lh = ListeningHistory()
-    for path in args.listening_history_jsons:
-        lh.add_history(path)
-    lh.add_filter(sc.filter_by_not_skipped(lh.listening_history))
-    pretty_fields = sc.prettify_fields(lh.filtered_history)
-    deep_sleep = sc.read_playlist_from_csv(
-        "/home/rzyxl1/git/spotify_crapped/tests/data/deep_sleep.csv"
-    )
-    print(deep_sleep)
+    lh = ListeningHistory(cache_dir=args.cache_dir, profile=args.profile)
+    lh.add_history_from_paths(args.listening_history_jsons, workers=args.workers)
+    if not args.include_skipped:
+        lh.add_filter(sc.NotSkippedFilter())
+    if args.exclude_playlists:
+        lh.add_filter(
+            sc.PlaylistFilter(
+                sc.PlaylistExclusionIndex.from_csvs(args.exclude_playlists)
+            )
+        )
+    report = lh.get_report(args.top)
+    if args.report:
+        paths = sc.write_report(report, args.report, args.format)
+        print(f"Wrote {len(paths)} report files to {args.report}")
+    else:
+        for name, table in report["all_time"].items():
+            if isinstance(table, pd.Series):
+                table = table.reset_index()
+            print(name.replace("_", " ").capitalize())
+            print(sc.prettify_fields(table).to_string(index=False))
+    if args.profile:
+        print(lh.stats)
 
 
 if __name__ == "__main__":
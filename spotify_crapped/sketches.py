@@ -0,0 +1,406 @@
+"""Streaming sketches for approximate top lists of spotify listening history. Sketches take a fixed
+amount of memory however many plays they count, and can be merged across files and processes
+"""
+
+import functools
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import spotify_crapped.spotify_crapped as sc
+
+# Default share of all plays a sketched play count can be off by
+SKETCH_EPSILON = 1e-4
+
+# Default probability that a Count-Min estimate is off by more than its error bound
+SKETCH_DELTA = 1e-3
+
+# Fields that label the tracks counted by a TrackSketch
+TRACK_LABEL_FIELDS = ["master_metadata_track_name", "master_metadata_album_artist_name"]
+
+
+class CountMinSketch:
+    """Count-Min sketch of the counts of 64 bit keys. Estimates never undercount, and overcount by
+    at most epsilon times the total count with probability 1 - delta
+
+    Arguments:
+        width: Number of counters in each row. The error bound epsilon is e / width
+        depth: Number of rows, each with its own hash function. The failure probability delta is
+            e ** -depth
+        seed: Seed of the hash functions. Only sketches with the same seed and size can be merged
+    """
+
+    def __init__(self, width: int, depth: int, seed: int = 0):
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # Odd multipliers and offsets of the multiply-shift hash function of each row
+        self._multipliers = rng.integers(
+            1 << 62, size=depth, dtype=np.uint64
+        ) * np.uint64(2) + np.uint64(1)
+        self._offsets = rng.integers(1 << 62, size=depth, dtype=np.uint64)
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        return
+
+    @classmethod
+    def from_error(
+        cls, epsilon: float = SKETCH_EPSILON, delta: float = SKETCH_DELTA, seed: int = 0
+    ) -> "CountMinSketch":
+        """Creates a sketch just large enough for an error bound
+
+        Arguments:
+            epsilon: Share of the total count an estimate can be off by
+            delta: Probability that an estimate is off by more than that
+            seed: Seed of the hash functions
+
+        Returns:
+            Empty sketch
+        """
+        return cls(math.ceil(math.e / epsilon), math.ceil(math.log(1 / delta)), seed)
+
+    @property
+    def epsilon(self) -> float:
+        """Share of the total count an estimate can be off by"""
+        return math.e / self.width
+
+    @property
+    def delta(self) -> float:
+        """Probability that an estimate is off by more than epsilon times the total count"""
+        return math.exp(-self.depth)
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    def _columns(self, keys: np.ndarray) -> np.ndarray:
+        """Hashes keys to a counter of each row
+
+        Arguments:
+            keys: Array of 64 bit keys
+
+        Returns:
+            Array with the column of each key in each row
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        hashes = keys[np.newaxis, :] * self._multipliers[:, np.newaxis]
+        hashes += self._offsets[:, np.newaxis]
+        return (hashes >> np.uint64(32)) % np.uint64(self.width)
+
+    def add(self, keys: np.ndarray, counts: Optional[np.ndarray] = None) -> None:
+        """Counts keys
+
+        Arguments:
+            keys: Array of 64 bit keys
+            counts: Array with the count of each key. Each key is counted once if not given
+        """
+        counts = np.ones(len(keys), dtype=np.int64) if counts is None else counts
+        columns = self._columns(keys)
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts)
+        self.total += int(np.sum(counts))
+        return
+
+    def estimate(self, keys: np.ndarray) -> np.ndarray:
+        """Estimates the counts of keys
+
+        Arguments:
+            keys: Array of 64 bit keys
+
+        Returns:
+            Array with the estimated count of each key
+        """
+        columns = self._columns(keys)
+        return self.table[np.arange(self.depth)[:, np.newaxis], columns].min(axis=0)
+
+    def merge(self, other: "CountMinSketch") -> None:
+        """Adds the counts of another sketch of the same size and seed
+
+        Arguments:
+            other: Sketch to add
+        """
+        if (self.width, self.depth, self.seed) != (
+            other.width,
+            other.depth,
+            other.seed,
+        ):
+            raise ValueError("Only sketches with the same size and seed can be merged")
+        self.table += other.table
+        self.total += other.total
+        return
+
+
+class SpaceSaving:
+    """Space-Saving summary of the most frequent of a stream of 64 bit keys, with labels for the
+    keys it monitors. Counters are kept in the equivalent Misra-Gries form, which merges with the
+    same guarantee: each count undercounts its key by at most error_bound, and keys that aren't
+    monitored occurred at most error_bound times
+
+    Arguments:
+        capacity: Number of keys monitored. The error bound is at most the total count divided by
+            capacity + 1
+        label_fields: Names of the labels kept for each key
+    """
+
+    def __init__(self, capacity: int, label_fields: Iterable[str] = ()):
+        self.capacity = capacity
+        self.label_fields = list(label_fields)
+        self.counters = pd.DataFrame(
+            {"count": pd.Series(dtype=np.int64)}
+            | {field: pd.Series(dtype=object) for field in self.label_fields},
+            index=pd.Index([], dtype=np.uint64, name="key"),
+        )
+        self.total = 0
+        return
+
+    @classmethod
+    def from_error(
+        cls, epsilon: float = SKETCH_EPSILON, label_fields: Iterable[str] = ()
+    ) -> "SpaceSaving":
+        """Creates a summary just large enough for an error bound
+
+        Arguments:
+            epsilon: Share of the total count a count can be off by
+            label_fields: Names of the labels kept for each key
+
+        Returns:
+            Empty summary
+        """
+        return cls(math.ceil(1 / epsilon), label_fields)
+
+    @property
+    def error_bound(self) -> float:
+        """Most a count can be off by, which is the count discarded to stay within capacity
+        spread over capacity + 1 keys
+        """
+        return (self.total - int(self.counters["count"].sum())) / (self.capacity + 1)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.counters.memory_usage(deep=True).sum())
+
+    def _combine(self, counters: pd.DataFrame, total: int) -> None:
+        """Adds counters to these and keeps the capacity largest, discounting all of them by the
+        count of the first one dropped
+
+        Arguments:
+            counters: Counters to add, indexed by key
+            total: Total count the counters summarize
+        """
+        combined = pd.concat([self.counters, counters])
+        if combined.index.has_duplicates:
+            combined = combined.groupby(level=0, sort=False).agg(
+                {"count": "sum"} | {field: "first" for field in self.label_fields}
+            )
+        if len(combined) > self.capacity:
+            counts = combined["count"].to_numpy()
+            discount = np.partition(counts, len(counts) - self.capacity - 1)[
+                len(counts) - self.capacity - 1
+            ]
+            combined = combined.assign(count=counts - discount)
+            combined = combined[combined["count"].to_numpy() > 0]
+        self.counters = combined
+        self.total += total
+        return
+
+    def add(
+        self,
+        keys: np.ndarray,
+        counts: Optional[np.ndarray] = None,
+        labels: Optional[pd.DataFrame] = None,
+    ) -> None:
+        """Counts keys
+
+        Arguments:
+            keys: Array of 64 bit keys
+            counts: Array with the count of each key. Each key is counted once if not given
+            labels: DataFrame with the label fields of each key
+        """
+        counts = np.ones(len(keys), dtype=np.int64) if counts is None else counts
+        counters = pd.DataFrame(
+            {"count": counts}, index=pd.Index(keys, dtype=np.uint64, name="key")
+        )
+        for field in self.label_fields:
+            counters[field] = labels[field].to_numpy(dtype=object)
+        self._combine(counters, int(np.sum(counts)))
+        return
+
+    def merge(self, other: "SpaceSaving") -> None:
+        """Adds the counts of another summary
+
+        Arguments:
+            other: Summary to add
+        """
+        self._combine(other.counters, other.total)
+        return
+
+
+class TrackSketch:
+    """Approximate play counts of songs in a fixed amount of memory. A Space-Saving summary finds
+    the most played songs and bounds their play counts, and a Count-Min sketch estimates the play
+    counts within those bounds. Songs are keyed by their track and artist name, like the song IDs
+    of a Catalog, so plays of one song under several URIs are counted together as they are by
+    sort_songs_by_play_count
+
+    Arguments:
+        epsilon: Share of all plays a play count can be off by
+        delta: Probability that a Count-Min estimate is off by more than epsilon of all plays
+        seed: Seed of the Count-Min hash functions. Only sketches with the same settings can be
+            merged
+    """
+
+    def __init__(
+        self,
+        epsilon: float = SKETCH_EPSILON,
+        delta: float = SKETCH_DELTA,
+        seed: int = 0,
+    ):
+        self.space_saving = SpaceSaving.from_error(epsilon, TRACK_LABEL_FIELDS)
+        self.count_min = CountMinSketch.from_error(epsilon, delta, seed)
+        return
+
+    @property
+    def total(self) -> int:
+        """Number of plays counted"""
+        return self.space_saving.total
+
+    @property
+    def nbytes(self) -> int:
+        return self.space_saving.nbytes + self.count_min.nbytes
+
+    def add_history(self, listening_history: pd.DataFrame) -> None:
+        """Counts the plays of a cleaned listening history. Plays are counted by song before being
+        added to the sketches, so each distinct song of the history is only hashed once
+
+        Arguments:
+            listening_history: Cleaned DataFrame with listening history data
+        """
+        songs = (
+            listening_history[TRACK_LABEL_FIELDS]
+            .astype(object)
+            .value_counts(sort=False)
+            .reset_index()
+        )
+        keys = sc.hash_songs(
+            songs["master_metadata_track_name"],
+            songs["master_metadata_album_artist_name"],
+        )
+        counts = songs["count"].to_numpy(dtype=np.int64)
+        self.space_saving.add(keys, counts, songs)
+        self.count_min.add(keys, counts)
+        return
+
+    def add_path(self, path: str, chunk_rows: int = sc.HISTORY_CHUNK_ROWS) -> None:
+        """Reads a spotify listening history json a chunk at a time and counts its plays
+
+        Arguments:
+            path: Path to a spotify listening history json
+            chunk_rows: Number of records read at a time
+        """
+        for chunk in sc.iter_listening_history_chunks(
+            path, chunk_rows, parse_timestamps=True
+        ):
+            if len(chunk):
+                self.add_history(sc.clean_listening_history(chunk))
+        return
+
+    def merge(self, other: "TrackSketch") -> None:
+        """Adds the plays counted by another sketch with the same settings
+
+        Arguments:
+            other: Sketch to add
+        """
+        self.count_min.merge(other.count_min)
+        self.space_saving.merge(other.space_saving)
+        return
+
+    def top(self, top: int = 10) -> pd.DataFrame:
+        """Returns the approximate top songs by play count. Each song's true play count is between
+        its play_count_lower and play_count_upper, and its play_count estimate is off by at most
+        count_min_error with probability count_min_confidence. These guarantees and the total
+        number of plays are in the attrs of the result
+
+        Arguments:
+            top: Number of ranks to return, including every song tied with the last one
+
+        Returns:
+            DataFrame sorted by estimated song play count
+        """
+        counters = self.space_saving.counters
+        error_bound = self.space_saving.error_bound
+        lower = counters["count"].to_numpy()
+        upper = lower + math.floor(error_bound)
+        estimate = np.clip(
+            self.count_min.estimate(counters.index.to_numpy()), lower, upper
+        )
+        songs = pd.DataFrame(
+            {
+                "master_metadata_track_name": counters["master_metadata_track_name"],
+                "master_metadata_album_artist_name": counters[
+                    "master_metadata_album_artist_name"
+                ],
+                "play_count": estimate,
+                "play_count_lower": lower,
+                "play_count_upper": upper,
+            }
+        ).take(sc.top_positions(estimate, top))
+        songs.insert(0, "rank", songs["play_count"].rank(ascending=False, method="min"))
+        songs = songs.sort_values(
+            by=["rank", "master_metadata_track_name"], kind="stable"
+        ).reset_index(drop=True)
+        songs.attrs = {
+            "total_plays": self.total,
+            "max_error": error_bound,
+            "count_min_error": self.count_min.epsilon * self.count_min.total,
+            "count_min_confidence": 1 - self.count_min.delta,
+        }
+        return songs
+
+
+def _sketch_path(
+    path: str, epsilon: float, delta: float, chunk_rows: int
+) -> TrackSketch:
+    """Sketches the plays of a spotify listening history json. Used by worker processes"""
+    sketch = TrackSketch(epsilon, delta)
+    sketch.add_path(path, chunk_rows)
+    return sketch
+
+
+def sketch_listening_history_paths(
+    paths: Iterable[str],
+    epsilon: float = SKETCH_EPSILON,
+    delta: float = SKETCH_DELTA,
+    chunk_rows: int = sc.HISTORY_CHUNK_ROWS,
+    workers: Optional[int] = None,
+) -> TrackSketch:
+    """Sketches the plays of spotify listening history jsons in parallel across a pool of
+    processes, and merges the sketches
+
+    Arguments:
+        paths: Paths to spotify listening history jsons
+        epsilon: Share of all plays a play count can be off by
+        delta: Probability that a Count-Min estimate is off by more than epsilon of all plays
+        chunk_rows: Number of records read at a time
+        workers: Number of worker processes. Defaults to the number of CPUs, and 1 reads the files
+            in this process
+
+    Returns:
+        Merged sketch of all of the listening histories
+    """
+    paths: List[str] = list(paths)
+    sketch = functools.partial(
+        _sketch_path, epsilon=epsilon, delta=delta, chunk_rows=chunk_rows
+    )
+    if workers == 1 or len(paths) <= 1:
+        parts = map(sketch, paths)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(sketch, paths))
+    merged = TrackSketch(epsilon, delta)
+    for part in parts:
+        merged.merge(part)
+    return merged
@@ -1,12 +1,244 @@
 """Module for interactig with spotify listening history. Imports a JSON file with listening history
 """
 
+import collections
+import functools
+import hashlib
 import json
+import os
+import pathlib
 import re
-from typing import List
-
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Union,
+)
+
+import numpy as np
 import pandas as pd
 
+# Number of characters read from a listening history file at a time
+JSON_CHUNK_SIZE = 1 << 16
+
+# Number of records in each chunk of listening history aggregated out of core
+HISTORY_CHUNK_ROWS = 1 << 17
+
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([\]}])")
+SEPARATOR_PATTERN = re.compile(r"[\s,]*")
+
+# Decoding errors this close to the end of the text read so far may be caused by a token cut off
+# by the end of it, such as a partial number, literal or escape, rather than by a malformed record
+TRUNCATED_TOKEN_LENGTH = 16
+
+# Layout of the UTC timestamps of spotify listening history, such as 2023-01-31T12:34:56Z
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+TIMESTAMP_WIDTH = 20
+
+# Byte positions of the year, month, day, hour, minute and second digits of a timestamp
+TIMESTAMP_FIELD_POSITIONS = [(0, 4), (5, 7), (8, 10), (11, 13), (14, 16), (17, 19)]
+
+# Separator bytes of a timestamp by position
+TIMESTAMP_SEPARATORS = {4: "-", 7: "-", 10: "T", 13: ":", 16: ":", 19: "Z"}
+
+# Days in each month of a common year
+MONTH_LENGTHS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+# Number of aggregation results a ListeningHistory keeps by default
+AGGREGATION_CACHE_SIZE = 32
+
+# Histories with more rows than this estimate how selective their filters are on a sample of rows
+FILTER_SAMPLE_SIZE = 1024
+
+# Version of the cleaned listening history layout stored in the history cache. Bump this whenever
+# the cleaning pipeline changes what it produces so stale cache entries are ignored
+CACHE_SCHEMA_VERSION = 3
+
+# Human-readable names of listening history fields
+PRETTY_FIELD_NAMES = {
+    "ts": "Timestamp",
+    "master_metadata_track_name": "Track",
+    "master_metadata_album_artist_name": "Artist",
+    "master_metadata_album_album_name": "Album",
+    "ms_played": "Playtime (ms)",
+    "play_count": "Play Count",
+}
+
+# Number of rows in a page of listening history shown at a time
+PAGE_SIZE = 100
+
+# Fields listening history is rolled up by
+ROLLUP_FIELDS = ["ts", "artist_id", "album_id", "track_id", "skipped"]
+
+# Compact data types of the cleaned listening history fields. Names are stored as categoricals so
+# they're held once and grouped by their integer codes
+HISTORY_SCHEMA = {
+    "master_metadata_track_name": "category",
+    "master_metadata_album_artist_name": "category",
+    "master_metadata_album_album_name": "category",
+    "spotify_track_uri": "category",
+    "ms_played": "int32",
+    "skipped": "boolean",
+}
+
+# ███████ ████████  █████  ████████ ███████
+# ██         ██    ██   ██    ██    ██
+# ███████    ██    ███████    ██    ███████
+#      ██    ██    ██   ██    ██         ██
+# ███████    ██    ██   ██    ██    ███████
+
+
+StageStats = collections.namedtuple(
+    "StageStats", ["stage", "seconds", "rows_in", "rows_out", "allocated_bytes"]
+)
+
+
+class PipelineStats:
+    """Wall time, rows in and out, and allocated bytes of each stage run while loading, filtering
+    and aggregating listening history. Stages can run other stages, so a stage's time and memory
+    include those of the stages it runs
+
+    Arguments:
+        trace_memory: Whether to trace the memory allocated by each stage with tracemalloc, which
+            slows stages down
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages: List[StageStats] = []
+        # Memory traced at the start of each running stage and the peak traced since
+        self._frames: List[List[int]] = []
+        return
+
+    def __len__(self) -> int:
+        return len(self.stages)
+
+    def __repr__(self):
+        return repr(self.summary())
+
+    def record(
+        self,
+        stage: str,
+        seconds: float,
+        rows_in: Optional[int] = None,
+        rows_out: Optional[int] = None,
+        allocated_bytes: Optional[int] = None,
+    ) -> None:
+        """Records the stats of a stage that was measured elsewhere
+
+        Arguments:
+            stage: Name of the stage
+            seconds: Wall time the stage took
+            rows_in: Number of rows the stage was given
+            rows_out: Number of rows the stage returned
+            allocated_bytes: Peak memory allocated by the stage
+        """
+        self.stages.append(
+            StageStats(stage, seconds, rows_in, rows_out, allocated_bytes)
+        )
+        return
+
+    def extend(self, other: "PipelineStats") -> None:
+        """Adds the stages recorded by another object, such as one filled in a worker process
+
+        Arguments:
+            other: Stats to add
+        """
+        self.stages.extend(other.stages)
+        return
+
+    def run(self, stage: str, function: Callable, *args, **kwargs):
+        """Runs a stage and records its stats. Rows are counted when the stage is given a
+        DataFrame as its first argument or returns one
+
+        Arguments:
+            stage: Name of the stage
+            function: Function that runs the stage
+            args: Arguments of the function
+            kwargs: Keyword arguments of the function
+
+        Returns:
+            Result of the function
+        """
+        rows_in = len(args[0]) if args and isinstance(args[0], pd.DataFrame) else None
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._frames:
+                self._frames[-1][1] = max(self._frames[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._frames.append([current, current])
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            allocated_bytes = None
+            if self.trace_memory:
+                start_bytes, peak = self._frames.pop()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if self._frames:
+                    self._frames[-1][1] = max(self._frames[-1][1], peak)
+                allocated_bytes = peak - start_bytes
+            if started_tracing:
+                tracemalloc.stop()
+        rows_out = (
+            len(result) if isinstance(result, (pd.DataFrame, pd.Series)) else None
+        )
+        self.record(stage, seconds, rows_in, rows_out, allocated_bytes)
+        return result
+
+    def summary(self) -> pd.DataFrame:
+        """Summarizes the recorded stats by stage
+
+        Returns:
+            DataFrame with the number of runs, total wall time, total rows in and out and the
+            largest allocation of each stage, in the order the stages first ran
+        """
+        stages = pd.DataFrame(self.stages, columns=StageStats._fields).astype(
+            {"rows_in": "Int64", "rows_out": "Int64", "allocated_bytes": "Int64"}
+        )
+        return stages.groupby("stage", sort=False).agg(
+            runs=("seconds", "size"),
+            seconds=("seconds", "sum"),
+            rows_in=("rows_in", lambda rows: rows.sum(min_count=1)),
+            rows_out=("rows_out", lambda rows: rows.sum(min_count=1)),
+            allocated_bytes=("allocated_bytes", "max"),
+        )
+
+
+def run_stage(
+    stats: Optional[PipelineStats], stage: str, function: Callable, *args, **kwargs
+):
+    """Runs a stage, recording its stats if given an object to record them in
+
+    Arguments:
+        stats: Stats to record the stage in. The stage is just run if not given
+        stage: Name of the stage
+        function: Function that runs the stage
+        args: Arguments of the function
+        kwargs: Keyword arguments of the function
+
+    Returns:
+        Result of the function
+    """
+    if stats is None:
+        return function(*args, **kwargs)
+    return stats.run(stage, function, *args, **kwargs)
+
+
 #  ██     ██  ██████      ███    ███ ███████ ████████ ██   ██  ██████  ██████  ███████
 #  ██    ██  ██    ██     ████  ████ ██         ██    ██   ██ ██    ██ ██   ██ ██
 #  ██   ██   ██    ██     ██ ████ ██ █████      ██    ███████ ██    ██ ██   ██ ███████
@@ -14,41 +246,255 @@ import pandas as pd
 #  ██ ██      ██████      ██      ██ ███████    ██    ██   ██  ██████  ██████  ███████
 
 
-def read_listening_history_json(path: str) -> pd.DataFrame:
-    """Reads a JSON file with listening history data, removes malformed trailing commas,
-    and returns a pandas DataFrame
+def _iter_repaired_text(
+    file: TextIO, chunk_size: int, stats: Optional[PipelineStats] = None
+) -> Iterator[str]:
+    """Reads a text file in chunks and removes malformed trailing commas from each chunk
+
+    A comma followed only by whitespace at the end of a chunk is carried over to the next one, so
+    trailing commas that straddle a chunk boundary are still removed
+
+    Arguments:
+        file: Open text file to read from
+        chunk_size: Number of characters to read at a time
+        stats: Stats to record the time spent removing trailing commas in
+
+    Returns:
+        Iterator over the repaired chunks
+    """
+    carry = ""
+    seconds = 0.0
+    try:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            start = time.perf_counter()
+            text = carry + chunk
+            stripped = text.rstrip()
+            split = len(stripped) - 1 if stripped.endswith(",") else len(text)
+            carry = text[split:]
+            repaired = TRAILING_COMMA_PATTERN.sub(r"\1", text[:split])
+            seconds += time.perf_counter() - start
+            yield repaired
+        if carry:
+            yield TRAILING_COMMA_PATTERN.sub(r"\1", carry)
+    finally:
+        # Parsing usually stops before the end of the file is read
+        if stats is not None:
+            stats.record("repair_trailing_commas", seconds)
+
+
+def _is_truncated(error: json.JSONDecodeError) -> bool:
+    """Checks whether an error decoding a record may only be caused by the record being cut off at
+    the end of the text read so far, so reading more of the file could complete it
+
+    Arguments:
+        error: Error raised decoding the record
+
+    Returns:
+        Whether the record may be incomplete rather than malformed
     """
+    # Unterminated strings are reported where they start, however long they run
+    if error.msg.startswith("Unterminated string"):
+        return True
+    return len(error.doc) - error.pos < TRUNCATED_TOKEN_LENGTH
+
+
+def iter_listening_history_records(
+    path: str,
+    chunk_size: int = JSON_CHUNK_SIZE,
+    stats: Optional[PipelineStats] = None,
+) -> Iterator[dict]:
+    """Incrementally parses a JSON file with listening history data, removing malformed trailing
+    commas, and yields one record at a time
+
+    Arguments:
+        path: Path to a spotify listening history json
+        chunk_size: Number of characters to read from the file at a time
+        stats: Stats to record the time spent removing trailing commas in
+
+    Returns:
+        Iterator over the records in the listening history
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    # Number of characters dropped from the front of the buffer
+    offset = 0
+    opened = False
     with open(path, "r", encoding="UTF-8") as file:
-        raw_data = file.read()
+        for chunk in _iter_repaired_text(file, chunk_size, stats):
+            buffer = buffer[position:] + chunk
+            offset += position
+            position = 0
+            if not opened:
+                position = SEPARATOR_PATTERN.match(buffer).end()
+                if position == len(buffer):
+                    continue
+                if buffer[position] != "[":
+                    raise json.JSONDecodeError(
+                        "Expected a listening history array", buffer, position
+                    )
+                opened = True
+                position += 1
+            while True:
+                position = SEPARATOR_PATTERN.match(buffer, position).end()
+                if position == len(buffer):
+                    break
+                if buffer[position] == "]":
+                    return
+                try:
+                    record, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as error:
+                    if _is_truncated(error):
+                        # The record is incomplete, read more of the file
+                        break
+                    raise json.JSONDecodeError(
+                        f"{error.msg} at character {offset + error.pos} of {path}",
+                        error.doc,
+                        error.pos,
+                    ) from None
+                yield record
+
+    position = SEPARATOR_PATTERN.match(buffer, position).end()
+    if position < len(buffer):
+        # Re-raise the decoding error for the malformed record
+        decoder.raw_decode(buffer, position)
+    raise json.JSONDecodeError("Unterminated listening history array", buffer, position)
+
+
+def iter_listening_history_chunks(
+    path: str,
+    chunk_rows: Optional[int] = HISTORY_CHUNK_ROWS,
+    columns: Optional[Iterable[str]] = None,
+    chunk_size: int = JSON_CHUNK_SIZE,
+    stats: Optional[PipelineStats] = None,
+    parse_timestamps: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """Reads a JSON file with listening history data, removing malformed trailing commas, and
+    yields it as DataFrames of a number of records each
+
+    Records are parsed one at a time and their fields are appended directly to column buffers, so
+    the whole file is never held in memory as a string or as a list of dictionaries
+
+    Arguments:
+        path: Path to a spotify listening history json
+        chunk_rows: Number of records in each DataFrame. All records are read into one DataFrame
+            if None
+        columns: Fields to keep. All fields are kept if not given
+        chunk_size: Number of characters to read from the file at a time
+        stats: Stats to record the time spent removing trailing commas and decoding timestamps in
+        parse_timestamps: Whether to decode the timestamps straight from the column buffer with
+            decode_timestamps, rather than leaving them as strings
+
+    Returns:
+        Iterator over DataFrames with the listening history data. A single empty DataFrame is
+        yielded for an empty listening history
+    """
+    wanted = None if columns is None else set(columns)
+    buffers: Dict[str, list] = {}
+    row_count = 0
+    yielded = False
+
+    def to_dataframe(buffers: Dict[str, list]) -> pd.DataFrame:
+        if parse_timestamps and "ts" in buffers:
+            buffers["ts"] = run_stage(
+                stats, "decode_timestamps", decode_timestamps, buffers["ts"]
+            )
+        return pd.DataFrame(buffers)
+
+    for record in iter_listening_history_records(path, chunk_size, stats):
+        appended = 0
+        for key, value in record.items():
+            column = buffers.get(key)
+            if column is None:
+                if wanted is not None and key not in wanted:
+                    continue
+                column = buffers[key] = [None] * row_count
+            column.append(value)
+            appended += 1
+        row_count += 1
+        if appended != len(buffers):
+            # Fill in fields missing from this record
+            for column in buffers.values():
+                if len(column) < row_count:
+                    column.append(None)
+        if row_count == chunk_rows:
+            yield to_dataframe(buffers)
+            yielded = True
+            buffers = {}
+            row_count = 0
+    if row_count or not yielded:
+        yield to_dataframe(buffers)
+
+
+def read_listening_history_json(
+    path: str,
+    columns: Optional[Iterable[str]] = None,
+    chunk_size: int = JSON_CHUNK_SIZE,
+    stats: Optional[PipelineStats] = None,
+    parse_timestamps: bool = False,
+) -> pd.DataFrame:
+    """Reads a JSON file with listening history data, removes malformed trailing commas,
+    and returns a pandas DataFrame
 
-    cleaned_data = re.sub(r",\s*([\]}])", r"\1", raw_data)
+    Records are parsed one at a time and their fields are appended directly to column buffers, so
+    the whole file is never held in memory as a string or as a list of dictionaries
+
+    Arguments:
+        path: Path to a spotify listening history json
+        columns: Fields to keep. All fields are kept if not given
+        chunk_size: Number of characters to read from the file at a time
+        stats: Stats to record the time spent removing trailing commas and decoding timestamps in
+        parse_timestamps: Whether to decode the timestamps while reading them
 
-    data = json.loads(cleaned_data)
-    return pd.DataFrame(data)
+    Returns:
+        DataFrame with the listening history data
+    """
+    return next(
+        iter_listening_history_chunks(
+            path, None, columns, chunk_size, stats, parse_timestamps
+        )
+    )
 
 
 def remove_unused_fields_from_playlist(playlist: pd.DataFrame) -> pd.DataFrame:
-    """Removes all fields from the playlist DataFrame except for the track name and artist name"""
-    return playlist[["Track Name", "Artist Name(s)"]]
+    """Removes all fields from the playlist DataFrame except for the track URI, track name and
+    artist name"""
+    return playlist[
+        [
+            field
+            for field in ["Track URI", "Track Name", "Artist Name(s)"]
+            if field in playlist.columns
+        ]
+    ]
 
 
 def remove_secondary_artists_from_playlist(playlist: pd.DataFrame) -> pd.DataFrame:
-    """Removes any artists listed after the first artist in the playlist DataFrame"""
-    filtered_playlist = playlist.copy()
+    """Removes any artists listed after the first artist in the playlist DataFrame. The artist
+    column is replaced in a shallow copy, so the other fields are shared with the playlist passed
+    in rather than copied"""
+    filtered_playlist = playlist.copy(deep=False)
     filtered_playlist["master_metadata_album_artist_name"] = (
-        filtered_playlist["master_metadata_album_artist_name"].str.split(",").str[0]
+        playlist["master_metadata_album_artist_name"].str.split(",", n=1).str[0]
     )
     return filtered_playlist
 
 
 def rename_playlist_fields(playlist: pd.DataFrame) -> pd.DataFrame:
-    """Renames the fields in the playlist DataFrame to match the listening history DataFrame"""
-    return playlist.rename(
+    """Renames the fields in the playlist DataFrame to match the listening history DataFrame,
+    sharing its data rather than copying it"""
+    renamed_playlist = playlist.copy(deep=False)
+    renamed_playlist.rename(
         columns={
+            "Track URI": "spotify_track_uri",
             "Track Name": "master_metadata_track_name",
             "Artist Name(s)": "master_metadata_album_artist_name",
-        }
+        },
+        inplace=True,
     )
+    return renamed_playlist
 
 
 def read_playlist_from_csv(path: str) -> pd.DataFrame:
@@ -69,22 +515,51 @@ def read_playlist_from_csv(path: str) -> pd.DataFrame:
 
 
 def prettify_fields(listening_history: pd.DataFrame) -> pd.DataFrame:
-    """Makes names of the fields in the listening history DataFrame more human-readable"""
-    pretty_history = listening_history.copy()
-    pretty_history.rename(
-        columns={
-            "ts": "Timestamp",
-            "master_metadata_track_name": "Track",
-            "master_metadata_album_artist_name": "Artist",
-            "master_metadata_album_album_name": "Album",
-            "ms_played": "Playtime (ms)",
-            "play_count": "Play Count",
-        },
-        inplace=True,
-    )
+    """Makes names of the fields in the listening history DataFrame more human-readable. Only the
+    column labels of a shallow copy are changed, so the data is shared with the DataFrame passed in
+    rather than copied"""
+    pretty_history = listening_history.copy(deep=False)
+    pretty_history.rename(columns=PRETTY_FIELD_NAMES, inplace=True)
     return pretty_history
 
 
+def paginate(
+    listening_history: pd.DataFrame, page: int = 0, page_size: int = PAGE_SIZE
+) -> pd.DataFrame:
+    """Returns a page of a listening history DataFrame with human-readable field names, as a view
+    of its rows rather than a copy
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        page: Number of the page, counting from 0. Negative numbers count back from the last page
+        page_size: Number of rows in each page
+
+    Returns:
+        DataFrame with the rows of the page, which is empty past the last page
+    """
+    if page < 0:
+        page += -(-len(listening_history) // page_size)
+    start = max(page, 0) * page_size
+    return prettify_fields(listening_history.iloc[start : start + page_size])
+
+
+def iter_pages(
+    listening_history: pd.DataFrame, page_size: int = PAGE_SIZE
+) -> Iterator[pd.DataFrame]:
+    """Yields the pages of a listening history DataFrame with human-readable field names one at a
+    time, so only the page being shown has to be rendered, for example by itables.show
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        page_size: Number of rows in each page
+
+    Returns:
+        Iterator over views of the rows of each page
+    """
+    for start in range(0, len(listening_history), page_size):
+        yield prettify_fields(listening_history.iloc[start : start + page_size])
+
+
 def remove_unused_fields_from_history(listening_history: pd.DataFrame) -> pd.DataFrame:
     """Removes unused fields from a listening history DataFrame
 
@@ -100,7 +575,6 @@ def remove_unused_fields_from_history(listening_history: pd.DataFrame) -> pd.Dat
             "platform",
             "conn_country",
             "ip_addr",
-            "spotify_track_uri",
             "spotify_episode_uri",
             "episode_name",
             "episode_show_name",
@@ -115,19 +589,79 @@ def remove_unused_fields_from_history(listening_history: pd.DataFrame) -> pd.Dat
     )
 
 
+def decode_timestamps(timestamps: Iterable) -> np.ndarray:
+    """Decodes spotify timestamps laid out like TIMESTAMP_FORMAT by reading their digits straight
+    from the bytes of a fixed width array, without parsing a format string for each of them.
+    Timestamps that don't match the layout, such as missing ones, are parsed by pandas instead
+
+    Arguments:
+        timestamps: Timestamp strings
+
+    Returns:
+        datetime64[us] array with each timestamp in UTC
+    """
+    if isinstance(timestamps, pd.Series):
+        timestamps = timestamps.to_numpy(dtype=object)
+    try:
+        # One byte wider than a timestamp, so longer strings don't match the layout
+        raw = np.asarray(timestamps, dtype=f"S{TIMESTAMP_WIDTH + 1}")
+    except UnicodeEncodeError:
+        return pd.to_datetime(timestamps, format=TIMESTAMP_FORMAT).to_numpy(
+            dtype="datetime64[us]"
+        )
+    characters = raw.view(np.uint8).reshape(len(raw), TIMESTAMP_WIDTH + 1)
+    matches = characters[:, TIMESTAMP_WIDTH] == 0
+    for position, separator in TIMESTAMP_SEPARATORS.items():
+        matches &= characters[:, position] == ord(separator)
+    fields = []
+    for start, end in TIMESTAMP_FIELD_POSITIONS:
+        field = np.zeros(len(raw), dtype=np.int64)
+        for position in range(start, end):
+            digits = characters[:, position] - np.uint8(ord("0"))
+            matches &= digits <= 9
+            field = field * 10 + digits
+        fields.append(field)
+    year, month, day, hour, minute, second = fields
+    leap_years = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_lengths = MONTH_LENGTHS[np.clip(month, 1, 12) - 1] + (
+        leap_years & (month == 2)
+    )
+    matches &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= month_lengths)
+    matches &= (hour < 24) & (minute < 60) & (second < 60)
+
+    # Days since the epoch of a proleptic Gregorian date, counting years from March so leap days
+    # fall at the end of them
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    days = era * 146097 + day_of_era - 719468
+    seconds = ((days * 24 + hour) * 60 + minute) * 60 + second
+    decoded = (seconds * 1_000_000).view("datetime64[us]")
+    if not matches.all():
+        mismatches = np.flatnonzero(~matches)
+        decoded[mismatches] = pd.to_datetime(
+            np.asarray(timestamps, dtype=object)[mismatches], format=TIMESTAMP_FORMAT
+        ).to_numpy(dtype="datetime64[us]")
+    return decoded
+
+
 def convert_timestamps_to_datetime(listening_history: pd.DataFrame) -> pd.DataFrame:
-    """Converts timestamps in a listening history DataFrame to datetime format
+    """Converts timestamps in a listening history DataFrame to datetime format with
+    decode_timestamps. The DataFrame passed in isn't modified, and is returned as is if its
+    timestamps were already decoded while reading it
 
     Arguments:
         listening_history: DataFrame with listening history data
 
     Returns:
-        DataFrame with timestamps converted to datetime format
+        DataFrame with timestamps converted to datetime64[us], whichever resolution the installed
+        pandas version parses to by default
     """
-    listening_history["ts"] = pd.to_datetime(
-        listening_history["ts"], format="%Y-%m-%dT%H:%M:%SZ"
-    )
-    return listening_history
+    if pd.api.types.is_datetime64_dtype(listening_history["ts"]):
+        return listening_history
+    return listening_history.assign(ts=decode_timestamps(listening_history["ts"]))
 
 
 def remove_non_songs(listening_history: pd.DataFrame) -> pd.DataFrame:
@@ -142,249 +676,2859 @@ def remove_non_songs(listening_history: pd.DataFrame) -> pd.DataFrame:
     return listening_history.dropna(subset=["master_metadata_track_name"])
 
 
-#  ██  ██      ███████ ██ ██      ████████ ███████ ██████  ███████
-# ████████     ██      ██ ██         ██    ██      ██   ██ ██
-#  ██  ██      █████   ██ ██         ██    █████   ██████  ███████
-# ████████     ██      ██ ██         ██    ██      ██   ██      ██
-#  ██  ██      ██      ██ ███████    ██    ███████ ██   ██ ███████
-
-
-def apply_filters(listening_history: pd.DataFrame, filters: list) -> pd.DataFrame:
-    """Applies a list of filters to a listening history DataFrame
+def apply_history_schema(listening_history: pd.DataFrame) -> pd.DataFrame:
+    """Converts the fields of a listening history DataFrame to the compact types in HISTORY_SCHEMA
 
     Arguments:
         listening_history: DataFrame with listening history data
-        filters: List of conditions that filter the listening history
 
     Returns:
-        DataFrame with filters applied
+        DataFrame with compact field types
     """
-    combined_filter = pd.Series(True, index=listening_history.index)
-    for f in filters:
-        combined_filter &= f
-    filtered_history = listening_history[combined_filter]
-    return filtered_history
+    return listening_history.astype(
+        {
+            field: dtype
+            for field, dtype in HISTORY_SCHEMA.items()
+            if field in listening_history.columns
+        }
+    )
 
 
-def filter_playlist_from_history(
-    listening_history: pd.DataFrame, playlist: pd.DataFrame
-) -> pd.Series:
-    """Filters a listening history DataFrame by removing any songs in the playlist from the history
+def concat_histories(
+    listening_histories: List[pd.DataFrame], ignore_index: bool = True
+) -> pd.DataFrame:
+    """Concatenates listening history DataFrames, merging the categories of categorical fields so
+    they stay categorical instead of falling back to strings
 
     Arguments:
-        listening_history: DataFrame with listening history data
-        playlist: DataFrame with the playlist data to be filtered out
+        listening_histories: DataFrames with listening history data
+        ignore_index: Whether to number the rows of the result from 0 instead of keeping the
+            index of each DataFrame
 
     Returns:
-        Series with the filter condition
+        DataFrame with all of the listening histories
     """
-    return (
-        listening_history.merge(
-            playlist,
-            on=["master_metadata_track_name", "master_metadata_album_artist_name"],
-            how="left",
-            indicator=True,
-        )["_merge"]
-        == "left_only"
-    )
+    listening_histories = [lh for lh in listening_histories if len(lh.columns)]
+    if not listening_histories:
+        return pd.DataFrame()
+    categorical_fields = {
+        field
+        for lh in listening_histories
+        for field, dtype in lh.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    }
+    for field in categorical_fields:
+        categories = functools.reduce(
+            lambda left, right: left.union(right, sort=False),
+            [
+                lh[field].cat.categories
+                for lh in listening_histories
+                if isinstance(lh.dtypes.get(field), pd.CategoricalDtype)
+            ],
+        )
+        listening_histories = [
+            (
+                lh.assign(**{field: lh[field].astype(pd.CategoricalDtype(categories))})
+                if field in lh.columns
+                else lh
+            )
+            for lh in listening_histories
+        ]
+    return pd.concat(listening_histories, ignore_index=ignore_index)
 
 
-def filter_by_song_title(listening_history: pd.DataFrame, song_title: str) -> pd.Series:
-    """Filters a listening history DataFrame by song title
+def merge_histories_by_time(
+    listening_history: pd.DataFrame, new_history: pd.DataFrame
+) -> pd.DataFrame:
+    """Merges a listening history sorted by time with another one into a history sorted by time.
+    If the new history starts after the first one ends it's appended without sorting
 
     Arguments:
-        listening_history: DataFrame with listening history data
-        song_title: Title of the song to filter
+        listening_history: DataFrame with listening history data sorted by time
+        new_history: DataFrame with listening history data to merge in
 
     Returns:
-        Series with the filter condition
+        DataFrame with both listening histories sorted by time, keeping the index of each
+    """
+    if len(new_history) and not new_history["ts"].is_monotonic_increasing:
+        new_history = new_history.sort_values("ts", kind="stable")
+    merged = concat_histories([listening_history, new_history], ignore_index=False)
+    if (
+        len(listening_history)
+        and len(new_history)
+        and new_history["ts"].iloc[0] < listening_history["ts"].iloc[-1]
+    ):
+        merged = merged.sort_values("ts", kind="stable")
+    return merged
+
+
+def empty_listening_history() -> pd.DataFrame:
+    """Creates a raw listening history without any plays that has the fields of songs, so an export
+    without any records cleans to an empty history rather than one without fields
+
+    Returns:
+        DataFrame with the song fields of a listening history and no rows
     """
-    return listening_history["master_metadata_track_name"].str.contains(
-        song_title, case=False
+    return pd.DataFrame(
+        {
+            "ts": pd.Series(dtype="datetime64[us]"),
+            "ms_played": pd.Series(dtype="int64"),
+            "master_metadata_track_name": pd.Series(dtype=object),
+            "master_metadata_album_artist_name": pd.Series(dtype=object),
+            "master_metadata_album_album_name": pd.Series(dtype=object),
+            "spotify_track_uri": pd.Series(dtype=object),
+            "skipped": pd.Series(dtype="boolean"),
+        }
     )
 
 
-def filter_by_artists(listening_history: pd.DataFrame, artists: List[str]) -> pd.Series:
-    """Filters a listening history DataFrame by a list of artists
+def clean_listening_history(
+    listening_history: pd.DataFrame, stats: Optional[PipelineStats] = None
+) -> pd.DataFrame:
+    """Removes non-songs and unused fields from a raw listening history DataFrame, converts its
+    timestamps from strings to datetime objects and applies the compact field types
 
     Arguments:
-        listening_history: DataFrame with listening history data
-        artist: Name of the artist to filter
+        listening_history: DataFrame with raw listening history data
+        stats: Stats to record each cleaning stage in
 
     Returns:
-        Series with the filter condition
+        Cleaned DataFrame with listening history data
     """
-    return listening_history["master_metadata_album_artist_name"].isin(artists)
+    if not len(listening_history.columns):
+        # Exports without any records have no fields at all
+        listening_history = empty_listening_history()
+    songs_only = run_stage(
+        stats, "remove_non_songs", remove_non_songs, listening_history
+    )
+    cleaned_fields = run_stage(
+        stats,
+        "remove_unused_fields_from_history",
+        remove_unused_fields_from_history,
+        songs_only,
+    )
+    cleaned_stamps = run_stage(
+        stats,
+        "convert_timestamps_to_datetime",
+        convert_timestamps_to_datetime,
+        cleaned_fields,
+    )
+    return run_stage(
+        stats, "apply_history_schema", apply_history_schema, cleaned_stamps
+    )
 
 
-def filter_by_not_skipped(listening_history: pd.DataFrame) -> pd.Series:
-    """Filters a listening history DataFrame by songs that were not skipped
+def load_listening_history(
+    path: str,
+    cache_dir: Optional[str] = None,
+    stats: Optional[PipelineStats] = None,
+) -> pd.DataFrame:
+    """Reads and cleans a spotify listening history json
 
     Arguments:
-        listening_history: DataFrame with listening history data
+        path: Path to a spotify listening history json
+        cache_dir: Directory of the history cache. If given, the cleaned history is loaded from the
+            cache when the file has been cleaned before, and stored in the cache otherwise
+        stats: Stats to record each loading stage in
 
     Returns:
-        Series with the filter condition
+        Cleaned DataFrame with listening history data
     """
-    return listening_history["skipped"] == False
+    entry_dir = None
+    if cache_dir is not None:
+        entry_dir = run_stage(stats, "hash_file", get_cache_entry_path, cache_dir, path)
+    if entry_dir is not None and entry_dir.is_dir():
+        return run_stage(stats, "read_cached_history", read_cached_history, entry_dir)
+    listening_history = clean_listening_history(
+        run_stage(
+            stats,
+            "read_listening_history_json",
+            functools.partial(
+                read_listening_history_json, stats=stats, parse_timestamps=True
+            ),
+            path,
+        ),
+        stats,
+    )
+    if entry_dir is not None:
+        run_stage(
+            stats,
+            "write_cached_history",
+            write_cached_history,
+            entry_dir,
+            listening_history,
+        )
+    return listening_history
 
 
-def filter_by_years(listening_history: pd.DataFrame, years: List[int]) -> pd.Series:
-    """Filters a listening history DataFrame by years
+def _load_listening_history_with_stats(
+    path: str, cache_dir: Optional[str] = None, trace_memory: bool = True
+) -> tuple:
+    """Reads and cleans a spotify listening history json, recording the stats of each loading
+    stage. Used by worker processes, which can't record in the stats of the parent process
 
     Arguments:
-        listening_history: DataFrame with listening history data
-        years: List of years to filter
+        path: Path to a spotify listening history json
+        cache_dir: Directory of the history cache
+        trace_memory: Whether to trace the memory allocated by each stage
 
     Returns:
-        Series with the filter condition
+        Cleaned DataFrame with listening history data and the stats of loading it
     """
-    return listening_history["ts"].dt.year.isin(years)
+    stats = PipelineStats(trace_memory)
+    return load_listening_history(path, cache_dir, stats), stats
 
 
-# ███████  ██████  ██████  ████████ ██ ███    ██  ██████
-# ██      ██    ██ ██   ██    ██    ██ ████   ██ ██
-# ███████ ██    ██ ██████     ██    ██ ██ ██  ██ ██   ███
-#      ██ ██    ██ ██   ██    ██    ██ ██  ██ ██ ██    ██
-# ███████  ██████  ██   ██    ██    ██ ██   ████  ██████
+#  ██████  █████   ██████ ██   ██ ███████
+# ██      ██   ██ ██      ██   ██ ██
+# ██      ███████ ██      ███████ █████
+# ██      ██   ██ ██      ██   ██ ██
+#  ██████ ██   ██  ██████ ██   ██ ███████
 
 
-def sort_songs_by_play_count(listening_history: pd.DataFrame) -> pd.DataFrame:
-    """Sorts a listening history DataFrame by song play count
+def hash_file(path: str) -> str:
+    """Computes the SHA-256 hash of a file's contents
 
     Arguments:
-        listening_history: DataFrame with listening history data
+        path: Path to the file
 
     Returns:
-        DataFrame sorted by song play count
+        Hexadecimal digest of the file
     """
-    song_play_counts = (
-        listening_history.groupby(
-            ["master_metadata_album_artist_name", "master_metadata_track_name"],
-            as_index=False,
-        )
-        .size()
-        .rename(columns={"size": "play_count"})
-    )
-
-    # Rank songs by play count
-    song_play_counts["rank"] = song_play_counts["play_count"].rank(
-        ascending=False, method="min"
-    )
-    # Sort by rank and reset index for cleaner output
-    ranked_songs = song_play_counts.sort_values(
-        by=["rank", "master_metadata_track_name"]
-    ).reset_index(drop=True)
-
-    # Reorganize columns for clarity
-    ranked_songs = ranked_songs[
-        [
-            "rank",
-            "master_metadata_track_name",
-            "master_metadata_album_artist_name",
-            "play_count",
-        ]
-    ]
-
-    return ranked_songs
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(functools.partial(file.read, 1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 
-def sort_artists_by_play_count(listening_history: pd.DataFrame) -> pd.DataFrame:
-    """Sorts a listening history DataFrame by artist play count
+def get_cache_entry_path(cache_dir: str, path: str) -> pathlib.Path:
+    """Returns the directory in the history cache for a listening history json, keyed by the hash
+    of the file and the cache schema version
 
     Arguments:
-        listening_history: DataFrame with listening history data
+        cache_dir: Directory of the history cache
+        path: Path to a spotify listening history json
 
     Returns:
-        DataFrame sorted by artist play count
+        Path to the cache entry for the file
     """
-    return listening_history["master_metadata_album_artist_name"].value_counts()
+    return pathlib.Path(cache_dir) / f"{hash_file(path)}-v{CACHE_SCHEMA_VERSION}"
 
 
-def sort_albums_by_play_count(listening_history: pd.DataFrame) -> pd.DataFrame:
-    """Sorts a listening history DataFrame by album play count
+def write_cached_history(entry_dir: str, listening_history: pd.DataFrame) -> None:
+    """Stores a cleaned listening history in the history cache. Every column is saved as its own
+    .npy file so it can be memory-mapped when read back. Numeric and datetime columns are stored
+    as-is, nullable booleans as -1/0/1, categorical columns as their codes, and all other columns as
+    integer codes into a list of unique values
 
     Arguments:
-        listening_history: DataFrame with listening history data
-
-    Returns:
-        DataFrame sorted by album play count
+        entry_dir: Directory of the cache entry
+        listening_history: Cleaned DataFrame with listening history data
     """
-    song_play_counts = (
-        listening_history.groupby(
-            ["master_metadata_album_artist_name", "master_metadata_album_album_name"],
-            as_index=False,
+    entry_dir = pathlib.Path(entry_dir)
+    entry_dir.parent.mkdir(parents=True, exist_ok=True)
+    staging_dir = pathlib.Path(tempfile.mkdtemp(dir=entry_dir.parent))
+    columns = []
+    for i, (name, column) in enumerate(listening_history.items()):
+        file_name = f"{i}.npy"
+        metadata = {"name": name, "dtype": str(column.dtype), "file": file_name}
+        if isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufM":
+            metadata["kind"] = "values"
+            values = column.to_numpy()
+            if column.dtype.kind == "M":
+                values = values.view("int64")
+        elif isinstance(column.dtype, pd.BooleanDtype):
+            metadata["kind"] = "boolean"
+            values = column.to_numpy(dtype="int8", na_value=-1)
+        elif isinstance(column.dtype, pd.CategoricalDtype):
+            metadata["kind"] = "categorical"
+            values = column.cat.codes.to_numpy()
+            metadata["categories"] = column.cat.categories.tolist()
+        else:
+            metadata["kind"] = "factorized"
+            values, uniques = pd.factorize(column)
+            metadata["uniques"] = uniques.tolist()
+        np.save(staging_dir / file_name, values)
+        columns.append(metadata)
+    with open(staging_dir / "metadata.json", "w", encoding="UTF-8") as file:
+        json.dump(
+            {
+                "schema_version": CACHE_SCHEMA_VERSION,
+                "row_count": len(listening_history),
+                "columns": columns,
+            },
+            file,
         )
-        .size()
-        .rename(columns={"size": "play_count"})
-    )
-
-    # Rank albums by play count
-    song_play_counts["rank"] = song_play_counts["play_count"].rank(
-        ascending=False, method="min"
-    )
-    # Sort by rank and reset index for cleaner output
-    ranked_songs = song_play_counts.sort_values(
-        by=["rank", "master_metadata_album_album_name"]
-    ).reset_index(drop=True)
+    try:
+        os.rename(staging_dir, entry_dir)
+    except OSError:
+        # Another process cached the same file first
+        shutil.rmtree(staging_dir)
+    return
 
-    # Reorganize columns for clarity
-    ranked_songs = ranked_songs[
-        [
-            "rank",
-            "master_metadata_album_album_name",
-            "master_metadata_album_artist_name",
-            "play_count",
-        ]
-    ]
 
-    return ranked_songs
+def read_cached_history(entry_dir: str) -> pd.DataFrame:
+    """Loads a cleaned listening history from the history cache. Numeric and datetime columns are
+    memory-mapped rather than read into memory
 
+    Arguments:
+        entry_dir: Directory of the cache entry
 
-def sort_artists_by_playtime(listening_history: pd.DataFrame) -> pd.DataFrame:
-    """Sorts a listening history DataFrame by artist playtime
+    Returns:
+        Cleaned DataFrame with listening history data
+    """
+    entry_dir = pathlib.Path(entry_dir)
+    with open(entry_dir / "metadata.json", "r", encoding="UTF-8") as file:
+        metadata = json.load(file)
+    columns = {}
+    for column in metadata["columns"]:
+        # Plain ndarray view of the memory-mapped file
+        values = np.asarray(np.load(entry_dir / column["file"], mmap_mode="r"))
+        if column["kind"] == "values":
+            values = values.view(column["dtype"])
+        elif column["kind"] == "boolean":
+            values = pd.arrays.BooleanArray(values == 1, values == -1)
+        elif column["kind"] == "categorical":
+            values = pd.Categorical.from_codes(values, categories=column["categories"])
+        else:
+            # Code -1 marks a missing value and picks the None appended to the unique values
+            uniques = np.array(column["uniques"] + [None], dtype=object)
+            values = uniques[values]
+        columns[column["name"]] = pd.Series(values, dtype=column["dtype"], copy=False)
+    return pd.DataFrame(columns, copy=False)
+
+
+#  ██████  █████  ████████  █████  ██       ██████   ██████
+# ██      ██   ██    ██    ██   ██ ██      ██    ██ ██
+# ██      ███████    ██    ███████ ██      ██    ██ ██   ███
+# ██      ██   ██    ██    ██   ██ ██      ██    ██ ██    ██
+#  ██████ ██   ██    ██    ██   ██ ███████  ██████   ██████
+
+
+def _factorize(values: pd.Series) -> tuple:
+    """Encodes values as integer codes, keeping missing values as a unique value of None
 
     Arguments:
-        listening_history: DataFrame with listening history data
+        values: Series to encode
 
     Returns:
-        DataFrame sorted by artist playtime
+        Array with the code of each value and list with the unique values
     """
-    artist_playtime = (
-        listening_history.groupby("master_metadata_album_artist_name", as_index=False)
-        .agg({"ms_played": "sum"})
-        .rename(columns={"ms_played": "total_playtime_ms"})
-        .sort_values(by="total_playtime_ms", ascending=False)
-    )
-    artist_playtime.reset_index(drop=True, inplace=True)
-    artist_playtime.index = artist_playtime.index + 1
-    artist_playtime["Total Playtime"] = pd.to_timedelta(
-        artist_playtime["total_playtime_ms"], unit="ms"
-    )
-    artist_playtime.drop(columns="total_playtime_ms", inplace=True)
-    return artist_playtime
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return codes, [None if pd.isna(unique) else unique for unique in uniques]
 
 
-#  ██████ ██       █████  ███████ ███████
-# ██      ██      ██   ██ ██      ██
-# ██      ██      ███████ ███████ ███████
-# ██      ██      ██   ██      ██      ██
-#  ██████ ███████ ██   ██ ███████ ███████
+def _first_positions(codes: np.ndarray, unique_count: int) -> np.ndarray:
+    """Finds the position where each code first appears
+
+    Arguments:
+        codes: Array of codes in the range [0, unique_count)
+        unique_count: Number of distinct codes
 
+    Returns:
+        Array with the position of the first appearance of each code
+    """
+    positions = np.zeros(unique_count, dtype=np.int64)
+    positions[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+    return positions
 
-class ListeningHistory:
-    """Object containing listening history data and methods for analysis
+
+class TitleSearchIndex:
+    """Trigram index over a list of titles for case-insensitive substring search. Each trigram
+    maps to the titles that contain it, so a search only checks the titles that contain every
+    trigram of the search string
 
     Arguments:
-        listening_history_path: Path to a spotify listening history json
+        titles: Titles to index. Each title is identified by its position in the list
     """
 
-    def __init__(self):
-        self.listening_history = pd.DataFrame()
-        self.filtered_history = pd.DataFrame()
-        self.filters = []
+    def __init__(self, titles: Iterable[Optional[str]] = ()):
+        self._titles: List[str] = []
+        self._postings: Dict[str, List[int]] = collections.defaultdict(list)
+        self.extend(titles)
         return
 
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    def extend(self, titles: Iterable[Optional[str]]) -> None:
+        """Adds titles to the index, after the ones already in it
+
+        Arguments:
+            titles: Titles to add. Missing titles never match a search
+        """
+        for title in titles:
+            title = title.casefold() if isinstance(title, str) else ""
+            position = len(self._titles)
+            self._titles.append(title)
+            for trigram in {title[i : i + 3] for i in range(len(title) - 2)}:
+                self._postings[trigram].append(position)
+        return
+
+    def search(self, substring: str) -> np.ndarray:
+        """Finds the titles that contain a string, ignoring case. The string is matched literally
+
+        Arguments:
+            substring: String to search for
+
+        Returns:
+            Sorted array with the positions of the matching titles
+        """
+        substring = substring.casefold()
+        trigrams = {substring[i : i + 3] for i in range(len(substring) - 2)}
+        if not trigrams:
+            candidates = range(len(self._titles))
+        elif not trigrams <= self._postings.keys():
+            return np.empty(0, dtype=np.int64)
+        else:
+            postings = sorted(
+                (self._postings[trigram] for trigram in trigrams), key=len
+            )
+            candidates = functools.reduce(
+                lambda left, right: np.intersect1d(left, right, assume_unique=True),
+                postings[1:],
+                np.asarray(postings[0]),
+            )
+        return np.array(
+            [i for i in candidates if substring in self._titles[i]], dtype=np.int64
+        )
+
+
+class Catalog:
+    """Shared dictionary that interns the tracks, artists and albums of listening histories as
+    dense integer IDs. Tracks are keyed by their spotify URI, or by their artist and name when the
+    URI is missing, artists by their name, and albums by their artist and name. Each track also
+    maps to a song keyed by its artist and name, so releases of a song with different URIs, such
+    as a single and an album track, are counted as one song. Names are only looked up by ID for
+    display
+    """
+
+    def __init__(self):
+        self._artist_ids: Dict[Hashable, int] = {}
+        self._album_ids: Dict[Hashable, int] = {}
+        self._track_ids: Dict[Hashable, int] = {}
+        self._song_ids: Dict[Hashable, int] = {}
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._track_name_index = TitleSearchIndex()
+        self._entries: Dict[str, list] = {
+            "artist_names": [],
+            "album_names": [],
+            "album_artist_ids": [],
+            "track_names": [],
+            "track_uris": [],
+            "track_artist_ids": [],
+            "track_album_ids": [],
+            "track_song_ids": [],
+            "song_names": [],
+            "song_artist_ids": [],
+        }
+        return
+
+    def _array(self, name: str) -> np.ndarray:
+        """Returns entries of the catalog as an array indexed by ID. The array has an extra
+        missing value at the end so an ID of -1 looks up a missing value
+
+        Arguments:
+            name: Name of the entries
+
+        Returns:
+            Array with the entries
+        """
+        if name not in self._arrays:
+            if name.endswith("_ids"):
+                array = np.array(self._entries[name] + [-1], dtype=np.int32)
+            else:
+                array = np.array(self._entries[name] + [None], dtype=object)
+            self._arrays[name] = array
+        return self._arrays[name]
+
+    @property
+    def artist_names(self) -> np.ndarray:
+        """Name of each artist, indexed by artist ID"""
+        return self._array("artist_names")
+
+    @property
+    def album_names(self) -> np.ndarray:
+        """Name of each album, indexed by album ID"""
+        return self._array("album_names")
+
+    @property
+    def album_artist_ids(self) -> np.ndarray:
+        """Artist ID of each album, indexed by album ID"""
+        return self._array("album_artist_ids")
+
+    @property
+    def track_names(self) -> np.ndarray:
+        """Name of each track, indexed by track ID"""
+        return self._array("track_names")
+
+    @property
+    def track_uris(self) -> np.ndarray:
+        """Spotify URI of each track, indexed by track ID"""
+        return self._array("track_uris")
+
+    @property
+    def track_artist_ids(self) -> np.ndarray:
+        """Artist ID of each track, indexed by track ID"""
+        return self._array("track_artist_ids")
+
+    @property
+    def track_album_ids(self) -> np.ndarray:
+        """Album ID of each track, indexed by track ID"""
+        return self._array("track_album_ids")
+
+    @property
+    def track_song_ids(self) -> np.ndarray:
+        """Song ID of each track, indexed by track ID. Tracks without an artist or name have a
+        song ID of -1"""
+        return self._array("track_song_ids")
+
+    @property
+    def song_names(self) -> np.ndarray:
+        """Name of each song, indexed by song ID"""
+        return self._array("song_names")
+
+    @property
+    def song_artist_ids(self) -> np.ndarray:
+        """Artist ID of each song, indexed by song ID"""
+        return self._array("song_artist_ids")
+
+    @property
+    def track_count(self) -> int:
+        """Number of tracks in the catalog"""
+        return len(self._entries["track_names"])
+
+    @property
+    def song_count(self) -> int:
+        """Number of songs in the catalog"""
+        return len(self._entries["song_names"])
+
+    @property
+    def artist_count(self) -> int:
+        """Number of artists in the catalog"""
+        return len(self._entries["artist_names"])
+
+    @property
+    def album_count(self) -> int:
+        """Number of albums in the catalog"""
+        return len(self._entries["album_names"])
+
+    def search_track_names(self, substring: str) -> np.ndarray:
+        """Finds the tracks whose name contains a string, ignoring case. The trigram index of track
+        names is extended with the tracks added since the last search
+
+        Arguments:
+            substring: String to search for
+
+        Returns:
+            Sorted array with the IDs of the matching tracks
+        """
+        index = self._track_name_index
+        if len(index) < self.track_count:
+            index.extend(self._entries["track_names"][len(index) :])
+        return index.search(substring)
+
+    def id_count(self, id_field: str) -> int:
+        """Returns the number of IDs in the catalog for an ID field of the listening history
+
+        Arguments:
+            id_field: One of track_id, artist_id or album_id
+
+        Returns:
+            Number of IDs
+        """
+        return {
+            "track_id": self.track_count,
+            "artist_id": self.artist_count,
+            "album_id": self.album_count,
+        }[id_field]
+
+    def _intern(
+        self, ids: Dict[Hashable, int], keys: list, add: Callable[[Hashable, int], None]
+    ) -> np.ndarray:
+        """Looks up the ID of each key, adding keys that aren't in the catalog yet. Missing keys
+        are given an ID of -1
+
+        Arguments:
+            ids: Dictionary from keys to IDs
+            keys: Unique keys to look up, with None for a missing key
+            add: Function called with each new key and the position of the key in `keys`
+
+        Returns:
+            Array with the ID of each key
+        """
+        key_ids = np.empty(len(keys), dtype=np.int32)
+        for i, key in enumerate(keys):
+            if key is None:
+                key_ids[i] = -1
+                continue
+            key_id = ids.get(key)
+            if key_id is None:
+                key_id = ids[key] = len(ids)
+                add(key, i)
+            key_ids[i] = key_id
+        self._arrays.clear()
+        return key_ids
+
+    def intern(self, listening_history: pd.DataFrame) -> pd.DataFrame:
+        """Adds the tracks, artists and albums of a cleaned listening history to the catalog
+
+        Arguments:
+            listening_history: Cleaned DataFrame with listening history data
+
+        Returns:
+            DataFrame with track_id, artist_id and album_id fields
+        """
+        entries = self._entries
+
+        def factorize_field(name: str) -> tuple:
+            if name in listening_history.columns:
+                return _factorize(listening_history[name])
+            return np.zeros(len(listening_history), dtype=np.int64), [None]
+
+        artist_codes, artist_names = factorize_field(
+            "master_metadata_album_artist_name"
+        )
+        artist_ids = self._intern(
+            self._artist_ids,
+            artist_names,
+            lambda name, _: entries["artist_names"].append(name),
+        )[artist_codes]
+
+        album_codes, album_names = factorize_field("master_metadata_album_album_name")
+        album_key_codes, album_key_uniques = pd.factorize(
+            artist_ids.astype(np.int64) * len(album_names) + album_codes
+        )
+        album_keys = []
+        for key in album_key_uniques:
+            artist_id, album_code = divmod(int(key), len(album_names))
+            name = album_names[album_code]
+            album_keys.append(None if name is None else (artist_id, name))
+
+        def add_album(key: tuple, _) -> None:
+            entries["album_artist_ids"].append(key[0])
+            entries["album_names"].append(key[1])
+
+        album_ids = self._intern(self._album_ids, album_keys, add_album)[
+            album_key_codes
+        ]
+
+        track_codes, track_names = factorize_field("master_metadata_track_name")
+        uri_codes, uris = factorize_field("spotify_track_uri")
+        has_uri = np.array([uri is not None for uri in uris], dtype=bool)[uri_codes]
+        # Tracks without a URI are keyed by their artist and name, encoded after the URIs. Artist
+        # IDs are shifted by one so a missing artist of -1 doesn't encode into the URIs
+        track_key_codes, track_key_uniques = pd.factorize(
+            np.where(
+                has_uri,
+                uri_codes,
+                len(uris)
+                + (artist_ids.astype(np.int64) + 1) * len(track_names)
+                + track_codes,
+            )
+        )
+        track_keys = []
+        for key in track_key_uniques:
+            if key < len(uris):
+                track_keys.append(uris[key])
+                continue
+            artist_id, track_code = divmod(int(key) - len(uris), len(track_names))
+            artist_id -= 1
+            name = track_names[track_code]
+            track_keys.append(None if name is None else (artist_id, name))
+        first_rows = _first_positions(track_key_codes, len(track_key_uniques))
+
+        def add_song(key: tuple, _) -> None:
+            entries["song_artist_ids"].append(key[0])
+            entries["song_names"].append(key[1])
+
+        def add_track(_, i: int) -> None:
+            row = first_rows[i]
+            artist_id = int(artist_ids[row])
+            name = track_names[track_codes[row]]
+            song_key = None if artist_id == -1 or name is None else (artist_id, name)
+            entries["track_names"].append(name)
+            entries["track_uris"].append(uris[uri_codes[row]])
+            entries["track_artist_ids"].append(artist_id)
+            entries["track_album_ids"].append(int(album_ids[row]))
+            entries["track_song_ids"].append(
+                int(self._intern(self._song_ids, [song_key], add_song)[0])
+            )
+
+        track_ids = self._intern(self._track_ids, track_keys, add_track)[
+            track_key_codes
+        ]
+        return listening_history.assign(
+            track_id=track_ids, artist_id=artist_ids, album_id=album_ids
+        )
+
+
+# Fields that identify a play. Tracks are identified by their ID, which stands for their URI when
+# they have one
+PLAY_KEY_FIELDS = ["ts", "track_id", "ms_played"]
+
+
+def hash_plays(listening_history: pd.DataFrame) -> np.ndarray:
+    """Hashes the plays of an interned listening history by their timestamp, track and playtime.
+    Timestamps are hashed as microseconds, so plays match whatever unit their timestamps are in
+
+    Arguments:
+        listening_history: Interned DataFrame with listening history data
+
+    Returns:
+        Array with the 64 bit hash of each play
+    """
+    play_keys = listening_history[PLAY_KEY_FIELDS].assign(
+        ts=listening_history["ts"].to_numpy(dtype="datetime64[us]").view(np.int64)
+    )
+    return pd.util.hash_pandas_object(play_keys, index=False).to_numpy()
+
+
+class PlayDeduplicator:
+    """Set of the hashes of the plays seen so far, so plays in overlapping exports of a listening
+    history are only kept the first time they're seen. New plays are only checked against the set,
+    never against the listening history itself
+    """
+
+    def __init__(self):
+        self._play_hashes: set = set()
+        self.duplicate_count = 0
+        return
+
+    def __len__(self) -> int:
+        return len(self._play_hashes)
+
+    def deduplicate(self, listening_history: pd.DataFrame) -> pd.DataFrame:
+        """Drops the plays of an interned listening history that were seen before, including
+        repeats within it, and adds the rest to the set
+
+        Arguments:
+            listening_history: Interned DataFrame with listening history data
+
+        Returns:
+            DataFrame with the plays that weren't seen before
+        """
+        play_hashes = hash_plays(listening_history)
+        first_rows = np.sort(np.unique(play_hashes, return_index=True)[1])
+        seen = self._play_hashes
+        is_new = np.fromiter(
+            (play_hash not in seen for play_hash in play_hashes[first_rows].tolist()),
+            dtype=bool,
+            count=len(first_rows),
+        )
+        new_rows = first_rows[is_new]
+        seen.update(play_hashes[new_rows].tolist())
+        self.duplicate_count += len(listening_history) - len(new_rows)
+        if len(new_rows) == len(listening_history):
+            return listening_history
+        return listening_history.take(new_rows)
+
+
+#  ██  ██      ███████ ██ ██      ████████ ███████ ██████  ███████
+# ████████     ██      ██ ██         ██    ██      ██   ██ ██
+#  ██  ██      █████   ██ ██         ██    █████   ██████  ███████
+# ████████     ██      ██ ██         ██    ██      ██   ██      ██
+#  ██  ██      ██      ██ ███████    ██    ███████ ██   ██ ███████
+
+
+def _to_datetime64(timestamp, dtype: np.dtype) -> np.datetime64:
+    """Converts a timestamp to a naive UTC datetime64 value
+
+    Arguments:
+        timestamp: Anything pandas can convert to a timestamp
+        dtype: datetime64 type of the result
+
+    Returns:
+        datetime64 value
+    """
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+    return timestamp.to_datetime64().astype(dtype)
+
+
+class TimeIndex:
+    """Index of the timestamps of a listening history sorted by time. Rows are partitioned by
+    month, so a time range resolves to a range of rows by skipping whole partitions and binary
+    searching only the partition it starts or ends in
+
+    Arguments:
+        timestamps: Timestamps of the listening history, sorted by time
+    """
+
+    def __init__(self, timestamps: pd.Series):
+        self.timestamps = timestamps.to_numpy(dtype="datetime64[us]")
+        months = self.timestamps.astype("datetime64[M]")
+        starts = np.flatnonzero(months[1:] != months[:-1]) + 1
+        starts = np.concatenate([[0], starts]) if len(months) else starts
+        self.partition_months = months[starts]
+        self.partition_offsets = np.append(starts, len(months))
+        return
+
+    def position(self, timestamp) -> int:
+        """Finds the first row played at or after a timestamp
+
+        Arguments:
+            timestamp: Anything pandas can convert to a timestamp. Time zone naive timestamps are
+                taken to be in UTC
+
+        Returns:
+            Position of the row
+        """
+        timestamp = _to_datetime64(timestamp, self.timestamps.dtype)
+        month = timestamp.astype("datetime64[M]")
+        partition = np.searchsorted(self.partition_months, month)
+        if partition == len(self.partition_months):
+            return len(self.timestamps)
+        start, end = self.partition_offsets[partition : partition + 2]
+        if self.partition_months[partition] > month:
+            return int(start)
+        return int(start + np.searchsorted(self.timestamps[start:end], timestamp))
+
+    def row_range(self, start=None, end=None) -> tuple:
+        """Finds the rows played in a time range
+
+        Arguments:
+            start: First timestamp of the range. The range is unbounded if not given
+            end: Timestamp the range ends before. The range is unbounded if not given
+
+        Returns:
+            Positions of the first row in the range and of the row after the last one
+        """
+        first = 0 if start is None else self.position(start)
+        last = len(self.timestamps) if end is None else self.position(end)
+        return first, max(first, last)
+
+    def year_ranges(self, years: Iterable[int]) -> List[tuple]:
+        """Finds the rows played in any of a list of years
+
+        Arguments:
+            years: List of years
+
+        Returns:
+            Sorted list of disjoint ranges of rows, as the positions of their first row and of the
+            row after their last one
+        """
+        ranges = []
+        for year in sorted(set(years)):
+            first, last = self.row_range(f"{year}-01-01", f"{year + 1}-01-01")
+            if ranges and ranges[-1][1] == first:
+                ranges[-1] = (ranges[-1][0], last)
+            elif first < last:
+                ranges.append((first, last))
+        return ranges
+
+
+def _intersect_row_ranges(left: List[tuple], right: List[tuple]) -> List[tuple]:
+    """Intersects two sorted lists of disjoint ranges of rows"""
+    ranges = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        first = max(left[i][0], right[j][0])
+        last = min(left[i][1], right[j][1])
+        if first < last:
+            ranges.append((first, last))
+        if left[i][1] < right[j][1]:
+            i += 1
+        else:
+            j += 1
+    return ranges
+
+
+class Filter:
+    """Declarative condition on the rows of a listening history. Filters added to a
+    ListeningHistory are only evaluated when the filtered history is needed, and apply_filters
+    combines them in a single pass
+
+    Attributes:
+        fields: Fields of the listening history the filter reads
+        cost: Relative cost of evaluating the filter on one row
+        rollup_compatible: Whether the filter can be evaluated on the rows of a RollupCube, which
+            only have the day each song was played on, its IDs and whether it was skipped
+    """
+
+    fields: List[str] = []
+    cost = 1.0
+    rollup_compatible = False
+
+    def evaluate(
+        self, listening_history: pd.DataFrame, catalog: Optional[Catalog] = None
+    ) -> np.ndarray:
+        """Evaluates the filter on each row of a listening history
+
+        Arguments:
+            listening_history: DataFrame with listening history data
+            catalog: Catalog the history was interned with
+
+        Returns:
+            Boolean array that's True for the rows that pass the filter
+        """
+        raise NotImplementedError
+
+    def row_ranges(self, time_index: TimeIndex) -> Optional[List[tuple]]:
+        """Finds the rows that pass the filter in a listening history sorted by time, for filters
+        that only depend on time
+
+        Arguments:
+            time_index: Index of the timestamps of the listening history
+
+        Returns:
+            Sorted list of disjoint ranges of rows that pass the filter, or None if the filter
+            doesn't only depend on time
+        """
+        return None
+
+    def __call__(
+        self, listening_history: pd.DataFrame, catalog: Optional[Catalog] = None
+    ) -> pd.Series:
+        """Returns the filter condition as a Series aligned with the listening history"""
+        return pd.Series(
+            self.evaluate(listening_history, catalog), index=listening_history.index
+        )
+
+
+class CatalogFilter(Filter):
+    """Filter that's decided once for each entry of a catalog and applied to the rows of a
+    listening history by looking up their IDs. Decisions are kept, so later evaluations only decide
+    the entries added to the catalog since
+
+    Attributes:
+        id_field: ID field of the listening history the decisions are looked up by
+        missing_passes: Whether rows with a missing ID pass the filter
+    """
+
+    id_field = "track_id"
+    missing_passes = False
+    rollup_compatible = True
+
+    def __init__(self):
+        self._catalog: Optional[Catalog] = None
+        self._decisions = np.empty(0, dtype=bool)
+        return
+
+    def decide(self, catalog: Catalog, start: int) -> np.ndarray:
+        """Decides the filter for catalog entries
+
+        Arguments:
+            catalog: Catalog to decide the filter for
+            start: First ID to decide
+
+        Returns:
+            Boolean array that's True for the IDs from `start` on that pass the filter
+        """
+        raise NotImplementedError
+
+    def evaluate_rows(self, listening_history: pd.DataFrame) -> np.ndarray:
+        """Evaluates the filter on each row of a listening history that wasn't interned
+
+        Arguments:
+            listening_history: DataFrame with listening history data
+
+        Returns:
+            Boolean array that's True for the rows that pass the filter
+        """
+        raise NotImplementedError
+
+    def evaluate(
+        self, listening_history: pd.DataFrame, catalog: Optional[Catalog] = None
+    ) -> np.ndarray:
+        if catalog is None or self.id_field not in listening_history.columns:
+            return self.evaluate_rows(listening_history)
+        if catalog is not self._catalog:
+            self._catalog = catalog
+            self._decisions = np.empty(0, dtype=bool)
+        if len(self._decisions) < catalog.id_count(self.id_field):
+            self._decisions = np.concatenate(
+                [self._decisions, self.decide(catalog, len(self._decisions))]
+            )
+        # An ID of -1 looks up the decision for missing IDs at the end
+        decisions = np.append(self._decisions, self.missing_passes)
+        return decisions[listening_history[self.id_field].to_numpy()]
+
+
+def hash_songs(track_names: Iterable, artist_names: Iterable) -> np.ndarray:
+    """Hashes songs by their track and artist name
+
+    Arguments:
+        track_names: Name of each song
+        artist_names: Artist name of each song
+
+    Returns:
+        Array with a 64-bit hash of each song
+    """
+    songs = pd.DataFrame(
+        {
+            "track": np.asarray(track_names, dtype=object),
+            "artist": np.asarray(artist_names, dtype=object),
+        }
+    )
+    return pd.util.hash_pandas_object(songs, index=False).to_numpy()
+
+
+class PlaylistExclusionIndex:
+    """Hash index of the songs in any number of playlists, used to exclude them all from a
+    listening history with a single membership test. Songs are matched by hashed track and artist
+    name, or by spotify URI when the playlist has one
+
+    Arguments:
+        playlists: DataFrames with the playlist data to be excluded
+    """
+
+    def __init__(self, playlists: Iterable[pd.DataFrame] = ()):
+        self._song_hashes = pd.Index(np.empty(0, dtype=np.uint64))
+        self._uris = pd.Index([], dtype=object)
+        self.add_playlists(playlists)
+        return
+
+    @classmethod
+    def from_csvs(cls, paths: Iterable[str]) -> "PlaylistExclusionIndex":
+        """Builds an index from playlist CSV files
+
+        Arguments:
+            paths: Paths to the CSV files
+
+        Returns:
+            Index of the songs in the playlists
+        """
+        return cls(read_playlist_from_csv(path) for path in paths)
+
+    def __len__(self) -> int:
+        return len(self._song_hashes)
+
+    def add_playlists(self, playlists: Iterable[pd.DataFrame]) -> None:
+        """Adds the songs in playlists to the index
+
+        Arguments:
+            playlists: DataFrames with the playlist data to be excluded
+        """
+        song_hashes = [self._song_hashes.to_numpy()]
+        uris = [self._uris.to_numpy()]
+        for playlist in playlists:
+            song_hashes.append(
+                hash_songs(
+                    playlist["master_metadata_track_name"],
+                    playlist["master_metadata_album_artist_name"],
+                )
+            )
+            if "spotify_track_uri" in playlist.columns:
+                uris.append(
+                    playlist["spotify_track_uri"].dropna().to_numpy(dtype=object)
+                )
+        self._song_hashes = pd.Index(np.unique(np.concatenate(song_hashes)))
+        self._uris = pd.Index(pd.unique(np.concatenate(uris)), dtype=object)
+        return
+
+    def contains(
+        self,
+        track_names: Iterable,
+        artist_names: Iterable,
+        uris: Optional[Iterable] = None,
+    ) -> np.ndarray:
+        """Tests which songs are in the index
+
+        Arguments:
+            track_names: Name of each song
+            artist_names: Artist name of each song
+            uris: Spotify URI of each song, if known
+
+        Returns:
+            Boolean array that's True for the songs in the index
+        """
+        in_index = (
+            self._song_hashes.get_indexer(hash_songs(track_names, artist_names)) >= 0
+        )
+        if uris is not None and len(self._uris):
+            in_index |= self._uris.get_indexer(np.asarray(uris, dtype=object)) >= 0
+        return in_index
+
+
+class PlaylistFilter(CatalogFilter):
+    """Removes any songs in one or more playlists from a listening history. Songs are matched by
+    track and artist name, or by spotify URI when the playlist has one
+
+    Arguments:
+        playlists: DataFrame with the playlist data to be filtered out, or an index of the songs
+            in any number of playlists
+    """
+
+    fields = [
+        "track_id",
+        "master_metadata_track_name",
+        "master_metadata_album_artist_name",
+        "spotify_track_uri",
+    ]
+    missing_passes = True
+
+    def __init__(self, playlists: Union[pd.DataFrame, PlaylistExclusionIndex]):
+        super().__init__()
+        if isinstance(playlists, pd.DataFrame):
+            playlists = PlaylistExclusionIndex([playlists])
+        self.exclusion_index = playlists
+        return
+
+    def decide(self, catalog: Catalog, start: int) -> np.ndarray:
+        return ~self.exclusion_index.contains(
+            catalog.track_names[start:-1],
+            catalog.artist_names[catalog.track_artist_ids[start:-1]],
+            catalog.track_uris[start:-1],
+        )
+
+    def evaluate_rows(self, listening_history: pd.DataFrame) -> np.ndarray:
+        return ~self.exclusion_index.contains(
+            listening_history["master_metadata_track_name"],
+            listening_history["master_metadata_album_artist_name"],
+            listening_history.get("spotify_track_uri"),
+        )
+
+
+class SongTitleFilter(CatalogFilter):
+    """Keeps songs whose title contains a string, ignoring case. The string is matched literally
+    and searched for with a trigram index of the distinct titles rather than on every row
+
+    Arguments:
+        song_title: Title of the song to filter
+    """
+
+    fields = ["track_id", "master_metadata_track_name"]
+
+    def __init__(self, song_title: str):
+        super().__init__()
+        self.song_title = song_title
+        return
+
+    def decide(self, catalog: Catalog, start: int) -> np.ndarray:
+        decisions = np.zeros(catalog.track_count - start, dtype=bool)
+        track_ids = catalog.search_track_names(self.song_title)
+        decisions[track_ids[track_ids >= start] - start] = True
+        return decisions
+
+    def evaluate_rows(self, listening_history: pd.DataFrame) -> np.ndarray:
+        codes, titles = pd.factorize(listening_history["master_metadata_track_name"])
+        # Code -1 marks a missing title and picks the False at the end
+        matches = np.zeros(len(titles) + 1, dtype=bool)
+        matches[TitleSearchIndex(titles).search(self.song_title)] = True
+        return matches[codes]
+
+
+class ArtistsFilter(CatalogFilter):
+    """Keeps songs by any of a list of artists
+
+    Arguments:
+        artists: Names of the artists to keep
+    """
+
+    id_field = "artist_id"
+    fields = ["artist_id", "master_metadata_album_artist_name"]
+
+    def __init__(self, artists: List[str]):
+        super().__init__()
+        self.artists = set(artists)
+        return
+
+    def decide(self, catalog: Catalog, start: int) -> np.ndarray:
+        return np.isin(catalog.artist_names[start:-1], list(self.artists))
+
+    def evaluate_rows(self, listening_history: pd.DataFrame) -> np.ndarray:
+        return (
+            listening_history["master_metadata_album_artist_name"]
+            .isin(self.artists)
+            .to_numpy(dtype=bool)
+        )
+
+
+class NotSkippedFilter(Filter):
+    """Keeps songs that were not skipped"""
+
+    fields = ["skipped"]
+    rollup_compatible = True
+
+    def evaluate(
+        self, listening_history: pd.DataFrame, catalog: Optional[Catalog] = None
+    ) -> np.ndarray:
+        return (listening_history["skipped"] == False).to_numpy(
+            dtype=bool, na_value=False
+        )
+
+
+class YearsFilter(Filter):
+    """Keeps songs played in any of a list of years
+
+    Arguments:
+        years: List of years to keep
+    """
+
+    fields = ["ts"]
+    cost = 4.0
+    rollup_compatible = True
+
+    def __init__(self, years: List[int]):
+        self.years = list(years)
+        return
+
+    def evaluate(
+        self, listening_history: pd.DataFrame, catalog: Optional[Catalog] = None
+    ) -> np.ndarray:
+        return listening_history["ts"].dt.year.isin(self.years).to_numpy(dtype=bool)
+
+    def row_ranges(self, time_index: TimeIndex) -> Optional[List[tuple]]:
+        return time_index.year_ranges(self.years)
+
+
+class DateRangeFilter(Filter):
+    """Keeps songs played in a time range
+
+    Arguments:
+        start: First timestamp of the range. The range is unbounded if not given
+        end: Timestamp the range ends before. The range is unbounded if not given
+    """
+
+    fields = ["ts"]
+
+    def __init__(self, start=None, end=None):
+        self.start = start
+        self.end = end
+        return
+
+    @property
+    def rollup_compatible(self) -> bool:
+        """Whether the range starts and ends at midnight UTC"""
+        for timestamp in (self.start, self.end):
+            if timestamp is not None:
+                timestamp = _to_datetime64(timestamp, np.dtype("datetime64[us]"))
+                if timestamp != timestamp.astype("datetime64[D]"):
+                    return False
+        return True
+
+    def evaluate(
+        self, listening_history: pd.DataFrame, catalog: Optional[Catalog] = None
+    ) -> np.ndarray:
+        timestamps = listening_history["ts"].to_numpy()
+        in_range = np.ones(len(timestamps), dtype=bool)
+        if self.start is not None:
+            in_range &= timestamps >= _to_datetime64(self.start, timestamps.dtype)
+        if self.end is not None:
+            in_range &= timestamps < _to_datetime64(self.end, timestamps.dtype)
+        return in_range
+
+    def row_ranges(self, time_index: TimeIndex) -> Optional[List[tuple]]:
+        first, last = time_index.row_range(self.start, self.end)
+        return [(first, last)] if first < last else []
+
+
+class MaskFilter(Filter):
+    """Wraps a precomputed filter condition. Rows missing from the condition don't pass it
+
+    Arguments:
+        condition: Boolean Series indexed like the listening history it was computed from
+    """
+
+    cost = 2.0
+
+    def __init__(self, condition: pd.Series):
+        self.condition = condition
+        return
+
+    def evaluate(
+        self, listening_history: pd.DataFrame, catalog: Optional[Catalog] = None
+    ) -> np.ndarray:
+        return self.condition.reindex(
+            listening_history.index, fill_value=False
+        ).to_numpy(dtype=bool)
+
+
+def _select_fields(listening_history: pd.DataFrame, fields: List[str]) -> pd.DataFrame:
+    """Selects the fields a filter reads that are in a listening history"""
+    return listening_history[
+        [field for field in fields if field in listening_history.columns]
+    ]
+
+
+def plan_filters(
+    listening_history: pd.DataFrame,
+    filters: List[Filter],
+    catalog: Optional[Catalog] = None,
+) -> List[Filter]:
+    """Orders filters so the ones that remove the most rows for their cost are evaluated first.
+    For large histories the share of rows each filter removes is estimated on a sample of rows,
+    otherwise filters are ordered by cost alone
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        filters: Filters to order
+        catalog: Catalog the history was interned with
+
+    Returns:
+        List with the filters in the order they should be evaluated
+    """
+    if len(filters) < 2 or len(listening_history) <= FILTER_SAMPLE_SIZE:
+        return sorted(filters, key=lambda f: f.cost)
+    sample_rows = np.linspace(0, len(listening_history) - 1, FILTER_SAMPLE_SIZE).astype(
+        np.intp
+    )
+    sample = listening_history.take(sample_rows)
+
+    def cost_per_removed_row(f: Filter) -> float:
+        removed = 1.0 - f.evaluate(_select_fields(sample, f.fields), catalog).mean()
+        return f.cost / removed if removed else np.inf
+
+    return sorted(filters, key=cost_per_removed_row)
+
+
+def apply_filters(
+    listening_history: pd.DataFrame,
+    filters: List[Union[Filter, pd.Series]],
+    catalog: Optional[Catalog] = None,
+    time_index: Optional[TimeIndex] = None,
+) -> pd.DataFrame:
+    """Applies a list of filters to a listening history DataFrame. Filters are evaluated in the
+    order given by plan_filters, each one only on the rows that passed the ones before it
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        filters: List of filters, or of precomputed conditions, that filter the listening history
+        catalog: Catalog the history was interned with
+        time_index: Index of the timestamps of the listening history, if it's sorted by time.
+            Filters that only depend on time then select ranges of rows instead of being
+            evaluated, and only select a slice of the history if no other filters are left
+
+    Returns:
+        DataFrame with filters applied
+    """
+    filters = [f if isinstance(f, Filter) else MaskFilter(f) for f in filters]
+    if not filters or not len(listening_history):
+        return listening_history
+    ranges = [(0, len(listening_history))]
+    if time_index is not None:
+        row_filters = []
+        for f in filters:
+            f_ranges = f.row_ranges(time_index)
+            if f_ranges is None:
+                row_filters.append(f)
+            else:
+                ranges = _intersect_row_ranges(ranges, f_ranges)
+        if not row_filters and len(ranges) == 1:
+            first, last = ranges[0]
+            return listening_history.iloc[first:last]
+        filters = row_filters
+    rows = np.concatenate(
+        [np.arange(first, last) for first, last in ranges] or [np.empty(0, np.intp)]
+    )
+    for f in plan_filters(listening_history, filters, catalog):
+        if not len(rows):
+            break
+        fields = _select_fields(listening_history, f.fields)
+        if len(rows) < len(listening_history):
+            fields = fields.take(rows)
+        rows = rows[f.evaluate(fields, catalog)]
+    return listening_history.take(rows)
+
+
+def filter_playlist_from_history(
+    listening_history: pd.DataFrame,
+    playlist: Union[pd.DataFrame, PlaylistExclusionIndex],
+    catalog: Optional[Catalog] = None,
+) -> pd.Series:
+    """Filters a listening history DataFrame by removing any songs in the playlist from the history
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        playlist: DataFrame with the playlist data to be filtered out, or an index of the songs in
+            any number of playlists
+        catalog: Catalog the history was interned with. If given, the songs in the playlist are
+            matched against each track in the catalog once and the history is filtered by track ID
+
+    Returns:
+        Series with the filter condition
+    """
+    return PlaylistFilter(playlist)(listening_history, catalog)
+
+
+def filter_by_song_title(
+    listening_history: pd.DataFrame,
+    song_title: str,
+    catalog: Optional[Catalog] = None,
+) -> pd.Series:
+    """Filters a listening history DataFrame by songs whose title contains a string, ignoring case
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        song_title: Title of the song to filter
+        catalog: Catalog the history was interned with. If given, the title is searched for with
+            the catalog's persistent title index and the history is filtered by track ID, rather
+            than indexing the distinct titles of the history on every call
+
+    Returns:
+        Series with the filter condition
+    """
+    return SongTitleFilter(song_title)(listening_history, catalog)
+
+
+def filter_by_artists(listening_history: pd.DataFrame, artists: List[str]) -> pd.Series:
+    """Filters a listening history DataFrame by a list of artists
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        artist: Name of the artist to filter
+
+    Returns:
+        Series with the filter condition
+    """
+    return ArtistsFilter(artists)(listening_history)
+
+
+def filter_by_not_skipped(listening_history: pd.DataFrame) -> pd.Series:
+    """Filters a listening history DataFrame by songs that were not skipped
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+
+    Returns:
+        Series with the filter condition
+    """
+    return NotSkippedFilter()(listening_history)
+
+
+def _time_condition(
+    listening_history: pd.DataFrame,
+    time_filter: Filter,
+    time_index: Optional[TimeIndex] = None,
+) -> pd.Series:
+    """Evaluates a filter on the timestamps of a listening history, resolving it to ranges of rows
+    by binary search if the history's time index is given rather than evaluating every row
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        time_filter: Filter that can resolve to ranges of rows of a time index
+        time_index: Index of the timestamps of the listening history
+
+    Returns:
+        Series with the filter condition
+    """
+    if time_index is None:
+        return time_filter(listening_history)
+    condition = np.zeros(len(listening_history), dtype=bool)
+    for start, end in time_filter.row_ranges(time_index):
+        condition[start:end] = True
+    return pd.Series(condition, index=listening_history.index)
+
+
+def filter_by_years(
+    listening_history: pd.DataFrame,
+    years: List[int],
+    time_index: Optional[TimeIndex] = None,
+) -> pd.Series:
+    """Filters a listening history DataFrame by years
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        years: List of years to filter
+        time_index: Index of the timestamps of the listening history, such as the time_index of
+            a ListeningHistory for its listening_history. If given, the years are found by binary
+            search instead of checking the year of every row
+
+    Returns:
+        Series with the filter condition
+    """
+    return _time_condition(listening_history, YearsFilter(years), time_index)
+
+
+def filter_by_date_range(
+    listening_history: pd.DataFrame,
+    start=None,
+    end=None,
+    time_index: Optional[TimeIndex] = None,
+) -> pd.Series:
+    """Filters a listening history DataFrame by a time range
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        start: First timestamp of the range. The range is unbounded if not given
+        end: Timestamp the range ends before. The range is unbounded if not given
+        time_index: Index of the timestamps of the listening history, such as the time_index of
+            a ListeningHistory for its listening_history. If given, the range is found by binary
+            search instead of comparing every row
+
+    Returns:
+        Series with the filter condition
+    """
+    return _time_condition(listening_history, DateRangeFilter(start, end), time_index)
+
+
+# ███████  ██████  ██████  ████████ ██ ███    ██  ██████
+# ██      ██    ██ ██   ██    ██    ██ ████   ██ ██
+# ███████ ██    ██ ██████     ██    ██ ██ ██  ██ ██   ███
+#      ██ ██    ██ ██   ██    ██    ██ ██  ██ ██ ██    ██
+# ███████  ██████  ██   ██    ██    ██ ██   ████  ██████
+
+
+def decategorize_fields(aggregate: pd.DataFrame) -> pd.DataFrame:
+    """Converts the categorical fields of an aggregated DataFrame back to plain values, so names
+    sort alphabetically rather than in category order
+
+    Arguments:
+        aggregate: DataFrame with aggregated listening history data
+
+    Returns:
+        DataFrame without categorical fields
+    """
+    return aggregate.astype(
+        {
+            field: dtype.categories.dtype
+            for field, dtype in aggregate.dtypes.items()
+            if isinstance(dtype, pd.CategoricalDtype)
+        }
+    )
+
+
+def top_positions(values: np.ndarray, top: Optional[int] = None) -> np.ndarray:
+    """Finds the values ranked in the top `top` in descending order by partial selection, so it
+    takes linear rather than sorting time. Every value tied with the last of them is included,
+    like the values with a rank(method="min") of at most `top`
+
+    Arguments:
+        values: Array of values to rank
+        top: Number of ranks to find. All values are returned if not given
+
+    Returns:
+        Sorted array with the positions of the values in the top `top`
+    """
+    if top is None or top >= len(values):
+        return np.arange(len(values))
+    if top <= 0:
+        return np.empty(0, dtype=np.intp)
+    threshold = np.partition(values, len(values) - top)[len(values) - top]
+    return np.flatnonzero(values >= threshold)
+
+
+def aggregate_by_id(
+    ids: pd.Series,
+    id_count: int,
+    weights: Optional[pd.Series] = None,
+    top: Optional[int] = None,
+) -> tuple:
+    """Counts the rows of each ID, or sums their weights, ignoring missing IDs of -1
+
+    Arguments:
+        ids: Series with the catalog ID of each row
+        id_count: Number of IDs in the catalog
+        weights: Series with the weight of each row. Rows are counted if not given
+        top: Number of ranks of totals to keep, as found by top_positions. All IDs are kept if
+            not given
+
+    Returns:
+        Array with the IDs that have at least one row and array with the total of each of them
+    """
+    shifted_ids = ids.to_numpy().astype(np.intp) + 1
+    counts = np.bincount(shifted_ids, minlength=id_count + 1)[1:]
+    present_ids = np.flatnonzero(counts)
+    if weights is None:
+        totals = counts[present_ids]
+    else:
+        totals = np.bincount(
+            shifted_ids, weights=weights.to_numpy(), minlength=id_count + 1
+        )[1:]
+        totals = totals[present_ids].round().astype(np.int64)
+    kept = top_positions(totals, top)
+    return present_ids[kept], totals[kept]
+
+
+class RollupCube:
+    """Play counts and playtimes of an interned listening history rolled up by day, artist, album,
+    track and whether the song was skipped. Filters that can be evaluated on the rolled up rows
+    select the rows top lists are computed from, instead of every play. The sorting functions
+    count the plays of rolled up rows by their play_count field
+
+    Arguments:
+        listening_history: Interned listening history to roll up
+    """
+
+    def __init__(self, listening_history: Optional[pd.DataFrame] = None):
+        self.rollup = pd.DataFrame()
+        if listening_history is not None:
+            self.add(listening_history)
+        return
+
+    def __len__(self) -> int:
+        return len(self.rollup)
+
+    def add(self, listening_history: pd.DataFrame) -> None:
+        """Rolls up more of the listening history, merging it with the rows rolled up before
+
+        Arguments:
+            listening_history: Interned listening history to roll up
+        """
+        # An empty history is only rolled up while there are no rows to give the rollup its fields
+        if not len(listening_history) and len(self.rollup.columns):
+            return
+        plays = listening_history[ROLLUP_FIELDS].assign(
+            ts=listening_history["ts"].dt.floor("D"),
+            play_count=np.int64(1),
+            ms_played=listening_history["ms_played"].astype(np.int64),
+        )
+        if len(self.rollup):
+            plays = pd.concat([self.rollup, plays], ignore_index=True)
+        self.rollup = (
+            plays.groupby(ROLLUP_FIELDS, dropna=False, sort=False)[
+                ["play_count", "ms_played"]
+            ]
+            .sum()
+            .reset_index()
+        )
+        return
+
+    def select(
+        self, filters: List[Filter], catalog: Optional[Catalog] = None
+    ) -> pd.DataFrame:
+        """Selects the rolled up rows that pass a list of filters
+
+        Arguments:
+            filters: Filters that can be evaluated on the rolled up rows
+            catalog: Catalog the history was interned with
+
+        Returns:
+            DataFrame with the rolled up rows that pass the filters
+        """
+        return apply_filters(self.rollup, filters, catalog)
+
+
+def _song_ids(listening_history: pd.DataFrame, catalog: Catalog) -> pd.Series:
+    """Looks up the song ID of the track of each row of an interned listening history, so songs
+    released with several URIs are aggregated as one song like when grouping by artist and name
+
+    Arguments:
+        listening_history: Interned DataFrame with listening history data, or rolled up rows
+        catalog: Catalog the history was interned with
+
+    Returns:
+        Series with the song ID of each row, or -1 for tracks without an artist or name
+    """
+    return pd.Series(
+        catalog.track_song_ids[listening_history["track_id"].to_numpy()],
+        index=listening_history.index,
+    )
+
+
+def sort_songs_by_play_count(
+    listening_history: pd.DataFrame,
+    catalog: Optional[Catalog] = None,
+    top: Optional[int] = None,
+) -> pd.DataFrame:
+    """Sorts a listening history DataFrame by song play count
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        catalog: Catalog the history was interned with. If given, songs are counted by the song
+            ID of each track ID and rows rolled up by a RollupCube can be sorted
+        top: Number of ranks to return, including every song tied with the last one. All
+            songs are returned if not given
+
+    Returns:
+        DataFrame sorted by song play count
+    """
+    if catalog is not None and "track_id" in listening_history.columns:
+        song_ids, play_counts = aggregate_by_id(
+            _song_ids(listening_history, catalog),
+            catalog.song_count,
+            weights=listening_history.get("play_count"),
+            top=top,
+        )
+        song_play_counts = pd.DataFrame(
+            {
+                "master_metadata_album_artist_name": catalog.artist_names[
+                    catalog.song_artist_ids[song_ids]
+                ],
+                "master_metadata_track_name": catalog.song_names[song_ids],
+                "play_count": play_counts,
+            }
+        )
+    else:
+        song_play_counts = decategorize_fields(
+            listening_history.groupby(
+                ["master_metadata_album_artist_name", "master_metadata_track_name"],
+                as_index=False,
+                observed=True,
+            )
+            .size()
+            .rename(columns={"size": "play_count"})
+        )
+        song_play_counts = song_play_counts.take(
+            top_positions(song_play_counts["play_count"].to_numpy(), top)
+        )
+
+    # Rank songs by play count
+    song_play_counts["rank"] = song_play_counts["play_count"].rank(
+        ascending=False, method="min"
+    )
+    # Sort by rank and reset index for cleaner output
+    ranked_songs = song_play_counts.sort_values(
+        by=["rank", "master_metadata_track_name"]
+    ).reset_index(drop=True)
+
+    # Reorganize columns for clarity
+    ranked_songs = ranked_songs[
+        [
+            "rank",
+            "master_metadata_track_name",
+            "master_metadata_album_artist_name",
+            "play_count",
+        ]
+    ]
+
+    return ranked_songs
+
+
+def sort_artists_by_play_count(
+    listening_history: pd.DataFrame,
+    catalog: Optional[Catalog] = None,
+    top: Optional[int] = None,
+) -> pd.DataFrame:
+    """Sorts a listening history DataFrame by artist play count
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        catalog: Catalog the history was interned with. If given, artists are counted by artist ID
+            and rows rolled up by a RollupCube can be sorted
+        top: Number of ranks to return, including every artist tied with the last one. All
+            artists are returned if not given
+
+    Returns:
+        DataFrame sorted by artist play count
+    """
+    if catalog is not None and "artist_id" in listening_history.columns:
+        artist_ids, play_counts = aggregate_by_id(
+            listening_history["artist_id"],
+            catalog.artist_count,
+            weights=listening_history.get("play_count"),
+            top=top,
+        )
+        return pd.Series(
+            play_counts,
+            index=pd.Index(
+                catalog.artist_names[artist_ids],
+                name="master_metadata_album_artist_name",
+            ),
+            name="count",
+        ).sort_values(ascending=False, kind="stable")
+
+    artist_play_counts = listening_history[
+        "master_metadata_album_artist_name"
+    ].value_counts()
+    # Categorical fields also count the artists that were filtered out
+    artist_play_counts = artist_play_counts[artist_play_counts > 0]
+    artist_play_counts = artist_play_counts.take(
+        top_positions(artist_play_counts.to_numpy(), top)
+    )
+    if isinstance(artist_play_counts.index, pd.CategoricalIndex):
+        artist_play_counts.index = artist_play_counts.index.astype(
+            artist_play_counts.index.categories.dtype
+        )
+    return artist_play_counts
+
+
+def sort_albums_by_play_count(
+    listening_history: pd.DataFrame,
+    catalog: Optional[Catalog] = None,
+    top: Optional[int] = None,
+) -> pd.DataFrame:
+    """Sorts a listening history DataFrame by album play count
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        catalog: Catalog the history was interned with. If given, albums are counted by album ID
+            and rows rolled up by a RollupCube can be sorted
+        top: Number of ranks to return, including every album tied with the last one. All
+            albums are returned if not given
+
+    Returns:
+        DataFrame sorted by album play count
+    """
+    if catalog is not None and "album_id" in listening_history.columns:
+        album_ids, play_counts = aggregate_by_id(
+            listening_history["album_id"],
+            catalog.album_count,
+            weights=listening_history.get("play_count"),
+            top=top,
+        )
+        song_play_counts = pd.DataFrame(
+            {
+                "master_metadata_album_artist_name": catalog.artist_names[
+                    catalog.album_artist_ids[album_ids]
+                ],
+                "master_metadata_album_album_name": catalog.album_names[album_ids],
+                "play_count": play_counts,
+            }
+        )
+    else:
+        song_play_counts = decategorize_fields(
+            listening_history.groupby(
+                [
+                    "master_metadata_album_artist_name",
+                    "master_metadata_album_album_name",
+                ],
+                as_index=False,
+                observed=True,
+            )
+            .size()
+            .rename(columns={"size": "play_count"})
+        )
+        song_play_counts = song_play_counts.take(
+            top_positions(song_play_counts["play_count"].to_numpy(), top)
+        )
+
+    # Rank albums by play count
+    song_play_counts["rank"] = song_play_counts["play_count"].rank(
+        ascending=False, method="min"
+    )
+    # Sort by rank and reset index for cleaner output
+    ranked_songs = song_play_counts.sort_values(
+        by=["rank", "master_metadata_album_album_name"]
+    ).reset_index(drop=True)
+
+    # Reorganize columns for clarity
+    ranked_songs = ranked_songs[
+        [
+            "rank",
+            "master_metadata_album_album_name",
+            "master_metadata_album_artist_name",
+            "play_count",
+        ]
+    ]
+
+    return ranked_songs
+
+
+def sort_artists_by_playtime(
+    listening_history: pd.DataFrame,
+    catalog: Optional[Catalog] = None,
+    top: Optional[int] = None,
+) -> pd.DataFrame:
+    """Sorts a listening history DataFrame by artist playtime
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        catalog: Catalog the history was interned with. If given, playtime is summed by artist ID
+            and rows rolled up by a RollupCube can be sorted
+        top: Number of ranks to return, including every artist tied with the last one. All
+            artists are returned if not given
+
+    Returns:
+        DataFrame sorted by artist playtime
+    """
+    if catalog is not None and "artist_id" in listening_history.columns:
+        artist_ids, playtimes = aggregate_by_id(
+            listening_history["artist_id"],
+            catalog.artist_count,
+            weights=listening_history["ms_played"],
+            top=top,
+        )
+        artist_playtime = pd.DataFrame(
+            {
+                "master_metadata_album_artist_name": catalog.artist_names[artist_ids],
+                "ms_played": playtimes,
+            }
+        )
+    else:
+        artist_playtime = decategorize_fields(
+            listening_history.groupby(
+                "master_metadata_album_artist_name", as_index=False, observed=True
+            ).agg({"ms_played": "sum"})
+        )
+        artist_playtime = artist_playtime.take(
+            top_positions(artist_playtime["ms_played"].to_numpy(), top)
+        )
+    return _rank_by_playtime(artist_playtime)
+
+
+def _rank_by_playtime(playtime: pd.DataFrame) -> pd.DataFrame:
+    """Sorts aggregated playtimes, numbers them from 1 and converts them to durations
+
+    Arguments:
+        playtime: DataFrame with the ms_played of each artist, song or album
+
+    Returns:
+        DataFrame sorted by playtime, with a Total Playtime field instead of ms_played
+    """
+    playtime = playtime.rename(columns={"ms_played": "total_playtime_ms"}).sort_values(
+        by="total_playtime_ms", ascending=False, kind="stable"
+    )
+    playtime.reset_index(drop=True, inplace=True)
+    playtime.index = playtime.index + 1
+    playtime["Total Playtime"] = pd.to_timedelta(
+        playtime["total_playtime_ms"], unit="ms"
+    )
+    playtime.drop(columns="total_playtime_ms", inplace=True)
+    return playtime
+
+
+def sort_songs_by_playtime(
+    listening_history: pd.DataFrame,
+    catalog: Optional[Catalog] = None,
+    top: Optional[int] = None,
+) -> pd.DataFrame:
+    """Sorts a listening history DataFrame by song playtime
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        catalog: Catalog the history was interned with. If given, playtime is summed by the song
+            ID of each track ID and rows rolled up by a RollupCube can be sorted
+        top: Number of ranks to return, including every song tied with the last one. All songs
+            are returned if not given
+
+    Returns:
+        DataFrame sorted by song playtime
+    """
+    if catalog is not None and "track_id" in listening_history.columns:
+        song_ids, playtimes = aggregate_by_id(
+            _song_ids(listening_history, catalog),
+            catalog.song_count,
+            weights=listening_history["ms_played"],
+            top=top,
+        )
+        song_playtime = pd.DataFrame(
+            {
+                "master_metadata_track_name": catalog.song_names[song_ids],
+                "master_metadata_album_artist_name": catalog.artist_names[
+                    catalog.song_artist_ids[song_ids]
+                ],
+                "ms_played": playtimes,
+            }
+        )
+    else:
+        song_playtime = decategorize_fields(
+            listening_history.groupby(
+                ["master_metadata_track_name", "master_metadata_album_artist_name"],
+                as_index=False,
+                observed=True,
+            ).agg({"ms_played": "sum"})
+        )
+        song_playtime = song_playtime.take(
+            top_positions(song_playtime["ms_played"].to_numpy(), top)
+        )
+    return _rank_by_playtime(song_playtime)
+
+
+def sort_albums_by_playtime(
+    listening_history: pd.DataFrame,
+    catalog: Optional[Catalog] = None,
+    top: Optional[int] = None,
+) -> pd.DataFrame:
+    """Sorts a listening history DataFrame by album playtime
+
+    Arguments:
+        listening_history: DataFrame with listening history data
+        catalog: Catalog the history was interned with. If given, playtime is summed by album ID
+            and rows rolled up by a RollupCube can be sorted
+        top: Number of ranks to return, including every album tied with the last one. All albums
+            are returned if not given
+
+    Returns:
+        DataFrame sorted by album playtime
+    """
+    if catalog is not None and "album_id" in listening_history.columns:
+        album_ids, playtimes = aggregate_by_id(
+            listening_history["album_id"],
+            catalog.album_count,
+            weights=listening_history["ms_played"],
+            top=top,
+        )
+        album_playtime = pd.DataFrame(
+            {
+                "master_metadata_album_album_name": catalog.album_names[album_ids],
+                "master_metadata_album_artist_name": catalog.artist_names[
+                    catalog.album_artist_ids[album_ids]
+                ],
+                "ms_played": playtimes,
+            }
+        )
+    else:
+        album_playtime = decategorize_fields(
+            listening_history.groupby(
+                [
+                    "master_metadata_album_album_name",
+                    "master_metadata_album_artist_name",
+                ],
+                as_index=False,
+                observed=True,
+            ).agg({"ms_played": "sum"})
+        )
+        album_playtime = album_playtime.take(
+            top_positions(album_playtime["ms_played"].to_numpy(), top)
+        )
+    return _rank_by_playtime(album_playtime)
+
+
+# ██████  ███████ ██████   ██████  ██████  ████████ ███████
+# ██   ██ ██      ██   ██ ██    ██ ██   ██    ██    ██
+# ██████  █████   ██████  ██    ██ ██████     ██    ███████
+# ██   ██ ██      ██      ██    ██ ██   ██    ██         ██
+# ██   ██ ███████ ██       ██████  ██   ██    ██    ███████
+
+
+# Functions that compute each table of a report, by name
+REPORT_TABLES = {
+    "artists_by_count": sort_artists_by_play_count,
+    "artists_by_playtime": sort_artists_by_playtime,
+    "songs_by_count": sort_songs_by_play_count,
+    "songs_by_playtime": sort_songs_by_playtime,
+    "albums_by_count": sort_albums_by_play_count,
+    "albums_by_playtime": sort_albums_by_playtime,
+}
+
+# Formats a report can be written in
+REPORT_FORMATS = ["json", "csv"]
+
+
+def group_by_year(listening_history: pd.DataFrame) -> pd.DataFrame:
+    """Groups an interned listening history by year, artist, album and track in a single pass
+
+    Arguments:
+        listening_history: Interned DataFrame with listening history data, or rows rolled up by a
+            RollupCube
+
+    Returns:
+        DataFrame with the play count and ms_played of each year, artist, album and track
+    """
+    fields = ["artist_id", "album_id", "track_id"]
+    return (
+        listening_history[fields]
+        .assign(
+            year=listening_history["ts"].dt.year,
+            play_count=listening_history.get("play_count", np.int64(1)),
+            ms_played=listening_history["ms_played"].astype(np.int64),
+        )
+        .groupby(["year", *fields])[["play_count", "ms_played"]]
+        .sum()
+        .reset_index()
+    )
+
+
+def build_report(
+    listening_history: pd.DataFrame, catalog: Catalog, top: Optional[int] = None
+) -> Dict[str, Dict[str, Union[pd.DataFrame, pd.Series]]]:
+    """Computes the top artists, songs and albums by play count and playtime for every year and
+    for all time. The history is grouped once, and every table is computed from the groups
+
+    Arguments:
+        listening_history: Interned DataFrame with listening history data, or rows rolled up by a
+            RollupCube
+        catalog: Catalog the history was interned with
+        top: Number of ranks in each table. All artists, songs and albums are kept if not given
+
+    Returns:
+        Dictionary with the tables of "all_time" and of each year, by the names in REPORT_TABLES
+    """
+    grouped = group_by_year(listening_history)
+    periods = {"all_time": grouped}
+    periods.update(
+        (str(year), rows) for year, rows in grouped.groupby("year", sort=True)
+    )
+    return {
+        period: {
+            name: sort_table(rows, catalog, top)
+            for name, sort_table in REPORT_TABLES.items()
+        }
+        for period, rows in periods.items()
+    }
+
+
+def _report_records(table: Union[pd.DataFrame, pd.Series]) -> pd.DataFrame:
+    """Converts a table of a report to plain records, with playtimes in milliseconds"""
+    if isinstance(table, pd.Series):
+        return table.reset_index()
+    table = table.reset_index(drop=True)
+    if "Total Playtime" in table.columns:
+        table.insert(
+            table.columns.get_loc("Total Playtime"),
+            "total_playtime_ms",
+            table["Total Playtime"] // pd.Timedelta(milliseconds=1),
+        )
+        table = table.drop(columns="Total Playtime")
+    return table
+
+
+def write_report(
+    report: Dict[str, Dict[str, Union[pd.DataFrame, pd.Series]]],
+    output_dir: str,
+    file_format: str = "json",
+) -> List[pathlib.Path]:
+    """Writes a report to a directory, either as a single report.json or as a CSV file named
+    after the period and table of each table
+
+    Arguments:
+        report: Report computed by build_report
+        output_dir: Directory to write the report to. It's created if it doesn't exist
+        file_format: One of REPORT_FORMATS
+
+    Returns:
+        List with the paths of the files written
+    """
+    if file_format not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format {file_format!r}")
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if file_format == "csv":
+        paths = []
+        for period, tables in report.items():
+            for name, table in tables.items():
+                path = output_dir / f"{period}_{name}.csv"
+                _report_records(table).to_csv(path, index=False)
+                paths.append(path)
+        return paths
+    path = output_dir / "report.json"
+    with open(path, "w", encoding="UTF-8") as file:
+        json.dump(
+            {
+                period: {
+                    name: _report_records(table).to_dict("records")
+                    for name, table in tables.items()
+                }
+                for period, tables in report.items()
+            },
+            file,
+            indent=2,
+            default=int,
+        )
+    return [path]
+
+
+# ███████ ███████ ███████ ███████ ██  ██████  ███    ██ ███████
+# ██      ██      ██      ██      ██ ██    ██ ████   ██ ██
+# ███████ █████   ███████ ███████ ██ ██    ██ ██ ██  ██ ███████
+#      ██ ██           ██      ██ ██ ██    ██ ██  ██ ██      ██
+# ███████ ███████ ███████ ███████ ██  ██████  ██   ████ ███████
+
+
+# Longest pause between two plays of the same listening session
+SESSION_GAP = pd.Timedelta(minutes=30)
+
+# Microseconds in a day, to number the days of timestamps
+MICROSECONDS_PER_DAY = 86_400_000_000
+
+
+def _play_bounds(listening_history: pd.DataFrame) -> tuple:
+    """Returns the start and end of each play in microseconds since the epoch. Timestamps of the
+    export mark when a play stopped, so plays start ms_played before them
+
+    Arguments:
+        listening_history: DataFrame with listening history data, sorted by time
+
+    Returns:
+        Tuple of int64 arrays with the start and end of each play
+    """
+    ends = listening_history["ts"].to_numpy().astype("datetime64[us]").view(np.int64)
+    starts = ends - listening_history["ms_played"].to_numpy(dtype=np.int64) * 1000
+    return starts, ends
+
+
+def _session_breaks(
+    listening_history: pd.DataFrame, gap: pd.Timedelta = SESSION_GAP
+) -> np.ndarray:
+    """Finds the plays that start a listening session
+
+    Arguments:
+        listening_history: DataFrame with listening history data, sorted by time
+        gap: Longest pause between two plays of the same session
+
+    Returns:
+        Boolean array that's True for the first play of each session
+    """
+    starts, ends = _play_bounds(listening_history)
+    if len(ends) == 0:
+        return np.empty(0, dtype=bool)
+    # Comparing with the latest end so far keeps plays that overlap earlier ones in their session
+    pauses = starts[1:] - np.maximum.accumulate(ends)[:-1]
+    return np.concatenate([[True], pauses > gap // pd.Timedelta(microseconds=1)])
+
+
+def assign_sessions(
+    listening_history: pd.DataFrame, gap: pd.Timedelta = SESSION_GAP
+) -> pd.Series:
+    """Numbers the listening sessions of a listening history. A session is a run of plays with no
+    pause longer than `gap` between the end of one and the start of the next
+
+    Arguments:
+        listening_history: DataFrame with listening history data, sorted by time
+        gap: Longest pause between two plays of the same session
+
+    Returns:
+        Series with the session number of each play, counting from 0
+    """
+    return pd.Series(
+        np.cumsum(_session_breaks(listening_history, gap)) - 1,
+        index=listening_history.index,
+        name="session",
+    )
+
+
+def summarize_sessions(
+    listening_history: pd.DataFrame, gap: pd.Timedelta = SESSION_GAP
+) -> pd.DataFrame:
+    """Summarizes the listening sessions of a listening history, as numbered by assign_sessions
+
+    Arguments:
+        listening_history: DataFrame with listening history data, sorted by time
+        gap: Longest pause between two plays of the same session
+
+    Returns:
+        DataFrame with the start, end, duration, play count, playtime in milliseconds, and first
+        song and artist of each session
+    """
+    first_plays = np.flatnonzero(_session_breaks(listening_history, gap))
+    starts, ends = _play_bounds(listening_history)
+    if len(first_plays) == 0:
+        starts = ends = np.empty(0, dtype=np.int64)
+        play_counts = ms_played = np.empty(0, dtype=np.int64)
+    else:
+        play_counts = np.diff(np.append(first_plays, len(listening_history)))
+        ms_played = np.add.reduceat(
+            listening_history["ms_played"].to_numpy(dtype=np.int64), first_plays
+        )
+        starts = np.minimum.reduceat(starts, first_plays)
+        ends = np.maximum.reduceat(ends, first_plays)
+    starts = starts.view("datetime64[us]")
+    ends = ends.view("datetime64[us]")
+    first_songs = listening_history.iloc[first_plays]
+    return pd.DataFrame(
+        {
+            "start": starts,
+            "end": ends,
+            "duration": ends - starts,
+            "play_count": play_counts,
+            "ms_played": ms_played,
+            "master_metadata_track_name": first_songs[
+                "master_metadata_track_name"
+            ].to_numpy(dtype=object),
+            "master_metadata_album_artist_name": first_songs[
+                "master_metadata_album_artist_name"
+            ].to_numpy(dtype=object),
+        },
+        index=pd.RangeIndex(len(first_plays), name="session"),
+    )
+
+
+def sort_artists_by_session_starts(
+    sessions: pd.DataFrame, top: Optional[int] = None
+) -> pd.Series:
+    """Sorts artists by the number of listening sessions they started
+
+    Arguments:
+        sessions: DataFrame with listening sessions, as summarized by summarize_sessions
+        top: Number of ranks to return, including every artist tied with the last one. All
+            artists are returned if not given
+
+    Returns:
+        Series with the number of sessions started by each artist
+    """
+    session_starts = sessions["master_metadata_album_artist_name"].value_counts()
+    return session_starts.take(top_positions(session_starts.to_numpy(), top))
+
+
+def find_daily_streaks(listening_history: pd.DataFrame) -> pd.DataFrame:
+    """Finds the streaks of consecutive days with at least one play, by UTC date
+
+    Arguments:
+        listening_history: DataFrame with listening history data, sorted by time
+
+    Returns:
+        DataFrame with the first day, last day and number of days of each streak, in time order
+    """
+    _, ends = _play_bounds(listening_history)
+    days = ends // MICROSECONDS_PER_DAY
+    days = days[np.diff(days, prepend=days[:1] - 1) != 0]
+    first_days = np.flatnonzero(np.diff(days, prepend=days[:1] - 2) != 1)
+    day_counts = np.diff(np.append(first_days, len(days)))
+    starts = days[first_days].astype("datetime64[D]").astype("datetime64[us]")
+    return pd.DataFrame(
+        {
+            "start": starts,
+            "end": starts + (day_counts - 1).astype("timedelta64[D]"),
+            "days": day_counts,
+        }
+    )
+
+
+def longest_streak(listening_history: pd.DataFrame) -> pd.Series:
+    """Finds the longest streak of consecutive days with at least one play, by UTC date. The
+    earliest streak wins ties
+
+    Arguments:
+        listening_history: DataFrame with listening history data, sorted by time
+
+    Returns:
+        Series with the first day, last day and number of days of the streak. The days are NaT and
+        the number of days 0 if there are no plays
+    """
+    streaks = find_daily_streaks(listening_history)
+    if streaks.empty:
+        return pd.Series({"start": pd.NaT, "end": pd.NaT, "days": 0})
+    return streaks.iloc[streaks["days"].to_numpy().argmax()]
+
+
+# ██████  ██ ███    ██ ███████
+# ██   ██ ██ ████   ██ ██
+# ██████  ██ ██ ██  ██ ███████
+# ██   ██ ██ ██  ██ ██      ██
+# ██████  ██ ██   ████ ███████
+
+
+# Microseconds in an hour, to number the hours of timestamps
+MICROSECONDS_PER_HOUR = 3_600_000_000
+
+# Weekday of the first day of the epoch, 1970-01-01, counting from Monday as 0
+EPOCH_WEEKDAY = 3
+
+
+class TimeBins:
+    """Play counts and playtimes of a listening history binned by hour of day and weekday, and by
+    month, in UTC. Bins are computed with integer arithmetic on the timestamps and kept as arrays,
+    so more history can be added without rebinning the history already added. Years are summed
+    from the months
+
+    Arguments:
+        listening_history: DataFrame with listening history data to bin
+    """
+
+    def __init__(self, listening_history: Optional[pd.DataFrame] = None):
+        self.hour_weekday_counts = np.zeros(7 * 24, dtype=np.int64)
+        self.hour_weekday_playtimes = np.zeros(7 * 24, dtype=np.int64)
+        # Month bins start at first_month, counted in months since the epoch
+        self.first_month = 0
+        self.month_counts = np.zeros(0, dtype=np.int64)
+        self.month_playtimes = np.zeros(0, dtype=np.int64)
+        if listening_history is not None:
+            self.add(listening_history)
+        return
+
+    def add(self, listening_history: pd.DataFrame) -> None:
+        """Adds the plays of a listening history to the bins
+
+        Arguments:
+            listening_history: DataFrame with listening history data
+        """
+        if listening_history.empty:
+            return
+        timestamps = listening_history["ts"].to_numpy().astype("datetime64[us]")
+        microseconds = timestamps.view(np.int64)
+        hours = microseconds // MICROSECONDS_PER_HOUR
+        weekdays = (hours // 24 + EPOCH_WEEKDAY) % 7
+        hour_weekday_bins = weekdays * 24 + hours % 24
+        months = timestamps.astype("datetime64[M]").view(np.int64)
+        playtimes = listening_history["ms_played"].to_numpy(dtype=np.float64)
+        play_counts = listening_history.get("play_count")
+        if play_counts is not None:
+            play_counts = play_counts.to_numpy(dtype=np.float64)
+
+        self.hour_weekday_counts += self._count(hour_weekday_bins, play_counts, 7 * 24)
+        self.hour_weekday_playtimes += self._count(hour_weekday_bins, playtimes, 7 * 24)
+
+        first_month = int(months.min())
+        end_month = int(months.max()) + 1
+        if len(self.month_counts):
+            first_month = min(first_month, self.first_month)
+            end_month = max(end_month, self.first_month + len(self.month_counts))
+        for name, weights in (
+            ("month_counts", play_counts),
+            ("month_playtimes", playtimes),
+        ):
+            grown = np.zeros(end_month - first_month, dtype=np.int64)
+            offset = self.first_month - first_month
+            grown[offset : offset + len(getattr(self, name))] = getattr(self, name)
+            grown += self._count(months - first_month, weights, end_month - first_month)
+            setattr(self, name, grown)
+        self.first_month = first_month
+        return
+
+    @staticmethod
+    def _count(
+        bins: np.ndarray, weights: Optional[np.ndarray], bin_count: int
+    ) -> np.ndarray:
+        """Counts the rows in each bin, or sums their weights
+
+        Arguments:
+            bins: Array with the bin of each row
+            weights: Array with the weight of each row. Each row is counted once if not given
+            bin_count: Number of bins
+
+        Returns:
+            int64 array with the total of each bin
+        """
+        if weights is None:
+            return np.bincount(bins, minlength=bin_count)
+        return (
+            np.bincount(bins, weights=weights, minlength=bin_count)
+            .round()
+            .astype(np.int64)
+        )
+
+    def by_hour_and_weekday(self) -> pd.DataFrame:
+        """Returns the play count and ms_played of each hour of each weekday, with Monday as
+        weekday 0. Unstack the hours for a weekday by hour heatmap
+        """
+        return pd.DataFrame(
+            {
+                "play_count": self.hour_weekday_counts,
+                "ms_played": self.hour_weekday_playtimes,
+            },
+            index=pd.MultiIndex.from_product(
+                [range(7), range(24)], names=["weekday", "hour"]
+            ),
+        )
+
+    def by_month(self) -> pd.DataFrame:
+        """Returns the play count and ms_played of each month from the first to the last month with
+        plays, indexed by the first day of the month
+        """
+        months = np.arange(
+            self.first_month, self.first_month + len(self.month_counts)
+        ).astype("datetime64[M]")
+        return pd.DataFrame(
+            {"play_count": self.month_counts, "ms_played": self.month_playtimes},
+            index=pd.DatetimeIndex(months.astype("datetime64[us]"), name="month"),
+        )
+
+    def by_year(self) -> pd.DataFrame:
+        """Returns the play count and ms_played of each year from the first to the last year with
+        plays
+        """
+        years = (
+            1970
+            + np.arange(self.first_month, self.first_month + len(self.month_counts))
+            // 12
+        )
+        by_month = pd.DataFrame(
+            {"play_count": self.month_counts, "ms_played": self.month_playtimes}
+        )
+        return by_month.groupby(pd.Index(years, name="year")).sum()
+
+
+# ███████ ████████ ██████  ███████  █████  ███    ███ ██ ███    ██  ██████
+# ██         ██    ██   ██ ██      ██   ██ ████  ████ ██ ████   ██ ██
+# ███████    ██    ██████  █████   ███████ ██ ████ ██ ██ ██ ██  ██ ██   ███
+#      ██    ██    ██   ██ ██      ██   ██ ██  ██  ██ ██ ██  ██ ██ ██    ██
+# ███████    ██    ██   ██ ███████ ██   ██ ██      ██ ██ ██   ████  ██████
+
+
+# ID fields of an interned listening history
+ID_FIELDS = ["artist_id", "album_id", "track_id"]
+
+
+class StreamingAggregates:
+    """Play counts and playtimes by artist, album and track, accumulated one chunk of listening
+    history at a time. Memory is bounded by the number of distinct artists, albums and tracks
+    rather than by the number of plays, and aggregates of different parts of a listening history
+    can be merged
+
+    Arguments:
+        filters: Filters applied to each chunk before it's aggregated. Precomputed conditions can't
+            be used, since they only apply to the rows they were computed from
+    """
+
+    def __init__(self, filters: Iterable[Filter] = ()):
+        self.filters = list(filters)
+        self.catalog = Catalog()
+        self.play_counts = {
+            id_field: np.zeros(0, dtype=np.int64) for id_field in ID_FIELDS
+        }
+        self.playtimes = {
+            id_field: np.zeros(0, dtype=np.int64) for id_field in ID_FIELDS
+        }
+        self.play_count = 0
+        return
+
+    def _accumulate(
+        self,
+        id_field: str,
+        ids: np.ndarray,
+        play_counts: Optional[np.ndarray],
+        playtimes: np.ndarray,
+    ) -> None:
+        """Adds play counts and playtimes to the totals of IDs
+
+        Arguments:
+            id_field: ID field the IDs are of
+            ids: Array of IDs. Missing IDs of -1 are ignored
+            play_counts: Array with the play count of each ID. Each ID is counted once if not given
+            playtimes: Array with the ms_played of each ID
+        """
+        id_count = self.catalog.id_count(id_field)
+        present = ids >= 0
+        ids = ids[present]
+        for totals, weights in (
+            (self.play_counts, play_counts),
+            (self.playtimes, playtimes),
+        ):
+            if weights is None:
+                added = np.bincount(ids, minlength=id_count)
+            else:
+                added = np.bincount(
+                    ids, weights=weights[present], minlength=id_count
+                ).round()
+            grown = np.zeros(id_count, dtype=np.int64)
+            grown[: len(totals[id_field])] = totals[id_field]
+            totals[id_field] = grown + added.astype(np.int64)
+        return
+
+    def add_chunk(self, listening_history: pd.DataFrame) -> None:
+        """Filters a chunk of cleaned listening history and adds it to the aggregates
+
+        Arguments:
+            listening_history: Cleaned DataFrame with listening history data
+        """
+        interned = self.catalog.intern(listening_history)
+        filtered = apply_filters(interned, self.filters, self.catalog)
+        playtimes = filtered["ms_played"].to_numpy(dtype=np.int64)
+        for id_field in ID_FIELDS:
+            self._accumulate(id_field, filtered[id_field].to_numpy(), None, playtimes)
+        self.play_count += len(filtered)
+        return
+
+    def add_path(self, path: str, chunk_rows: int = HISTORY_CHUNK_ROWS) -> None:
+        """Reads a spotify listening history json a chunk at a time and adds it to the aggregates
+
+        Arguments:
+            path: Path to a spotify listening history json
+            chunk_rows: Number of records read at a time
+        """
+        for chunk in iter_listening_history_chunks(
+            path, chunk_rows, parse_timestamps=True
+        ):
+            if len(chunk):
+                self.add_chunk(clean_listening_history(chunk))
+        return
+
+    def merge(self, other: "StreamingAggregates") -> None:
+        """Adds the aggregates of another part of the listening history. Its artists, albums and
+        tracks are matched to these by interning its catalog entries in this catalog
+
+        Arguments:
+            other: Aggregates to add
+        """
+        catalog = other.catalog
+        tracks, albums, artists = (
+            np.arange(catalog.track_count),
+            np.arange(catalog.album_count),
+            np.arange(catalog.artist_count),
+        )
+        entries = pd.DataFrame(
+            {
+                "master_metadata_track_name": np.concatenate(
+                    [catalog.track_names[tracks], [None] * (len(albums) + len(artists))]
+                ),
+                "master_metadata_album_artist_name": np.concatenate(
+                    [
+                        catalog.artist_names[catalog.track_artist_ids[tracks]],
+                        catalog.artist_names[catalog.album_artist_ids[albums]],
+                        catalog.artist_names[artists],
+                    ]
+                ),
+                "master_metadata_album_album_name": np.concatenate(
+                    [
+                        catalog.album_names[catalog.track_album_ids[tracks]],
+                        catalog.album_names[albums],
+                        [None] * len(artists),
+                    ]
+                ),
+                "spotify_track_uri": np.concatenate(
+                    [catalog.track_uris[tracks], [None] * (len(albums) + len(artists))]
+                ),
+            },
+            dtype=object,
+        )
+        interned = self.catalog.intern(entries)
+        id_ranges = {
+            "track_id": slice(0, len(tracks)),
+            "album_id": slice(len(tracks), len(tracks) + len(albums)),
+            "artist_id": slice(len(tracks) + len(albums), len(entries)),
+        }
+        for id_field in ID_FIELDS:
+            ids = interned[id_field].to_numpy()[id_ranges[id_field]]
+            count = len(other.play_counts[id_field])
+            self._accumulate(
+                id_field,
+                ids[:count],
+                other.play_counts[id_field],
+                other.playtimes[id_field],
+            )
+        self.play_count += other.play_count
+        return
+
+    def _rows(self, id_field: str) -> pd.DataFrame:
+        """Returns the aggregates of the IDs with plays as rolled up rows the sorting functions
+        can sort
+
+        Arguments:
+            id_field: ID field to return the aggregates of
+
+        Returns:
+            DataFrame with the ID, play count and ms_played of each ID with plays
+        """
+        ids = np.flatnonzero(self.play_counts[id_field])
+        return pd.DataFrame(
+            {
+                id_field: ids,
+                "play_count": self.play_counts[id_field][ids],
+                "ms_played": self.playtimes[id_field][ids],
+            }
+        )
+
+    def get_top_artists_by_count(self, top: Optional[int] = None) -> pd.Series:
+        """Returns the artists by play count, like sort_artists_by_play_count"""
+        return sort_artists_by_play_count(self._rows("artist_id"), self.catalog, top)
+
+    def get_top_artists_by_playtime(self, top: Optional[int] = None) -> pd.DataFrame:
+        """Returns the artists by playtime, like sort_artists_by_playtime"""
+        return sort_artists_by_playtime(self._rows("artist_id"), self.catalog, top)
+
+    def get_top_songs_by_count(self, top: Optional[int] = None) -> pd.DataFrame:
+        """Returns the songs by play count, like sort_songs_by_play_count"""
+        return sort_songs_by_play_count(self._rows("track_id"), self.catalog, top)
+
+    def get_top_albums_by_count(self, top: Optional[int] = None) -> pd.DataFrame:
+        """Returns the albums by play count, like sort_albums_by_play_count"""
+        return sort_albums_by_play_count(self._rows("album_id"), self.catalog, top)
+
+
+def _aggregate_path(
+    path: str, filters: List[Filter], chunk_rows: int
+) -> StreamingAggregates:
+    """Aggregates a spotify listening history json out of core. Used by worker processes"""
+    aggregates = StreamingAggregates(filters)
+    aggregates.add_path(path, chunk_rows)
+    return aggregates
+
+
+def aggregate_listening_history_paths(
+    paths: Iterable[str],
+    filters: Iterable[Filter] = (),
+    chunk_rows: int = HISTORY_CHUNK_ROWS,
+    workers: Optional[int] = None,
+) -> StreamingAggregates:
+    """Aggregates spotify listening history jsons out of core, in parallel across a pool of
+    processes, and merges their aggregates in the order of the paths
+
+    Arguments:
+        paths: Paths to spotify listening history jsons
+        filters: Filters applied to each chunk before it's aggregated
+        chunk_rows: Number of records read at a time
+        workers: Number of worker processes. Defaults to the number of CPUs, and 1 reads the files
+            in this process
+
+    Returns:
+        Merged aggregates of all of the listening histories
+    """
+    paths = list(paths)
+    filters = list(filters)
+    aggregate = functools.partial(
+        _aggregate_path, filters=filters, chunk_rows=chunk_rows
+    )
+    if workers == 1 or len(paths) <= 1:
+        parts = map(aggregate, paths)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(aggregate, paths))
+    merged = StreamingAggregates(filters)
+    for part in parts:
+        merged.merge(part)
+    return merged
+
+
+AggregationCacheInfo = collections.namedtuple(
+    "AggregationCacheInfo", ["hits", "misses", "maxsize", "currsize"]
+)
+
+
+#  ██████ ██       █████  ███████ ███████
+# ██      ██      ██   ██ ██      ██
+# ██      ██      ███████ ███████ ███████
+# ██      ██      ██   ██      ██      ██
+#  ██████ ███████ ██   ██ ███████ ███████
+
+
+class ListeningHistory:
+    """Object containing listening history data and methods for analysis
+
+    Arguments:
+        cache_dir: Directory of the history cache. If given, cleaned histories read from json files
+            are cached there and reused the next time the same file is added
+        catalog: Catalog that interns tracks, artists and albums as integer IDs. Pass the same
+            catalog to several objects to share their IDs. A new catalog is created if not given
+        aggregation_cache_size: Number of aggregation results to keep. The least recently used
+            results are dropped first, and none are kept if 0
+        rollup: Whether to keep a RollupCube of the listening history, updated as history is
+            added. Top lists are then computed from it whenever all of the filters can be
+            evaluated on it
+        deduplicate: Whether to drop plays that were already added, so overlapping exports of
+            the same listening history are only counted once. Plays are identified by their
+            timestamp, track and playtime
+        profile: Whether to record the wall time, rows in and out and allocated bytes of each
+            stage of loading, filtering and aggregating the listening history in `stats`
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        catalog: Optional[Catalog] = None,
+        aggregation_cache_size: int = AGGREGATION_CACHE_SIZE,
+        rollup: bool = False,
+        deduplicate: bool = False,
+        profile: bool = False,
+    ):
+        self.cache_dir = cache_dir
+        self.catalog = Catalog() if catalog is None else catalog
+        self.aggregation_cache_size = aggregation_cache_size
+        self._listening_history = self.catalog.intern(
+            clean_listening_history(empty_listening_history())
+        )
+        self._rollup_cube = RollupCube(self._listening_history) if rollup else None
+        self.deduplicator = PlayDeduplicator() if deduplicate else None
+        self.stats = PipelineStats() if profile else None
+        self._aggregation_cache: collections.OrderedDict = collections.OrderedDict()
+        self._aggregation_cache_hits = 0
+        self._aggregation_cache_misses = 0
+        # Incremented whenever the filtered history changes
+        self._filter_state = 0
+        self._time_index: Optional[TimeIndex] = None
+        # Time bins of the filtered history, dropped whenever the filters change
+        self._time_bins: Optional[TimeBins] = None
+        # None when the filtered history has to be computed from scratch
+        self._filtered_history: Optional[pd.DataFrame] = None
+        # Cleaned histories that haven't been merged into the listening history yet
+        self._pending_histories: List[pd.DataFrame] = []
+        # Histories merged into the listening history that haven't been filtered yet
+        self._unfiltered_histories: List[pd.DataFrame] = []
+        # Filters that haven't been applied to the filtered history yet
+        self._unapplied_filters: List[Union[Filter, pd.Series]] = []
+        # Index label of the next row added, so rows keep their label when the history is sorted
+        self._next_label = 0
+        self.filters = []
+        return
+
+    @property
+    def listening_history(self) -> pd.DataFrame:
+        """DataFrame with all of the listening history added to the object, sorted by time. Rows
+        are labelled in the order they were added
+        """
+        if self._pending_histories:
+            new_history = run_stage(
+                self.stats,
+                "concat_histories",
+                concat_histories,
+                self._pending_histories,
+                ignore_index=False,
+            )
+            new_history = run_stage(
+                self.stats,
+                "sort_histories",
+                new_history.sort_values,
+                "ts",
+                kind="stable",
+            )
+            self._listening_history = run_stage(
+                self.stats,
+                "merge_histories_by_time",
+                merge_histories_by_time,
+                self._listening_history,
+                new_history,
+            )
+            self._unfiltered_histories.append(new_history)
+            if self._rollup_cube is not None:
+                run_stage(self.stats, "roll_up", self._rollup_cube.add, new_history)
+            self._pending_histories = []
+            self._time_index = None
+        return self._listening_history
+
+    @property
+    def rollup_cube(self) -> Optional[RollupCube]:
+        """Rollup cube of the listening history, if the object keeps one"""
+        self.listening_history
+        return self._rollup_cube
+
+    @property
+    def time_index(self) -> TimeIndex:
+        """Index of the timestamps of the listening history"""
+        listening_history = self.listening_history
+        if self._time_index is None:
+            self._time_index = run_stage(
+                self.stats,
+                "build_time_index",
+                TimeIndex,
+                listening_history.get("ts", pd.Series([], dtype="datetime64[us]")),
+            )
+        return self._time_index
+
+    @property
+    def filtered_history(self) -> pd.DataFrame:
+        """DataFrame with the listening history that passes all of the filters, sorted by time.
+        Filters added since it was last computed are only applied to the rows that passed the
+        others, and rows added since are filtered on their own and merged in
+        """
+        listening_history = self.listening_history
+        if not self.filters:
+            self._filtered_history = None
+            if self._time_bins is not None and self._unfiltered_histories:
+                run_stage(
+                    self.stats,
+                    "bin_times",
+                    self._time_bins.add,
+                    concat_histories(self._unfiltered_histories, ignore_index=False),
+                )
+        elif self._filtered_history is None:
+            self._filtered_history = run_stage(
+                self.stats,
+                "apply_filters",
+                apply_filters,
+                listening_history,
+                self.filters,
+                self.catalog,
+                self.time_index,
+            )
+        else:
+            if self._unapplied_filters:
+                self._filtered_history = run_stage(
+                    self.stats,
+                    "apply_filters",
+                    apply_filters,
+                    self._filtered_history,
+                    self._unapplied_filters,
+                    self.catalog,
+                )
+            if self._unfiltered_histories:
+                new_rows = run_stage(
+                    self.stats,
+                    "apply_filters",
+                    apply_filters,
+                    concat_histories(self._unfiltered_histories, ignore_index=False),
+                    self.filters,
+                    self.catalog,
+                )
+                self._filtered_history = run_stage(
+                    self.stats,
+                    "merge_histories_by_time",
+                    merge_histories_by_time,
+                    self._filtered_history,
+                    new_rows,
+                )
+                if self._time_bins is not None:
+                    run_stage(self.stats, "bin_times", self._time_bins.add, new_rows)
+        self._unapplied_filters = []
+        self._unfiltered_histories = []
+        if self._filtered_history is None:
+            return listening_history
+        return self._filtered_history
+
+    @property
+    def time_bins(self) -> TimeBins:
+        """Time bins of the filtered history. They're kept until the filters change, and history
+        added since is binned on its own and added to them
+        """
+        filtered_history = self.filtered_history
+        if self._time_bins is None:
+            self._time_bins = run_stage(
+                self.stats, "bin_times", TimeBins, filtered_history
+            )
+        return self._time_bins
+
     def __repr__(self):
         return prettify_fields(self.filtered_history).__repr__()
 
@@ -394,8 +3538,44 @@ class ListeningHistory:
         Arguments:
             new_history_path: Path to a spotify listening history json
         """
-        new_history_raw: pd.DataFrame = read_listening_history_json(new_history_path)
-        self.add_history(new_history_raw)
+        self._append_histories(
+            [load_listening_history(new_history_path, self.cache_dir, self.stats)]
+        )
+        return
+
+    def add_history_from_paths(
+        self, new_history_paths: Iterable[str], workers: Optional[int] = None
+    ) -> None:
+        """Adds several histories to the object from paths to spotify listening history jsons.
+        The files are read and cleaned in parallel across a pool of processes, then merged into the
+        listening history at once
+
+        Arguments:
+            new_history_paths: Paths to spotify listening history jsons
+            workers: Number of worker processes. Defaults to the number of CPUs, and 1 reads the
+                files in this process
+        """
+        paths = list(new_history_paths)
+        if self.stats is None:
+            load = functools.partial(load_listening_history, cache_dir=self.cache_dir)
+        else:
+            load = functools.partial(
+                _load_listening_history_with_stats,
+                cache_dir=self.cache_dir,
+                trace_memory=self.stats.trace_memory,
+            )
+        if workers == 1 or len(paths) <= 1:
+            loaded = [load(path) for path in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                loaded = list(executor.map(load, paths))
+        if self.stats is None:
+            new_histories = loaded
+        else:
+            new_histories = [new_history for new_history, _ in loaded]
+            for _, load_stats in loaded:
+                self.stats.extend(load_stats)
+        self._append_histories(new_histories)
         return
 
     def add_history(self, new_history_dataframe: pd.DataFrame) -> None:
@@ -405,62 +3585,326 @@ class ListeningHistory:
         Arguments:
             new_history_dataframe: DataFrame with listening history data
         """
-        new_history_songs_only = remove_non_songs(new_history_dataframe)
-        new_history_cleaned_fields = remove_unused_fields_from_history(
-            new_history_songs_only
+        self._append_histories(
+            [clean_listening_history(new_history_dataframe, self.stats)]
         )
-        new_history_cleaned_stamps = convert_timestamps_to_datetime(
-            new_history_cleaned_fields
-        )
-        self.listening_history = pd.concat(
-            [self.listening_history, new_history_cleaned_stamps], ignore_index=True
-        )
-        self.filtered_history = apply_filters(self.listening_history, self.filters)
         return
 
-    def add_filter(self, filter_condition: pd.Series) -> None:
-        """Adds a filter to the object and updatees the filtered history
+    def _append_histories(self, new_histories: List[pd.DataFrame]) -> None:
+        """Interns cleaned listening histories in the catalog, drops the plays that were already
+        added if deduplicating, and stages them to be merged into the listening history the next
+        time it's accessed, so adding many histories only concatenates them once
+
+        Arguments:
+            new_histories: Cleaned DataFrames with listening history data
+        """
+        for new_history in new_histories:
+            new_history = run_stage(
+                self.stats, "intern", self.catalog.intern, new_history
+            )
+            if self.deduplicator is not None:
+                new_history = run_stage(
+                    self.stats,
+                    "deduplicate",
+                    self.deduplicator.deduplicate,
+                    new_history,
+                )
+            labels = pd.RangeIndex(
+                self._next_label, self._next_label + len(new_history)
+            )
+            self._pending_histories.append(new_history.set_axis(labels, axis=0))
+            self._next_label += len(new_history)
+        self._invalidate_aggregations()
+        return
+
+    def add_filter(self, filter_condition: Union[Filter, pd.Series]) -> None:
+        """Adds a filter to the object. The filtered history is updated the next time it's accessed
 
         Arguments:
-            filter_condition: Condition to filter the listening history
+            filter_condition: Filter, or precomputed condition, to filter the listening history.
+                Filters are also evaluated on history added later. A precomputed condition is a
+                boolean Series indexed by the labels of the listening_history rows it was
+                computed from, and rows whose label isn't in it don't pass it. Rows added after
+                it was computed are never in it, so they're left out of the filtered history,
+                whether it's updated with the new rows or computed from scratch
         """
         self.filters.append(filter_condition)
-        self.filtered_history = apply_filters(self.listening_history, self.filters)
+        self._unapplied_filters.append(filter_condition)
+        self._time_bins = None
+        self._invalidate_aggregations()
         return
 
     def reset_filters(self) -> None:
         """Removes all applied filters"""
         self.filters = []
-        self.filtered_history = apply_filters(self.listening_history, self.filters)
+        self._unapplied_filters = []
+        self._filtered_history = None
+        self._time_bins = None
+        self._invalidate_aggregations()
+        return
+
+    def _invalidate_aggregations(self) -> None:
+        """Drops the cached aggregation results after the filtered history changes"""
+        self._filter_state += 1
+        self._aggregation_cache.clear()
         return
 
-    def get_top_artists_by_count(self) -> pd.Series:
-        """Returns the top ten artists in the listening history
+    def _aggregate(
+        self,
+        aggregation: str,
+        compute: Callable[[], pd.DataFrame],
+        top: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Returns the result of an aggregation of the filtered history, computing it only if it
+        isn't cached for the current filter state
+
+        Arguments:
+            aggregation: Name of the aggregation
+            compute: Function that computes the aggregation
+            top: Number of ranks the aggregation returns
+
+        Returns:
+            Copy of the aggregation result
+        """
+        key = (aggregation, top, self._filter_state)
+        if key in self._aggregation_cache:
+            self._aggregation_cache_hits += 1
+            self._aggregation_cache.move_to_end(key)
+            return self._aggregation_cache[key].copy()
+        self._aggregation_cache_misses += 1
+        result = run_stage(self.stats, f"aggregate_{aggregation}", compute)
+        if self.aggregation_cache_size > 0:
+            self._aggregation_cache[key] = result
+            while len(self._aggregation_cache) > self.aggregation_cache_size:
+                self._aggregation_cache.popitem(last=False)
+            result = result.copy()
+        return result
+
+    def aggregation_cache_info(self) -> AggregationCacheInfo:
+        """Returns the hits, misses, maximum size and current size of the aggregation cache"""
+        return AggregationCacheInfo(
+            self._aggregation_cache_hits,
+            self._aggregation_cache_misses,
+            self.aggregation_cache_size,
+            len(self._aggregation_cache),
+        )
+
+    def _aggregation_source(self) -> pd.DataFrame:
+        """Returns the rows top lists are computed from: the rolled up rows that pass the filters
+        if there's a rollup cube and all of the filters can be evaluated on it, otherwise the
+        filtered history
+        """
+        if self._rollup_cube is not None and all(
+            isinstance(f, Filter) and f.rollup_compatible for f in self.filters
+        ):
+            return self.rollup_cube.select(self.filters, self.catalog)
+        return self.filtered_history
+
+    def get_top_artists_by_count(self, top: Optional[int] = None) -> pd.Series:
+        """Returns the artists in the listening history by play count
 
         Arguments:
-            rank_count: Number of artists to return
+            top: Number of ranks to return, including every artist tied with the last one. All
+                artists are returned if not given
 
         Returns:
-            Series with the top `rank_count` artists
+            Series with the play count of the top `top` artists
         """
-        return sort_artists_by_play_count(self.filtered_history)
+        return self._aggregate(
+            "artists_by_count",
+            lambda: sort_artists_by_play_count(
+                self._aggregation_source(), self.catalog, top
+            ),
+            top,
+        )
 
-    def get_top_artists_by_playtime(self) -> pd.DataFrame:
+    def get_top_artists_by_playtime(self, top: Optional[int] = None) -> pd.DataFrame:
         """Returns the top artists in the listening history by playtime
 
+        Arguments:
+            top: Number of ranks to return, including every artist tied with the last one. All
+                artists are returned if not given
+
         Returns:
             DataFrame with the top artists by playtime
         """
-        return sort_artists_by_playtime(self.filtered_history)
+        return self._aggregate(
+            "artists_by_playtime",
+            lambda: sort_artists_by_playtime(
+                self._aggregation_source(), self.catalog, top
+            ),
+            top,
+        )
+
+    def get_top_songs_by_count(self, top: Optional[int] = None) -> pd.DataFrame:
+        """Returns the songs in the listening history by play count
+
+        Arguments:
+            top: Number of ranks to return, including every song tied with the last one. All
+                songs are returned if not given
+
+        Returns:
+            DataFrame with the top songs by play count
+        """
+        return self._aggregate(
+            "songs_by_count",
+            lambda: sort_songs_by_play_count(
+                self._aggregation_source(), self.catalog, top
+            ),
+            top,
+        )
+
+    def get_top_albums_by_count(self, top: Optional[int] = None) -> pd.DataFrame:
+        """Returns the albums in the listening history by play count
+
+        Arguments:
+            top: Number of ranks to return, including every album tied with the last one. All
+                albums are returned if not given
+
+        Returns:
+            DataFrame with the top albums by play count
+        """
+        return self._aggregate(
+            "albums_by_count",
+            lambda: sort_albums_by_play_count(
+                self._aggregation_source(), self.catalog, top
+            ),
+            top,
+        )
+
+    def get_report(
+        self, top: Optional[int] = None
+    ) -> Dict[str, Dict[str, Union[pd.DataFrame, pd.Series]]]:
+        """Returns the top artists, songs and albums by play count and playtime for every year
+        and for all time, computed in a single grouped pass over the filtered history
+
+        Arguments:
+            top: Number of ranks in each table. All artists, songs and albums are kept if not
+                given
+
+        Returns:
+            Dictionary with the tables of "all_time" and of each year, by the names in
+            REPORT_TABLES
+        """
+        return run_stage(
+            self.stats,
+            "build_report",
+            build_report,
+            self._aggregation_source(),
+            self.catalog,
+            top,
+        )
+
+    def get_plays_by_hour_and_weekday(self) -> pd.DataFrame:
+        """Returns the play count and ms_played of the filtered history by hour of day and
+        weekday, like TimeBins.by_hour_and_weekday
+        """
+        return self.time_bins.by_hour_and_weekday()
+
+    def get_plays_by_month(self) -> pd.DataFrame:
+        """Returns the play count and ms_played of the filtered history by month, like
+        TimeBins.by_month
+        """
+        return self.time_bins.by_month()
+
+    def get_plays_by_year(self) -> pd.DataFrame:
+        """Returns the play count and ms_played of the filtered history by year, like
+        TimeBins.by_year
+        """
+        return self.time_bins.by_year()
+
+    def get_sessions(self, gap: pd.Timedelta = SESSION_GAP) -> pd.DataFrame:
+        """Returns the listening sessions of the filtered history, like summarize_sessions
+
+        Arguments:
+            gap: Longest pause between two plays of the same session
+
+        Returns:
+            DataFrame with a row for each listening session
+        """
+        return run_stage(
+            self.stats,
+            "summarize_sessions",
+            summarize_sessions,
+            self.filtered_history,
+            gap,
+        )
+
+    def get_top_session_starting_artists(
+        self, top: Optional[int] = None, gap: pd.Timedelta = SESSION_GAP
+    ) -> pd.Series:
+        """Returns the artists by the number of listening sessions they started
+
+        Arguments:
+            top: Number of ranks to return, including every artist tied with the last one. All
+                artists are returned if not given
+            gap: Longest pause between two plays of the same session
+
+        Returns:
+            Series with the number of sessions started by each of the top `top` artists
+        """
+        return sort_artists_by_session_starts(self.get_sessions(gap), top)
+
+    def get_daily_streaks(self) -> pd.DataFrame:
+        """Returns the streaks of consecutive days in the filtered history, like
+        find_daily_streaks
+        """
+        return run_stage(
+            self.stats, "find_daily_streaks", find_daily_streaks, self.filtered_history
+        )
+
+    def get_longest_streak(self) -> pd.Series:
+        """Returns the longest streak of consecutive days in the filtered history, like
+        longest_streak
+        """
+        return longest_streak(self.filtered_history)
+
+    def search_song_title(self, song_title: str) -> pd.DataFrame:
+        """Returns the songs in the filtered history whose title contains a string, ignoring case
+
+        Arguments:
+            song_title: String to search for
+
+        Returns:
+            DataFrame with the matching rows of the filtered history
+        """
+        filtered_history = self.filtered_history
+        return filtered_history[
+            SongTitleFilter(song_title).evaluate(filtered_history, self.catalog)
+        ]
+
+    def memory_usage(self) -> pd.DataFrame:
+        """Returns the memory used by each field of the listening history and the filtered history
+
+        Returns:
+            DataFrame with the memory usage of each field in bytes
+        """
+        return pd.DataFrame(
+            {
+                "listening_history": self.listening_history.memory_usage(deep=True),
+                "filtered_history": self.filtered_history.memory_usage(deep=True),
+            }
+        )
+
+    def pretty_history(
+        self, page: Optional[int] = None, page_size: int = PAGE_SIZE
+    ) -> pd.DataFrame:
+        """Returns the filtered history with more human-readable column names, without copying it
 
-    def get_top_songs_by_count(self) -> pd.Series:
-        """Returns the songs in the listening history by play count"""
-        return sort_songs_by_play_count(self.filtered_history)
+        Arguments:
+            page: Number of the page of rows to return, like paginate. All rows are returned if
+                not given
+            page_size: Number of rows in each page
 
-    def get_top_albums_by_count(self) -> pd.Series:
-        """Returns the albums in the listening history by play count"""
-        return sort_albums_by_play_count(self.filtered_history)
+        Returns:
+            DataFrame with the filtered history, or a page of it
+        """
+        if page is None:
+            return prettify_fields(self.filtered_history)
+        return paginate(self.filtered_history, page, page_size)
 
-    def pretty_history(self) -> pd.DataFrame:
-        """Returns a the listening history with more human-readable column names"""
-        return prettify_fields(self.filtered_history)
+    def iter_pretty_pages(self, page_size: int = PAGE_SIZE) -> Iterator[pd.DataFrame]:
+        """Yields the pages of the filtered history with more human-readable column names, like
+        iter_pages
+        """
+        return iter_pages(self.filtered_history, page_size)
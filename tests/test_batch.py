@@ -0,0 +1,96 @@
+import json
+
+import pandas as pd
+
+import spotify_crapped.batch as batch
+import spotify_crapped.benchmark as benchmark
+import spotify_crapped.spotify_crapped as spotify_crapped
+
+
+def make_exports(exports_dir):
+    (exports_dir / "alice").mkdir(parents=True)
+    benchmark.generate_listening_history_json(
+        str(exports_dir / "alice" / "first.json"), 500, seed=0
+    )
+    benchmark.generate_listening_history_json(
+        str(exports_dir / "alice" / "second.json"), 500, seed=1
+    )
+    benchmark.generate_listening_history_json(
+        str(exports_dir / "bob.json"), 300, seed=2
+    )
+    (exports_dir / "empty").mkdir()
+    return
+
+
+def test_find_user_exports(tmp_path):
+    make_exports(tmp_path)
+    exports = batch.find_user_exports(str(tmp_path))
+    assert list(exports) == ["alice", "bob"]
+    assert [path.split("/")[-1] for path in exports["alice"]] == [
+        "first.json",
+        "second.json",
+    ]
+
+
+def test_analyse_users(tmp_path):
+    make_exports(tmp_path / "exports")
+    exports = batch.find_user_exports(str(tmp_path / "exports"))
+    playlist = pd.DataFrame(
+        {
+            "master_metadata_track_name": ["Track 0-0"],
+            "master_metadata_album_artist_name": ["Artist 0"],
+        }
+    )
+    exclusion_index = spotify_crapped.PlaylistExclusionIndex([playlist])
+    results = {
+        result.user: result
+        for result in batch.analyse_users(
+            exports, exclusion_index=exclusion_index, top=5, workers=1
+        )
+    }
+    for user, paths in exports.items():
+        lh = spotify_crapped.ListeningHistory()
+        lh.add_history_from_paths(paths, workers=1)
+        lh.add_filter(spotify_crapped.NotSkippedFilter())
+        lh.add_filter(spotify_crapped.PlaylistFilter(exclusion_index))
+        assert results[user].error is None
+        assert results[user].plays == len(lh.filtered_history)
+        pd.testing.assert_series_equal(
+            results[user].report["all_time"]["artists_by_count"],
+            lh.get_top_artists_by_count(5),
+        )
+        songs = results[user].report["all_time"]["songs_by_count"]
+        assert "Track 0-0" not in songs["master_metadata_track_name"].tolist()
+
+    written = list(
+        batch.analyse_users(
+            exports, str(tmp_path / "reports"), top=5, workers=2, memory_limit=8 << 30
+        )
+    )
+    assert sorted(result.user for result in written) == ["alice", "bob"]
+    for result in written:
+        assert result.error is None
+        assert result.paths == [tmp_path / "reports" / result.user / "report.json"]
+        with open(result.paths[0]) as file:
+            assert "all_time" in json.load(file)
+
+
+def test_analyse_users_reports_failures_per_user(tmp_path):
+    make_exports(tmp_path / "exports")
+    (tmp_path / "exports" / "carol.json").write_text("[]")
+    (tmp_path / "exports" / "dave.json").write_text('[{"ts": "2024-01-01T00:00:00Z"}]')
+    exports = batch.find_user_exports(str(tmp_path / "exports"))
+    results = {
+        result.user: result
+        for result in batch.analyse_users(exports, str(tmp_path / "reports"), workers=1)
+    }
+    assert sorted(results) == ["alice", "bob", "carol", "dave"]
+    assert results["alice"].error is None
+    assert results["bob"].error is None
+    assert results["carol"].error is None
+    assert results["carol"].plays == 0
+    assert results["dave"].error.startswith("KeyError")
+    with open(results["carol"].paths[0]) as file:
+        report = json.load(file)
+    assert list(report) == ["all_time"]
+    assert all(table == [] for table in report["all_time"].values())
@@ -0,0 +1,39 @@
+import json
+
+import spotify_crapped.benchmark as benchmark
+import spotify_crapped.spotify_crapped as spotify_crapped
+
+
+def test_generate_listening_history_json(tmp_path):
+    path = tmp_path / "listening_history.json"
+    benchmark.generate_listening_history_json(str(path), 1000, podcast_share=0.1)
+    assert ",\n]" in path.read_text()
+    with open(path) as file:
+        assert json.loads(
+            spotify_crapped.TRAILING_COMMA_PATTERN.sub(r"\1", file.read())
+        )
+    listening_history = spotify_crapped.read_listening_history_json(str(path))
+    assert len(listening_history) == 1000
+    assert list(listening_history.columns) == benchmark.EXPORT_FIELDS
+    assert listening_history["ts"].is_monotonic_increasing
+    assert listening_history["episode_name"].notna().any()
+    songs = spotify_crapped.clean_listening_history(listening_history)
+    assert len(songs) == listening_history["master_metadata_track_name"].notna().sum()
+    artist_counts = songs["master_metadata_album_artist_name"].value_counts()
+    assert artist_counts.index[0] == "Artist 0"
+
+
+def test_compare_with_baseline():
+    baseline = {
+        "read": {"seconds": 1.0, "peak_bytes": 100},
+        "filter": {"seconds": 0.001, "peak_bytes": 100},
+    }
+    results = {
+        "read": {"seconds": 2.0, "peak_bytes": 100},
+        "filter": {"seconds": 0.002, "peak_bytes": 200},
+        "new": {"seconds": 1.0, "peak_bytes": 100},
+    }
+    assert benchmark.compare_with_baseline(results, baseline) == {
+        "read": {"seconds": 2.0},
+        "filter": {"peak_bytes": 2.0},
+    }
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+import spotify_crapped.benchmark as benchmark
+import spotify_crapped.sketches as sketches
+import spotify_crapped.spotify_crapped as spotify_crapped
+
+
+def test_count_min_sketch():
+    rng = np.random.default_rng(0)
+    keys = rng.zipf(1.3, 20000).astype(np.uint64)
+    first = sketches.CountMinSketch.from_error(epsilon=0.01, delta=0.01)
+    second = sketches.CountMinSketch.from_error(epsilon=0.01, delta=0.01)
+    first.add(keys[:10000])
+    second.add(keys[10000:])
+    first.merge(second)
+    unique_keys, true_counts = np.unique(keys, return_counts=True)
+    estimates = first.estimate(unique_keys)
+    assert first.total == len(keys)
+    assert (estimates >= true_counts).all()
+    assert np.mean(estimates - true_counts <= first.epsilon * first.total) >= 0.99
+
+
+def test_space_saving():
+    rng = np.random.default_rng(0)
+    keys = rng.zipf(1.3, 20000).astype(np.uint64)
+    summary = sketches.SpaceSaving(50)
+    for chunk in np.array_split(keys, 7):
+        part = sketches.SpaceSaving(50)
+        part.add(chunk)
+        summary.merge(part)
+    unique_keys, true_counts = np.unique(keys, return_counts=True)
+    true_counts = dict(zip(unique_keys, true_counts))
+    assert len(summary.counters) <= 50
+    assert summary.error_bound <= len(keys) / 51
+    for key, count in summary.counters["count"].items():
+        assert count <= true_counts[key] <= count + summary.error_bound
+    for key, count in true_counts.items():
+        if key not in summary.counters.index:
+            assert count <= summary.error_bound
+
+
+def test_track_sketch(tmp_path):
+    paths = [str(tmp_path / "first.json"), str(tmp_path / "second.json")]
+    for seed, path in enumerate(paths):
+        benchmark.generate_listening_history_json(path, 5000, seed=seed)
+    sketch = sketches.sketch_listening_history_paths(
+        paths, epsilon=0.01, chunk_rows=1000, workers=1
+    )
+    listening_history = spotify_crapped.clean_listening_history(
+        spotify_crapped.merge_histories_by_time(
+            *[spotify_crapped.read_listening_history_json(path) for path in paths]
+        )
+    )
+    true_counts = listening_history.groupby(
+        ["master_metadata_track_name", "master_metadata_album_artist_name"]
+    ).size()
+    top = sketch.top(5)
+    assert sketch.total == len(listening_history)
+    assert top.attrs["total_plays"] == len(listening_history)
+    assert top.attrs["max_error"] <= 0.01 * len(listening_history)
+    assert (top["play_count_lower"] <= top["play_count"]).all()
+    assert (top["play_count"] <= top["play_count_upper"]).all()
+    for song in top.itertuples():
+        true_count = true_counts[
+            (song.master_metadata_track_name, song.master_metadata_album_artist_name)
+        ]
+        assert song.play_count_lower <= true_count <= song.play_count_upper
+    assert top["master_metadata_track_name"].iloc[0] == true_counts.idxmax()[0]
+
+
+def test_track_sketch_matches_top_songs_across_uris():
+    raw_history = benchmark.generate_listening_history(5000, artists=20, seed=0)
+    # Every other play of each song is of a second release with its own URI
+    raw_history["spotify_track_uri"] = raw_history["spotify_track_uri"].where(
+        raw_history.index % 2 == 0,
+        raw_history["spotify_track_uri"].str.replace(
+            "spotify:track:", "spotify:track:single-", regex=False
+        ),
+    )
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(raw_history)
+    sketch = sketches.TrackSketch(epsilon=1e-3)
+    sketch.add_history(spotify_crapped.clean_listening_history(raw_history))
+    exact = lh.get_top_songs_by_count(10)
+    top = sketch.top(10)
+    assert top.attrs["max_error"] == 0
+    fields = list(exact.columns)
+    assert not exact.duplicated(fields[1:3]).any()
+    pd.testing.assert_frame_equal(
+        top[fields].sort_values(fields).reset_index(drop=True),
+        exact.sort_values(fields).reset_index(drop=True),
+        check_dtype=False,
+    )
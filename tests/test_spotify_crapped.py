@@ -1,5 +1,7 @@
+import json
 import pathlib
 
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -189,6 +191,100 @@ def test_read_listening_history_json():
     assert len(listening_history) == 23
 
 
+def test_read_listening_history_json_repairs_trailing_commas(tmp_path):
+    path = tmp_path / "trailing_commas.json"
+    path.write_text(
+        '[\n  {"ts": "2024-09-11T17:23:46Z", "ms_played": 1,\n  },\n'
+        '  {"ts": "2024-09-11T17:25:50Z", "skipped": true,  \n  },\n]',
+        encoding="UTF-8",
+    )
+    for chunk_size in [1, 7, 1 << 16]:
+        listening_history = spotify_crapped.read_listening_history_json(
+            path, chunk_size=chunk_size
+        )
+        assert list(listening_history["ts"]) == [
+            "2024-09-11T17:23:46Z",
+            "2024-09-11T17:25:50Z",
+        ]
+        assert listening_history["ms_played"].iloc[0] == 1
+        assert pd.isna(listening_history["ms_played"].iloc[1])
+        assert listening_history["skipped"].iloc[1] == True
+
+
+def test_read_listening_history_json_raises_on_malformed_record(tmp_path):
+    path = tmp_path / "malformed.json"
+    records = [
+        {"ts": "2024-09-11T17:23:46Z", "ms_played": index} for index in range(100)
+    ]
+    text = json.dumps(records)
+    malformed_at = text.index('"ms_played"', 100)
+    path.write_text(text[:malformed_at] + '"ms_played" 1' + text[malformed_at + 11 :])
+    for chunk_size in [7, 1 << 16]:
+        with pytest.raises(
+            json.JSONDecodeError, match=f"at character {malformed_at + 12} of"
+        ):
+            spotify_crapped.read_listening_history_json(
+                str(path), chunk_size=chunk_size
+            )
+
+
+def test_read_listening_history_json_columns():
+    path = pathlib.Path(__file__).parent / "data" / "test_data.json"
+    listening_history = spotify_crapped.read_listening_history_json(
+        path, columns=["ts", "ms_played"], chunk_size=100
+    )
+    assert list(listening_history.columns) == ["ts", "ms_played"]
+    assert len(listening_history) == 23
+
+
+def test_iter_listening_history_chunks():
+    path = pathlib.Path(__file__).parent / "data" / "test_data.json"
+    chunks = list(spotify_crapped.iter_listening_history_chunks(path, chunk_rows=4))
+    assert [len(chunk) for chunk in chunks[:-1]] == [4] * (len(chunks) - 1)
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True),
+        spotify_crapped.read_listening_history_json(path),
+    )
+
+
+def test_convert_timestamps_to_datetime():
+    timestamps = [
+        "2023-01-31T12:34:56Z",
+        "2024-02-29T00:00:00Z",
+        None,
+        "1969-12-31T23:59:59Z",
+    ]
+    listening_history = pd.DataFrame({"ts": timestamps})
+    original = listening_history.copy()
+    converted = spotify_crapped.convert_timestamps_to_datetime(listening_history)
+    pd.testing.assert_frame_equal(listening_history, original)
+    pd.testing.assert_series_equal(
+        converted["ts"],
+        pd.Series(
+            pd.to_datetime(timestamps, format="%Y-%m-%dT%H:%M:%SZ"), name="ts"
+        ).astype("datetime64[us]"),
+    )
+    for malformed in ["2023-02-29T00:00:00Z", "2023-01-31 12:34:56Z"]:
+        with pytest.raises(ValueError):
+            spotify_crapped.decode_timestamps([malformed])
+    path = pathlib.Path(__file__).parent / "data" / "test_data.json"
+    parsed = spotify_crapped.read_listening_history_json(path, parse_timestamps=True)
+    raw = spotify_crapped.read_listening_history_json(path)
+    pd.testing.assert_series_equal(
+        parsed["ts"], spotify_crapped.convert_timestamps_to_datetime(raw)["ts"]
+    )
+
+
+def test_load_listening_history_from_cache(tmp_path):
+    path = pathlib.Path(__file__).parent / "data" / "test_data.json"
+    uncached = spotify_crapped.load_listening_history(path)
+    stored = spotify_crapped.load_listening_history(path, cache_dir=tmp_path)
+    assert spotify_crapped.get_cache_entry_path(tmp_path, path).is_dir()
+    cached = spotify_crapped.load_listening_history(path, cache_dir=tmp_path)
+    pd.testing.assert_frame_equal(stored, uncached)
+    pd.testing.assert_frame_equal(cached, uncached)
+
+
 def test_load_playlist_from_csv():
     path = pathlib.Path(__file__).parent / "data" / "deep_sleep.csv"
     playlist = spotify_crapped.read_playlist_from_csv(path)
@@ -200,6 +296,13 @@ def test_remove_secondary_artists_from_playlist(mock_dirty_playlist):
         spotify_crapped.rename_playlist_fields(mock_dirty_playlist)
     )
     assert playlist.iloc[1]["master_metadata_album_artist_name"] == "playlist_artist_2"
+    assert mock_dirty_playlist.iloc[1]["Artist Name(s)"] == (
+        "playlist_artist_2, secondary_artist"
+    )
+    assert np.shares_memory(
+        playlist["master_metadata_track_name"].to_numpy(),
+        mock_dirty_playlist["Track Name"].to_numpy(),
+    )
 
 
 def test_rename_playlist_fields(mock_dirty_playlist):
@@ -235,6 +338,86 @@ def test_remove_non_songs(mock_mixed_listening_history, mock_listening_history):
     assert len(lh.listening_history) == len(mock_listening_history)
 
 
+def test_filter_playlist_from_history_by_track_id(
+    mock_clean_playlist, mock_listening_history
+):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    by_name = spotify_crapped.filter_playlist_from_history(
+        lh.listening_history, mock_clean_playlist
+    )
+    by_track_id = spotify_crapped.filter_playlist_from_history(
+        lh.listening_history, mock_clean_playlist, lh.catalog
+    )
+    assert list(by_track_id) == list(by_name)
+
+
+def test_playlist_exclusion_index(mock_clean_playlist, mock_listening_history):
+    other_playlist = pd.DataFrame(
+        [
+            {
+                "master_metadata_track_name": "track_7",
+                "master_metadata_album_artist_name": "artist_4",
+            }
+        ]
+    )
+    exclusion_index = spotify_crapped.PlaylistExclusionIndex(
+        [pd.concat([mock_clean_playlist] * 3), other_playlist]
+    )
+    assert len(exclusion_index) == 3
+    history = mock_listening_history.set_axis(
+        range(100, 100 + len(mock_listening_history)), axis=0
+    )
+    playlist_filter = spotify_crapped.filter_playlist_from_history(
+        history, exclusion_index
+    )
+    assert list(playlist_filter.index) == list(history.index)
+    assert (~playlist_filter).sum() == 3
+
+
+def test_playlist_exclusion_index_from_csvs():
+    path = pathlib.Path(__file__).parent / "data" / "deep_sleep.csv"
+    playlist = spotify_crapped.read_playlist_from_csv(path)
+    exclusion_index = spotify_crapped.PlaylistExclusionIndex.from_csvs([path, path])
+    assert exclusion_index.contains(
+        playlist["master_metadata_track_name"],
+        playlist["master_metadata_album_artist_name"],
+    ).all()
+    assert (
+        exclusion_index.contains(
+            ["not_a_track"], ["not_an_artist"], ["spotify:track:0"]
+        ).sum()
+        == 0
+    )
+    assert exclusion_index.contains(
+        ["not_a_track"], ["not_an_artist"], playlist["spotify_track_uri"][:1]
+    ).all()
+
+
+def test_filter_by_song_title(mock_listening_history):
+    mock_listening_history.loc[0, "master_metadata_track_name"] = "Track (Remix)"
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    title_filter = spotify_crapped.filter_by_song_title(lh.listening_history, "K (rEm")
+    assert list(title_filter[title_filter].index) == [0]
+    catalog_filter = spotify_crapped.filter_by_song_title(
+        lh.listening_history, "K (rEm", lh.catalog
+    )
+    pd.testing.assert_series_equal(catalog_filter, title_filter)
+    assert len(lh.search_song_title("track_")) == len(mock_listening_history) - 1
+    assert len(lh.search_song_title("x")) == 1
+    assert len(lh.search_song_title("not a track")) == 0
+
+
+def test_title_search_index():
+    index = spotify_crapped.TitleSearchIndex(["Hello World", None, "world peace"])
+    index.extend(["WORLDS"])
+    assert list(index.search("WORLD")) == [0, 2, 3]
+    assert list(index.search("o w")) == [0]
+    assert list(index.search("")) == [0, 1, 2, 3]
+    assert list(index.search("Peaces")) == []
+
+
 def test_filter_by_artists(mock_listening_history):
     lh = spotify_crapped.ListeningHistory()
     lh.add_history(mock_listening_history)
@@ -263,6 +446,12 @@ def test_filter_by_years(mock_listening_history):
     lh = spotify_crapped.ListeningHistory()
     lh.add_history(mock_listening_history)
     years_filter = spotify_crapped.filter_by_years(lh.listening_history, [2024])
+    pd.testing.assert_series_equal(
+        spotify_crapped.filter_by_years(
+            lh.listening_history, [2024, 2021], lh.time_index
+        ),
+        years_filter,
+    )
     lh.add_filter(years_filter)
     assert len(lh.filtered_history) == len(mock_listening_history) - 1
     lh.reset_filters()
@@ -271,6 +460,130 @@ def test_filter_by_years(mock_listening_history):
     assert len(lh.filtered_history) == 0
 
 
+def test_filter_by_date_range(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    date_filter = spotify_crapped.filter_by_date_range(
+        lh.listening_history, "2024-09-01", "2024-10-01"
+    )
+    assert date_filter.sum() == 8
+    pd.testing.assert_series_equal(
+        spotify_crapped.filter_by_date_range(
+            lh.listening_history, "2024-09-01", "2024-10-01", lh.time_index
+        ),
+        date_filter,
+    )
+    lh.add_filter(spotify_crapped.DateRangeFilter(end="2024-09-01"))
+    assert len(lh.filtered_history) == 2
+    assert lh.filtered_history.equals(lh.listening_history.iloc[:2])
+
+
+def test_time_index_selects_ranges(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history.iloc[:5])
+    lh.add_history(mock_listening_history.iloc[5:])
+    assert lh.listening_history["ts"].is_monotonic_increasing
+    assert sorted(lh.listening_history.index) == list(range(11))
+    time_index = lh.time_index
+    assert time_index.year_ranges([2024]) == [(1, 11)]
+    assert time_index.year_ranges([2022, 2023, 2024]) == [(0, 11)]
+    assert time_index.row_range("2024-09-11", "2024-09-12") == (2, 10)
+    assert time_index.row_range("2025-01-01") == (11, 11)
+    filters = [
+        spotify_crapped.YearsFilter([2024]),
+        spotify_crapped.DateRangeFilter("2024-09-01"),
+        spotify_crapped.NotSkippedFilter(),
+    ]
+    for f in filters:
+        lh.add_filter(f)
+    expected = lh.listening_history[
+        spotify_crapped.filter_by_years(lh.listening_history, [2024])
+        & spotify_crapped.filter_by_date_range(lh.listening_history, "2024-09-01")
+        & spotify_crapped.filter_by_not_skipped(lh.listening_history)
+    ]
+    assert lh.filtered_history.equals(expected)
+
+
+def test_filters_apply_to_added_history(mock_clean_playlist, mock_listening_history):
+    filters = [
+        spotify_crapped.NotSkippedFilter(),
+        spotify_crapped.YearsFilter([2024]),
+        spotify_crapped.ArtistsFilter(["artist_1", "artist_3", "playlist_artist_1"]),
+        spotify_crapped.PlaylistFilter(mock_clean_playlist),
+        spotify_crapped.SongTitleFilter("TRACK"),
+    ]
+    lh = spotify_crapped.ListeningHistory()
+    for f in filters:
+        lh.add_filter(f)
+    lh.add_history(mock_listening_history)
+    assert len(lh.filtered_history) == 6
+    lh.add_history(mock_listening_history)
+    assert len(lh.filtered_history) == 12
+    without_ids = lh.listening_history.drop(
+        columns=["track_id", "artist_id", "album_id"]
+    )
+    for f in filters:
+        assert list(f(lh.listening_history, lh.catalog)) == list(f(without_ids))
+
+
+def test_precomputed_conditions_exclude_added_history(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    lh.add_filter(spotify_crapped.filter_by_not_skipped(lh.listening_history))
+    not_skipped = list(lh.filtered_history.index)
+    assert len(not_skipped) == len(mock_listening_history) - 1
+    lh.add_history(mock_listening_history)
+    assert list(lh.filtered_history.index) == not_skipped
+    lh.add_filter(spotify_crapped.YearsFilter([2023, 2024]))
+    assert list(lh.filtered_history.index) == not_skipped
+    recomputed = spotify_crapped.ListeningHistory()
+    recomputed.add_history(mock_listening_history)
+    recomputed.add_history(mock_listening_history)
+    for f in lh.filters:
+        recomputed.add_filter(f)
+    assert list(recomputed.filtered_history.index) == not_skipped
+
+
+class CountingFilter(spotify_crapped.NotSkippedFilter):
+    """Filter that counts the rows it's evaluated on"""
+
+    def __init__(self):
+        self.evaluated_rows = 0
+
+    def evaluate(self, listening_history, catalog=None):
+        self.evaluated_rows += len(listening_history)
+        return super().evaluate(listening_history, catalog)
+
+
+def test_filters_only_evaluate_new_rows(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    counting_filter = CountingFilter()
+    lh.add_filter(counting_filter)
+    assert len(lh.filtered_history) == len(mock_listening_history) - 1
+    lh.add_history(mock_listening_history.iloc[:3])
+    assert len(lh.filtered_history) == len(mock_listening_history) + 2
+    assert counting_filter.evaluated_rows == len(mock_listening_history) + 3
+    lh.add_filter(spotify_crapped.YearsFilter([2023]))
+    assert len(lh.filtered_history) == 1
+    assert counting_filter.evaluated_rows == len(mock_listening_history) + 3
+    assert list(lh.filtered_history.index) == list(
+        spotify_crapped.apply_filters(lh.listening_history, lh.filters).index
+    )
+
+
+def test_plan_filters_orders_by_cost_per_removed_row(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(pd.concat([mock_listening_history] * 200, ignore_index=True))
+    keeps_all = spotify_crapped.YearsFilter([2023, 2024])
+    keeps_few = spotify_crapped.ArtistsFilter(["artist_4"])
+    keeps_most = spotify_crapped.NotSkippedFilter()
+    plan = spotify_crapped.plan_filters(
+        lh.listening_history, [keeps_all, keeps_most, keeps_few], lh.catalog
+    )
+    assert plan == [keeps_few, keeps_most, keeps_all]
+
+
 # ███████  ██████  ██████  ████████     ████████ ███████ ███████ ████████ ███████
 # ██      ██    ██ ██   ██    ██           ██    ██      ██         ██    ██
 # ███████ ██    ██ ██████     ██           ██    █████   ███████    ██    ███████
@@ -303,6 +616,327 @@ def test_get_top_albums(mock_listening_history):
     assert top_albums.iloc[0]["play_count"] == 3
 
 
+def test_catalog_interns_ids(mock_listening_history):
+    catalog = spotify_crapped.Catalog()
+    lh = spotify_crapped.ListeningHistory(catalog=catalog)
+    lh.add_history(mock_listening_history)
+    other_lh = spotify_crapped.ListeningHistory(catalog=catalog)
+    other_lh.add_history(mock_listening_history.iloc[[3]])
+    history = lh.listening_history
+    assert catalog.track_count == 10
+    assert catalog.artist_count == 6
+    assert other_lh.listening_history["track_id"].iloc[0] == history["track_id"].iloc[3]
+    track_ids = history["track_id"].to_numpy()
+    assert list(catalog.track_names[track_ids]) == list(
+        history["master_metadata_track_name"]
+    )
+    assert list(catalog.artist_names[history["artist_id"]]) == list(
+        history["master_metadata_album_artist_name"]
+    )
+
+
+def test_catalog_keys_tracks_by_uri(mock_listening_history):
+    mock_listening_history["spotify_track_uri"] = [
+        f"spotify:track:{i % 2}" for i in range(len(mock_listening_history))
+    ]
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    assert lh.catalog.track_count == 2
+    top_songs = lh.get_top_songs_by_count()
+    assert top_songs.iloc[0]["master_metadata_track_name"] == "track_1"
+    assert top_songs.iloc[0]["play_count"] == 6
+
+
+def test_catalog_keys_tracks_without_artist_or_uri():
+    catalog = spotify_crapped.Catalog()
+    history = catalog.intern(
+        pd.DataFrame(
+            {
+                "master_metadata_track_name": ["a", "b", "c", "d"],
+                "master_metadata_album_artist_name": [
+                    "artist_1",
+                    "artist_1",
+                    None,
+                    None,
+                ],
+                "master_metadata_album_album_name": ["album"] * 4,
+                "spotify_track_uri": ["spotify:track:a", None, None, None],
+            }
+        )
+    )
+    assert history["track_id"].tolist() == [0, 1, 2, 3]
+    assert list(catalog.track_names[history["track_id"]]) == ["a", "b", "c", "d"]
+
+
+def test_catalog_counts_songs_across_uris(mock_listening_history):
+    # track_1 by artist_1 is played once as a single and once as an album track
+    mock_listening_history["spotify_track_uri"] = [
+        f"spotify:track:{i}" for i in range(len(mock_listening_history))
+    ]
+    mock_listening_history.loc[7, "master_metadata_track_name"] = "track_1"
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    history = spotify_crapped.clean_listening_history(mock_listening_history)
+    assert lh.catalog.track_count == len(mock_listening_history)
+    top_songs = lh.get_top_songs_by_count()
+    assert top_songs.iloc[0]["master_metadata_track_name"] == "track_1"
+    assert top_songs.iloc[0]["master_metadata_album_artist_name"] == "artist_1"
+    assert top_songs.iloc[0]["play_count"] == 2
+    for with_catalog, without_catalog in [
+        (top_songs, spotify_crapped.sort_songs_by_play_count(history)),
+        (
+            spotify_crapped.sort_songs_by_playtime(lh.listening_history, lh.catalog),
+            spotify_crapped.sort_songs_by_playtime(history),
+        ),
+    ]:
+        # Songs tied on play count or playtime may be listed in either order
+        pd.testing.assert_frame_equal(
+            with_catalog.sort_values(list(with_catalog.columns)).reset_index(drop=True),
+            without_catalog.sort_values(list(without_catalog.columns)).reset_index(
+                drop=True
+            ),
+        )
+
+
+def test_aggregation_cache(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory(aggregation_cache_size=2)
+    lh.add_history(mock_listening_history)
+    top_songs = lh.get_top_songs_by_count()
+    top_songs["play_count"] = 0
+    assert lh.get_top_songs_by_count().iloc[0]["play_count"] == 2
+    assert lh.aggregation_cache_info() == (1, 1, 2, 1)
+    lh.get_top_albums_by_count()
+    lh.get_top_artists_by_count()
+    assert lh.aggregation_cache_info() == (1, 3, 2, 2)
+    lh.add_filter(spotify_crapped.ArtistsFilter(["artist_2"]))
+    assert lh.aggregation_cache_info().currsize == 0
+    assert lh.get_top_songs_by_count().iloc[0]["play_count"] == 1
+    assert lh.aggregation_cache_info() == (1, 4, 2, 1)
+
+
+def test_top_positions():
+    values = pd.Series([4, 1, 5, 4, 4]).to_numpy()
+    assert list(spotify_crapped.top_positions(values, 1)) == [2]
+    assert list(spotify_crapped.top_positions(values, 2)) == [0, 2, 3, 4]
+    assert list(spotify_crapped.top_positions(values)) == [0, 1, 2, 3, 4]
+    assert list(spotify_crapped.top_positions(values, 0)) == []
+
+
+def test_get_top_returns_ties(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    top_songs = lh.get_top_songs_by_count()
+    pd.testing.assert_frame_equal(
+        lh.get_top_songs_by_count(top=2), top_songs[top_songs["rank"] <= 2]
+    )
+    top_albums = lh.get_top_albums_by_count()
+    pd.testing.assert_frame_equal(
+        lh.get_top_albums_by_count(top=1), top_albums[top_albums["rank"] <= 1]
+    )
+    top_artists = lh.get_top_artists_by_count()
+    pd.testing.assert_series_equal(
+        lh.get_top_artists_by_count(top=1),
+        top_artists[top_artists.rank(ascending=False, method="min") <= 1],
+    )
+    top_playtime = lh.get_top_artists_by_playtime()
+    playtime_rank = top_playtime["Total Playtime"].rank(ascending=False, method="min")
+    pd.testing.assert_frame_equal(
+        lh.get_top_artists_by_playtime(top=2), top_playtime[playtime_rank <= 2]
+    )
+    pd.testing.assert_frame_equal(
+        spotify_crapped.sort_songs_by_play_count(lh.listening_history, top=2),
+        top_songs[top_songs["rank"] <= 2],
+    )
+
+
+def test_build_report_matches_top_lists(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    report = lh.get_report()
+    assert list(report) == ["all_time", "2023", "2024"]
+    assert list(report["2024"]) == list(spotify_crapped.REPORT_TABLES)
+    lh.add_filter(spotify_crapped.YearsFilter([2024]))
+    pd.testing.assert_series_equal(
+        report["2024"]["artists_by_count"], lh.get_top_artists_by_count()
+    )
+    pd.testing.assert_frame_equal(
+        report["2024"]["artists_by_playtime"], lh.get_top_artists_by_playtime()
+    )
+    pd.testing.assert_frame_equal(
+        report["2024"]["songs_by_count"], lh.get_top_songs_by_count()
+    )
+    pd.testing.assert_frame_equal(
+        report["2024"]["albums_by_count"], lh.get_top_albums_by_count()
+    )
+    songs_by_playtime = report["all_time"]["songs_by_playtime"]
+    assert songs_by_playtime.iloc[0]["master_metadata_track_name"] == "track_2"
+    assert songs_by_playtime["Total Playtime"].sum() == pd.Timedelta(
+        milliseconds=mock_listening_history["ms_played"].sum()
+    )
+
+
+def test_write_report(tmp_path, mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    report = lh.get_report(top=2)
+    (json_path,) = spotify_crapped.write_report(report, tmp_path / "json")
+    with open(json_path) as file:
+        json_report = json.load(file)
+    assert json_report["2023"]["artists_by_playtime"] == [
+        {"master_metadata_album_artist_name": "artist_2", "total_playtime_ms": 10}
+    ]
+    csv_paths = spotify_crapped.write_report(report, tmp_path / "csv", "csv")
+    assert len(csv_paths) == 3 * len(spotify_crapped.REPORT_TABLES)
+    songs = pd.read_csv(tmp_path / "csv" / "all_time_songs_by_count.csv")
+    assert list(songs.columns) == list(report["all_time"]["songs_by_count"].columns)
+    with pytest.raises(ValueError):
+        spotify_crapped.write_report(report, tmp_path, "xml")
+
+
+def test_sessions_and_streaks():
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(
+        pd.DataFrame(
+            {
+                "ts": [
+                    "2023-01-01T10:03:00Z",
+                    "2023-01-01T10:06:00Z",
+                    "2023-01-01T11:00:00Z",
+                    "2023-01-02T09:00:00Z",
+                    "2023-01-02T09:04:00Z",
+                    "2023-01-04T09:00:00Z",
+                ],
+                "ms_played": [180000, 180000, 60000, 240000, 240000, 1000],
+                "master_metadata_track_name": ["a", "b", "c", "a", "d", "e"],
+                "master_metadata_album_artist_name": [
+                    "artist_1",
+                    "artist_2",
+                    "artist_2",
+                    "artist_1",
+                    "artist_3",
+                    "artist_3",
+                ],
+                "master_metadata_album_album_name": ["album"] * 6,
+                "spotify_track_uri": [None] * 6,
+                "skipped": [False] * 6,
+            }
+        )
+    )
+    assert spotify_crapped.assign_sessions(lh.filtered_history).tolist() == [
+        0,
+        0,
+        1,
+        2,
+        2,
+        3,
+    ]
+    sessions = lh.get_sessions()
+    assert sessions["play_count"].tolist() == [2, 1, 2, 1]
+    assert sessions["duration"].iloc[0] == pd.Timedelta(minutes=6)
+    assert sessions["ms_played"].iloc[2] == 480000
+    assert lh.get_sessions(pd.Timedelta(hours=1))["play_count"].tolist() == [3, 2, 1]
+    assert lh.get_top_session_starting_artists(1).to_dict() == {"artist_1": 2}
+    streaks = lh.get_daily_streaks()
+    assert streaks["days"].tolist() == [2, 1]
+    longest = lh.get_longest_streak()
+    assert longest["days"] == 2
+    assert longest["end"] == pd.Timestamp("2023-01-02")
+
+
+def test_time_bins_update_incrementally(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    lh.add_filter(spotify_crapped.NotSkippedFilter())
+    time_bins = lh.time_bins
+    lh.add_history(mock_listening_history)
+    assert lh.time_bins is time_bins
+    filtered_history = lh.filtered_history
+    timestamps = filtered_history["ts"]
+    expected = filtered_history.groupby([timestamps.dt.dayofweek, timestamps.dt.hour])[
+        "ms_played"
+    ].agg(["size", "sum"])
+    by_hour_and_weekday = lh.get_plays_by_hour_and_weekday()
+    assert len(by_hour_and_weekday) == 7 * 24
+    assert by_hour_and_weekday["play_count"].sum() == len(filtered_history)
+    for (weekday, hour), (play_count, ms_played) in expected.iterrows():
+        assert by_hour_and_weekday.loc[(weekday, hour)].tolist() == [
+            play_count,
+            ms_played,
+        ]
+    by_month = lh.get_plays_by_month()
+    assert by_month["play_count"].sum() == len(filtered_history)
+    assert by_month.index[0] == timestamps.min().to_period("M").to_timestamp()
+    by_year = lh.get_plays_by_year()
+    expected = filtered_history.groupby(timestamps.dt.year)["ms_played"].sum()
+    assert by_year.loc[expected.index, "ms_played"].tolist() == expected.tolist()
+    lh.reset_filters()
+    assert lh.get_plays_by_year()["play_count"].sum() == len(lh.listening_history)
+
+
+def test_streaming_aggregates_match_listening_history():
+    data_dir = pathlib.Path(__file__).parent / "data"
+    paths = [data_dir / "test_data.json", data_dir / "test_data_2.json"]
+    filters = [spotify_crapped.NotSkippedFilter()]
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history_from_paths(paths, workers=1)
+    lh.add_filter(filters[0])
+    aggregates = spotify_crapped.aggregate_listening_history_paths(
+        paths, filters, chunk_rows=4, workers=1
+    )
+    assert aggregates.play_count == len(lh.filtered_history)
+    pd.testing.assert_series_equal(
+        aggregates.get_top_artists_by_count(), lh.get_top_artists_by_count()
+    )
+    for method in (
+        "get_top_artists_by_playtime",
+        "get_top_songs_by_count",
+        "get_top_albums_by_count",
+    ):
+        pd.testing.assert_frame_equal(
+            getattr(aggregates, method)(), getattr(lh, method)()
+        )
+
+
+def test_rollup_cube_matches_listening_history(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    rollup_lh = spotify_crapped.ListeningHistory(rollup=True)
+    for history in (lh, rollup_lh):
+        history.add_history(mock_listening_history.iloc[:6])
+        history.listening_history
+        history.add_history(mock_listening_history.iloc[6:])
+    assert len(rollup_lh.rollup_cube) < len(mock_listening_history)
+    for filters in (
+        [],
+        [spotify_crapped.YearsFilter([2024]), spotify_crapped.NotSkippedFilter()],
+        [spotify_crapped.DateRangeFilter("2024-09-01", "2024-10-01")],
+        [spotify_crapped.ArtistsFilter(["artist_1", "artist_2"])],
+        [spotify_crapped.DateRangeFilter("2024-09-11 12:00")],
+    ):
+        for history in (lh, rollup_lh):
+            history.reset_filters()
+            for f in filters:
+                history.add_filter(f)
+        pd.testing.assert_series_equal(
+            lh.get_top_artists_by_count(), rollup_lh.get_top_artists_by_count()
+        )
+        for method in (
+            "get_top_artists_by_playtime",
+            "get_top_songs_by_count",
+            "get_top_albums_by_count",
+        ):
+            pd.testing.assert_frame_equal(
+                getattr(lh, method)(), getattr(rollup_lh, method)()
+            )
+        report, rollup_report = lh.get_report(), rollup_lh.get_report()
+        assert list(report) == list(rollup_report)
+        for period, tables in report.items():
+            for name, table in tables.items():
+                if isinstance(table, pd.Series):
+                    pd.testing.assert_series_equal(table, rollup_report[period][name])
+                else:
+                    pd.testing.assert_frame_equal(table, rollup_report[period][name])
+
+
 #  ██████ ██       █████  ███████ ███████     ████████ ███████ ███████ ████████ ███████
 # ██      ██      ██   ██ ██      ██             ██    ██      ██         ██    ██
 # ██      ██      ███████ ███████ ███████        ██    █████   ███████    ██    ███████
@@ -316,6 +950,24 @@ def test_print_history(mock_listening_history):
     print(lh)
 
 
+def test_pretty_history_pages(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    filtered_history = lh.filtered_history
+    pretty_history = lh.pretty_history()
+    assert "Playtime (ms)" in pretty_history.columns
+    assert np.shares_memory(
+        pretty_history["Playtime (ms)"].to_numpy(),
+        filtered_history["ms_played"].to_numpy(),
+    )
+    pages = list(lh.iter_pretty_pages(page_size=2))
+    assert len(pages) == -(-len(filtered_history) // 2)
+    pd.testing.assert_frame_equal(pd.concat(pages), pretty_history)
+    pd.testing.assert_frame_equal(lh.pretty_history(page=1, page_size=2), pages[1])
+    pd.testing.assert_frame_equal(lh.pretty_history(page=-1, page_size=2), pages[-1])
+    assert lh.pretty_history(page=len(pages), page_size=2).empty
+
+
 def test_add_history_from_path():
     path = pathlib.Path(__file__).parent / "data" / "test_data.json"
     lh = spotify_crapped.ListeningHistory()
@@ -326,9 +978,128 @@ def test_add_history_from_path():
     assert len(lh.listening_history) == 26
 
 
+def test_add_history_from_paths():
+    data_dir = pathlib.Path(__file__).parent / "data"
+    paths = [data_dir / "test_data.json", data_dir / "test_data_2.json"]
+    serial = spotify_crapped.ListeningHistory()
+    serial.add_history_from_paths(paths, workers=1)
+    parallel = spotify_crapped.ListeningHistory()
+    parallel.add_history_from_paths(paths, workers=2)
+    assert len(parallel.listening_history) == 26
+    pd.testing.assert_frame_equal(parallel.listening_history, serial.listening_history)
+
+
 def test_add_history(mock_listening_history):
     lh = spotify_crapped.ListeningHistory()
     lh.add_history(mock_listening_history)
     assert len(lh.listening_history) == len(mock_listening_history)
     lh.add_history(mock_listening_history)
     assert len(lh.listening_history) == 2 * len(mock_listening_history)
+
+
+def test_empty_history(mock_listening_history):
+    expected = spotify_crapped.ListeningHistory()
+    expected.add_history(mock_listening_history)
+    for rollup, filters in [
+        (False, []),
+        (False, [spotify_crapped.NotSkippedFilter()]),
+        (True, [spotify_crapped.YearsFilter([2024])]),
+    ]:
+        for added in [[], [pd.DataFrame([])]]:
+            lh = spotify_crapped.ListeningHistory(rollup=rollup)
+            for new_history in added:
+                lh.add_history(new_history)
+            for f in filters:
+                lh.add_filter(f)
+            assert len(lh.filtered_history) == 0
+            assert len(lh.get_top_artists_by_count()) == 0
+            for getter in [
+                "get_top_artists_by_playtime",
+                "get_top_songs_by_count",
+                "get_top_albums_by_count",
+                "get_sessions",
+            ]:
+                result = getattr(lh, getter)()
+                assert len(result) == 0
+                assert list(result.columns) == list(getattr(expected, getter)().columns)
+            assert list(lh.get_report()) == ["all_time"]
+            assert lh.get_longest_streak()["days"] == 0
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(pd.DataFrame([]))
+    lh.add_history(mock_listening_history)
+    pd.testing.assert_frame_equal(
+        lh.get_top_songs_by_count(), expected.get_top_songs_by_count()
+    )
+
+
+def test_add_history_applies_schema(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory()
+    lh.add_history(mock_listening_history)
+    lh.add_history(mock_listening_history.iloc[:2])
+    for field, dtype in spotify_crapped.HISTORY_SCHEMA.items():
+        if field in lh.listening_history.columns:
+            assert lh.listening_history[field].dtype == dtype
+    memory_usage = lh.memory_usage()
+    assert memory_usage.loc["ms_played", "listening_history"] == 4 * len(
+        lh.listening_history
+    )
+
+
+def test_add_history_merges_lazily(mock_listening_history):
+    lh = spotify_crapped.ListeningHistory(profile=True)
+    for _ in range(3):
+        lh.add_history(mock_listening_history)
+    assert "concat_histories" not in lh.stats.summary().index
+    lh.add_filter(spotify_crapped.filter_by_not_skipped(lh.listening_history))
+    assert len(lh.listening_history) == 3 * len(mock_listening_history)
+    concatenated = lh.stats.summary().loc["concat_histories"]
+    assert concatenated["runs"] == 1
+    assert concatenated["rows_out"] == 3 * len(mock_listening_history)
+    assert len(lh.filtered_history) == 3 * (len(mock_listening_history) - 1)
+
+
+def test_add_history_deduplicates_overlapping_exports(mock_listening_history):
+    # The mock history repeats the same play, so only distinct plays are kept
+    distinct_plays = len(mock_listening_history.drop_duplicates())
+    lh = spotify_crapped.ListeningHistory(deduplicate=True)
+    lh.add_history(mock_listening_history.iloc[:7])
+    lh.add_history(mock_listening_history.iloc[4:])
+    assert len(lh.listening_history) == distinct_plays
+    assert lh.deduplicator.duplicate_count == 11 + 3 - distinct_plays
+    lh.add_history(mock_listening_history)
+    assert len(lh.listening_history) == distinct_plays
+    assert lh.get_top_artists_by_count().sum() == distinct_plays
+    nanosecond_history = mock_listening_history.assign(
+        ts=pd.to_datetime(mock_listening_history["ts"])
+        .dt.tz_localize(None)
+        .astype("datetime64[ns]")
+    )
+    lh.add_history(nanosecond_history)
+    assert len(lh.listening_history) == distinct_plays
+
+
+def test_profile_records_stages():
+    data_dir = pathlib.Path(__file__).parent / "data"
+    lh = spotify_crapped.ListeningHistory(profile=True)
+    assert spotify_crapped.ListeningHistory().stats is None
+    lh.add_history_from_paths(
+        [data_dir / "test_data.json", data_dir / "test_data_2.json"], workers=2
+    )
+    lh.add_filter(spotify_crapped.NotSkippedFilter())
+    lh.get_top_songs_by_count()
+    summary = lh.stats.summary()
+    for stage in (
+        "read_listening_history_json",
+        "repair_trailing_commas",
+        "remove_non_songs",
+        "decode_timestamps",
+        "convert_timestamps_to_datetime",
+        "concat_histories",
+        "apply_filters",
+        "aggregate_songs_by_count",
+    ):
+        assert stage in summary.index
+    assert summary.loc["read_listening_history_json", "runs"] == 2
+    assert summary.loc["apply_filters", "rows_in"] == len(lh.listening_history)
+    assert summary.loc["apply_filters", "rows_out"] == len(lh.filtered_history)
+    assert summary.loc["decode_timestamps", "allocated_bytes"] > 0